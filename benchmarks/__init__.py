@@ -0,0 +1 @@
+"""Offline benchmarks, run as modules: python -m benchmarks.<name>."""
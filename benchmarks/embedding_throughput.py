@@ -0,0 +1,79 @@
+"""
+benchmarks/embedding_throughput.py
+
+Measures the embedding throughput (chunks/second) of BatchedOllamaEmbeddings for
+several batch sizes and in-flight limits, against the local fake Ollama server so
+it runs offline and gives repeatable numbers.
+
+Usage:
+    python -m benchmarks.embedding_throughput --chunks 2000 --batch-sizes 1,16,64 \
+        --in-flight 1,4,8 --request-latency 0.02 --item-latency 0.002
+"""
+import argparse
+import json
+import time
+from typing import List
+
+from benchmarks.fake_ollama import FakeOllamaServer
+from src.embedding_engine import BatchedOllamaEmbeddings
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def make_chunks(count: int, size: int) -> List[str]:
+    """Builds distinct synthetic chunks of roughly the given size."""
+    filler = "lorem ipsum dolor sit amet " * (size // 27 + 1)
+    return [f"chunk {index}: {filler}"[:size] for index in range(count)]
+
+
+def main():
+    """Runs the benchmark and prints one JSON line per configuration."""
+    parser = argparse.ArgumentParser(description="Embedding throughput benchmark")
+    parser.add_argument("--chunks", type=int, default=1000)
+    parser.add_argument("--chunk-size", type=int, default=1200)
+    parser.add_argument("--batch-sizes", type=_int_list, default=[1, 16, 64])
+    parser.add_argument("--in-flight", type=_int_list, default=[1, 4, 8])
+    parser.add_argument("--request-latency", type=float, default=0.02,
+                        help="Simulated fixed cost of each request, in seconds")
+    parser.add_argument("--item-latency", type=float, default=0.002,
+                        help="Simulated cost of each embedded text, in seconds")
+    parser.add_argument("--parallel-slots", type=int, default=4,
+                        help="Requests the fake server processes in parallel")
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    chunks = make_chunks(args.chunks, args.chunk_size)
+    with FakeOllamaServer(
+        request_latency=args.request_latency,
+        item_latency=args.item_latency,
+        parallel_slots=args.parallel_slots,
+        failure_rate=args.failure_rate
+    ) as server:
+        for batch_size in args.batch_sizes:
+            for in_flight in args.in_flight:
+                embeddings = BatchedOllamaEmbeddings(
+                    "fake-embed",
+                    batch_size=batch_size,
+                    max_in_flight=in_flight,
+                    backoff_seconds=0.01,
+                    host=server.url
+                )
+                requests_before = server.requests
+                start = time.perf_counter()
+                vectors = embeddings.embed_documents(chunks)
+                elapsed = time.perf_counter() - start
+                assert len(vectors) == len(chunks)
+                print(json.dumps({
+                    "batch_size": batch_size,
+                    "max_in_flight": in_flight,
+                    "chunks": len(chunks),
+                    "requests": server.requests - requests_before,
+                    "seconds": round(elapsed, 4),
+                    "chunks_per_second": round(len(chunks) / elapsed, 2),
+                }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+benchmarks/faiss_index_eval.py
+
+Evaluates the FAISS index types of src/faiss_index.py against the exact flat index:
+recall@k, query latency and memory. By default it uses synthetic clustered vectors;
+with --index-dir it uses the vectors of a saved index (an index cache entry).
+
+Usage:
+    python -m benchmarks.faiss_index_eval --vectors 200000 --dimensions 768 \
+        --types flat,ivf,hnsw,ivfpq --k 10
+    python -m benchmarks.faiss_index_eval --index-dir .cache/index/<key>
+"""
+import argparse
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+from src.faiss_index import IndexOptions, build_index, exact_search, index_memory_bytes
+from src.settings import FAISS_INDEX_TYPES
+
+
+def synthetic_vectors(count: int, dimensions: int, clusters: int, seed: int) -> np.ndarray:
+    """Returns unit vectors grouped around random centers, like text embeddings."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimensions)).astype(np.float32)
+    labels = rng.integers(0, clusters, size=count)
+    vectors = centers[labels] + 0.5 * rng.standard_normal((count, dimensions)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def load_vectors(index_dir: str) -> np.ndarray:
+    """Returns the vectors of a saved flat index."""
+    index = faiss.read_index(os.path.join(index_dir, "index.faiss"))
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def main():
+    """Runs the evaluation and prints one JSON line per index type."""
+    parser = argparse.ArgumentParser(description="FAISS index type evaluation")
+    parser.add_argument("--index-dir", help="Use the vectors of a saved flat index")
+    parser.add_argument("--vectors", type=int, default=100_000)
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--clusters", type=int, default=256)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default=",".join(FAISS_INDEX_TYPES))
+    parser.add_argument("--nlist", type=int, default=0)
+    parser.add_argument("--pq-m", type=int, default=0)
+    parser.add_argument("--hnsw-m", type=int, default=32)
+    parser.add_argument("--nprobe", type=int, default=16)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.index_dir:
+        vectors = load_vectors(args.index_dir)
+    else:
+        vectors = synthetic_vectors(args.vectors, args.dimensions, args.clusters, args.seed)
+    rng = np.random.default_rng(args.seed + 1)
+    # Queries close to, but not equal to, indexed vectors
+    queries = vectors[rng.integers(0, len(vectors), size=args.queries)]
+    queries = queries + 0.05 * rng.standard_normal(queries.shape).astype(np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    truth = exact_search(vectors, queries, args.k)
+
+    for index_type in args.types.split(","):
+        options = IndexOptions(
+            index_type=index_type, nlist=args.nlist, pq_m=args.pq_m, hnsw_m=args.hnsw_m,
+            nprobe=args.nprobe, ef_search=args.ef_search
+        )
+        start = time.perf_counter()
+        index = build_index(vectors, options)
+        build_seconds = time.perf_counter() - start
+
+        latencies = []
+        found = np.empty_like(truth)
+        for position, query in enumerate(queries):
+            start = time.perf_counter()
+            _, ids = index.search(query[np.newaxis, :], args.k)
+            latencies.append(time.perf_counter() - start)
+            found[position] = ids[0]
+        recall = np.mean([
+            len(set(found[position]) & set(truth[position])) / args.k
+            for position in range(len(queries))
+        ])
+        latencies_ms = np.array(latencies) * 1000
+        print(json.dumps({
+            "index_type": index_type,
+            "built_as": type(index).__name__,
+            "vectors": int(index.ntotal),
+            "dimensions": int(vectors.shape[1]),
+            f"recall_at_{args.k}": round(float(recall), 4),
+            "latency_p50_ms": round(float(np.percentile(latencies_ms, 50)), 4),
+            "latency_p99_ms": round(float(np.percentile(latencies_ms, 99)), 4),
+            "memory_mb": round(index_memory_bytes(index) / 1024 ** 2, 2),
+            "build_seconds": round(build_seconds, 2),
+        }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
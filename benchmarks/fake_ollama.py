@@ -0,0 +1,279 @@
+"""
+benchmarks/fake_ollama.py
+
+A deterministic local stand-in for the Ollama HTTP API, used to benchmark the
+pipeline offline. Embeddings are derived from a hash of the input text, chat
+answers are words picked from a hash of the prompt, and the server can simulate
+request latency, per-token generation latency, the time to load a model on its
+first use, a limited number of parallel slots and transient failures. Pulled models
+are listed by /api/tags.
+
+Usage:
+    python -m benchmarks.fake_ollama --port 11435
+    OLLAMA_HOST=http://127.0.0.1:11435 python main.py
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Iterator, List
+
+DEFAULT_DIMENSIONS = 768
+DEFAULT_CHAT_TOKENS = 24
+
+_CHAT_WORDS = (
+    "el", "documento", "describe", "los", "resultados", "del", "proyecto", "con",
+    "datos", "de", "rendimiento", "y", "un", "resumen", "para", "cada", "sección",
+)
+
+
+def fake_embedding(text: str, dimensions: int = DEFAULT_DIMENSIONS) -> List[float]:
+    """Returns a unit vector that only depends on the text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    vector = [rng.gauss(0.0, 1.0) for _ in range(dimensions)]
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+def fake_answer_tokens(prompt: str, tokens: int = DEFAULT_CHAT_TOKENS) -> List[str]:
+    """Returns the tokens of a chat answer that only depends on the prompt."""
+    seed = int.from_bytes(hashlib.sha256(prompt.encode("utf-8")).digest()[:8], "big")
+    rng = random.Random(seed)
+    return [(" " if position else "") + rng.choice(_CHAT_WORDS) for position in range(tokens)]
+
+
+class FakeOllamaServer:
+    """Fake Ollama server running in a background thread."""
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        dimensions: int = DEFAULT_DIMENSIONS,
+        request_latency: float = 0.0,
+        item_latency: float = 0.0,
+        parallel_slots: int = 4,
+        failure_rate: float = 0.0,
+        chat_tokens: int = DEFAULT_CHAT_TOKENS,
+        token_latency: float = 0.0,
+        load_latency: float = 0.0
+    ):
+        self.dimensions = dimensions
+        self.request_latency = request_latency
+        self.item_latency = item_latency
+        self.chat_tokens = chat_tokens
+        self.token_latency = token_latency
+        self.failure_rate = failure_rate
+        self.load_latency = load_latency
+        self.requests = 0
+        self.pulls = 0
+        self._pulled = set()
+        self._loaded = set()
+        self._load_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(parallel_slots)
+        self._lock = threading.Lock()
+        self._rng = random.Random(0)
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Base URL of the server, suitable for OLLAMA_HOST."""
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FakeOllamaServer":
+        """Starts serving requests in a background thread."""
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the server."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FakeOllamaServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _should_fail(self) -> bool:
+        with self._lock:
+            self.requests += 1
+            return self._rng.random() < self.failure_rate
+
+    def _simulate_work(self, items: int) -> None:
+        # The semaphore models the number of requests Ollama processes in parallel
+        with self._slots:
+            time.sleep(self.request_latency + self.item_latency * items)
+
+    def _load(self, model: str) -> float:
+        """Loads a model on its first use, returning the load time in seconds."""
+        with self._load_lock:
+            if model in self._loaded:
+                return 0.0
+            time.sleep(self.load_latency)
+            self._loaded.add(model)
+            return self.load_latency
+
+    def _chat(self, body: dict):
+        messages = body.get("messages", [])
+        prompt = messages[-1].get("content", "") if messages else ""
+        tokens = fake_answer_tokens(prompt, self.chat_tokens)
+        model = body.get("model", "")
+        load_seconds = self._load(model)
+        final = {
+            "model": model,
+            "message": {"role": "assistant", "content": ""},
+            "done": True,
+            "done_reason": "stop",
+            "load_duration": int(load_seconds * 1e9),
+            "prompt_eval_count": len(prompt.split()),
+            "prompt_eval_duration": int(self.request_latency * 1e9),
+            "eval_count": len(tokens),
+        }
+
+        def stream() -> Iterator[dict]:
+            with self._slots:
+                time.sleep(self.request_latency)
+                for token in tokens:
+                    time.sleep(self.token_latency)
+                    yield {"model": model, "message": {"role": "assistant", "content": token},
+                           "done": False}
+            yield final
+
+        if body.get("stream", True):
+            return 200, stream()
+        self._simulate_work(0)
+        time.sleep(self.token_latency * len(tokens))
+        final["message"]["content"] = "".join(tokens)
+        return 200, final
+
+    def handle(self, path: str, body: dict):
+        """
+        Returns the (status, payload) of an API call. Streaming calls return an
+        iterator of payloads, sent as newline-delimited JSON.
+        """
+        if path == "/api/embed":
+            texts = body.get("input", [])
+            if isinstance(texts, str):
+                texts = [texts]
+            if self._should_fail():
+                return 503, {"error": "server busy"}
+            self._load(body.get("model", ""))
+            self._simulate_work(len(texts))
+            return 200, {
+                "model": body.get("model", ""),
+                "embeddings": [fake_embedding(text, self.dimensions) for text in texts],
+            }
+        if path == "/api/embeddings":
+            if self._should_fail():
+                return 503, {"error": "server busy"}
+            self._simulate_work(1)
+            return 200, {"embedding": fake_embedding(body.get("prompt", ""), self.dimensions)}
+        if path == "/api/chat":
+            if self._should_fail():
+                return 503, {"error": "server busy"}
+            return self._chat(body)
+        if path == "/api/generate":
+            # Requests without a prompt only load the model
+            load_seconds = self._load(body.get("model", ""))
+            return 200, {"model": body.get("model", ""), "response": "", "done": True,
+                         "load_duration": int(load_seconds * 1e9)}
+        if path == "/api/pull":
+            with self._lock:
+                self.pulls += 1
+                self._pulled.add(body.get("model", body.get("name", "")))
+            return 200, {"status": "success"}
+        if path == "/api/tags":
+            with self._lock:
+                models = [{"name": f"{name}:latest", "model": f"{name}:latest"}
+                          for name in sorted(self._pulled)]
+            return 200, {"models": models}
+        return 404, {"error": f"unknown endpoint {path}"}
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            """Request handler delegating to FakeOllamaServer.handle."""
+
+            protocol_version = "HTTP/1.1"
+
+            def _reply(self, status: int, payload) -> None:
+                if not isinstance(payload, dict):
+                    self._stream(status, payload)
+                    return
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _stream(self, status: int, payloads: Iterator[dict]) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for payload in payloads:
+                    line = json.dumps(payload).encode("utf-8") + b"\n"
+                    self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            def do_GET(self):  # pylint: disable=invalid-name
+                status, payload = server.handle(self.path, {})
+                self._reply(status, payload)
+
+            def do_POST(self):  # pylint: disable=invalid-name
+                length = int(self.headers.get("Content-Length", 0))
+                raw = self.rfile.read(length) if length else b"{}"
+                status, payload = server.handle(self.path, json.loads(raw or b"{}"))
+                self._reply(status, payload)
+
+            def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+                pass
+
+        return Handler
+
+
+def main():
+    """Runs the fake server in the foreground."""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[1])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--dimensions", type=int, default=DEFAULT_DIMENSIONS)
+    parser.add_argument("--request-latency", type=float, default=0.0)
+    parser.add_argument("--item-latency", type=float, default=0.0)
+    parser.add_argument("--parallel-slots", type=int, default=4)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--chat-tokens", type=int, default=DEFAULT_CHAT_TOKENS)
+    parser.add_argument("--token-latency", type=float, default=0.0)
+    parser.add_argument("--load-latency", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = FakeOllamaServer(
+        args.host, args.port, args.dimensions, args.request_latency,
+        args.item_latency, args.parallel_slots, args.failure_rate,
+        args.chat_tokens, args.token_latency, args.load_latency
+    )
+    print(f"Fake Ollama listening on {server.url}")
+    server.start()
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
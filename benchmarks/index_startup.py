@@ -0,0 +1,114 @@
+"""
+benchmarks/index_startup.py
+
+Compares the startup cost of the two ways of saving a vector database as the corpus
+grows: LangChain's pickled docstore (FAISS.save_local/load_local) and the memory-mapped
+index with the SQLite docstore of src/mmap_store.py. For each corpus size, a fresh
+process opens the saved index and runs one query; its load time, first query latency
+and RSS growth are reported.
+
+Usage:
+    python -m benchmarks.index_startup --sizes 10000,100000,500000 --dimensions 768
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import List
+
+import numpy as np
+import psutil
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from src.mmap_store import load_vector_db, save_vector_db
+
+LAYOUTS = ("pickle", "mmap")
+CHUNK_CHARS = 1200
+
+
+class RandomEmbeddings(Embeddings):
+    """Returns random vectors; the benchmark only measures loading and lookups."""
+
+    def __init__(self, dimensions: int):
+        self.dimensions = dimensions
+        self.rng = np.random.default_rng(0)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.rng.standard_normal(self.dimensions).astype(np.float32).tolist()
+
+
+def build_corpus(directory: str, size: int, dimensions: int) -> None:
+    """Saves a synthetic corpus of the given size in both layouts."""
+    rng = np.random.default_rng(size)
+    vectors = rng.standard_normal((size, dimensions)).astype(np.float32)
+    filler = "lorem ipsum " * (CHUNK_CHARS // 12)
+    text_embeddings = [(f"chunk {i} {filler}", vector) for i, vector in enumerate(vectors)]
+    metadatas = [{"source": f"doc{i % 100}.pdf", "page_number": i % 50} for i in range(size)]
+    vector_db = FAISS.from_embeddings(text_embeddings, RandomEmbeddings(dimensions),
+                                      metadatas=metadatas)
+    vector_db.save_local(os.path.join(directory, "pickle"))
+    save_vector_db(vector_db, os.path.join(directory, "mmap"))
+
+
+def measure(layout: str, directory: str, dimensions: int) -> dict:
+    """Opens a saved index and runs one query, in the current process."""
+    process = psutil.Process()
+    embeddings = RandomEmbeddings(dimensions)
+    rss_before = process.memory_info().rss
+    start = time.perf_counter()
+    if layout == "pickle":
+        vector_db = FAISS.load_local(directory, embeddings, allow_dangerous_deserialization=True)
+    else:
+        vector_db = load_vector_db(directory, embeddings)
+    load_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    vector_db.similarity_search("query", k=4)
+    query_seconds = time.perf_counter() - start
+    return {
+        "load_ms": round(load_seconds * 1000, 2),
+        "first_query_ms": round(query_seconds * 1000, 2),
+        "rss_growth_mb": round((process.memory_info().rss - rss_before) / 1024 ** 2, 2),
+    }
+
+
+def main():
+    """Runs the benchmark and prints one JSON line per corpus size and layout."""
+    parser = argparse.ArgumentParser(description="Saved index startup benchmark")
+    parser.add_argument("--sizes", default="10000,50000,200000")
+    parser.add_argument("--dimensions", type=int, default=768)
+    parser.add_argument("--child", nargs=2, metavar=("LAYOUT", "DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure(args.child[0], args.child[1], args.dimensions)))
+        return
+
+    for size in (int(value) for value in args.sizes.split(",")):
+        directory = tempfile.mkdtemp(prefix="index_startup.")
+        try:
+            build_corpus(directory, size, args.dimensions)
+            for layout in LAYOUTS:
+                # A fresh process so that neither RSS nor caches carry over between runs
+                output = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.index_startup",
+                     "--dimensions", str(args.dimensions),
+                     "--child", layout, os.path.join(directory, layout)],
+                    check=True, capture_output=True, text=True
+                ).stdout
+                result = {"chunks": size, "layout": layout}
+                result.update(json.loads(output.strip().splitlines()[-1]))
+                print(json.dumps(result), flush=True)
+        finally:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
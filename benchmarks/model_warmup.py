@@ -0,0 +1,103 @@
+"""
+benchmarks/model_warmup.py
+
+Cold and warm first-token latency of the pipeline against the fake Ollama server,
+which simulates the time Ollama takes to load a model on its first use. Each
+configuration starts a fresh fake server (no model loaded or pulled) and runs steps
+1 to 5 in a fresh process, once with the model warm-up (OLLAMA_WARMUP) and once
+without, then a second time against the same server to check that models already
+present are not pulled again.
+
+One JSON line is printed per run with the time to first token of the first query
+(cold unless the warm-up loaded the model) and of the following ones (warm), the
+warm-up timings and the number of pulls.
+
+Usage:
+    python -m benchmarks.model_warmup --load-latency 2 --questions 5
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Dict
+
+from benchmarks.fake_ollama import FakeOllamaServer
+
+
+def run_pipeline(config: Dict) -> Dict:
+    """Runs steps 1 to 5 in the current process and returns the query latencies."""
+    os.environ.update({
+        "OLLAMA_HOST": config["ollama_url"],
+        "OLLAMA_WARMUP": "true" if config["warmup"] else "false",
+        "PDF_BACKEND": config["pdf_backend"],
+        "INDEX_CACHE_DIR": "",
+        "EMBEDDING_CACHE_PATH": "",
+        "PARSE_CACHE_DIR": "",
+        "ANSWER_CACHE_PATH": "",
+        "TRACE_FILE": "",
+    })
+    # Imported here so that the Ollama client is created with the fake server URL
+    import main  # pylint: disable=import-outside-toplevel
+
+    settings = main.load_settings()
+    start = time.perf_counter()
+    pipeline = main.build_pipeline(config["pdf"], "fake-embed", "benchmark", "fake-llm",
+                                   settings)
+    setup_seconds = time.perf_counter() - start
+    questions = [f"Pregunta {index}: ¿de qué trata el documento?"
+                 for index in range(config["questions"])]
+    results = main.step_5_process_queries(pipeline.retriever, pipeline.llm, None, questions)
+    warm = [result["ttft_seconds"] for result in results[1:]]
+    return {
+        "setup_seconds": round(setup_seconds, 3),
+        "first_query_ttft_ms": round(results[0]["ttft_seconds"] * 1000, 1),
+        "first_query_cold_start": results[0].get("cold_start"),
+        "warm_ttft_ms_mean": round(sum(warm) / len(warm) * 1000, 1) if warm else None,
+        **{name: round(value, 3) for name, value in main.performance_data.items()
+           if name.startswith("warmup_")},
+    }
+
+
+def main():
+    """Runs the pipeline with and without warm-up and prints one JSON line per run."""
+    parser = argparse.ArgumentParser(description="Model warm-up benchmark")
+    parser.add_argument("--pdf", default="data/*.pdf")
+    parser.add_argument("--questions", type=int, default=5)
+    parser.add_argument("--load-latency", type=float, default=2.0)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--pdf-backend", default="fast")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_pipeline(json.loads(args.child))))
+        return
+
+    for warmup in (False, True):
+        with FakeOllamaServer(load_latency=args.load_latency,
+                              token_latency=args.token_latency) as server:
+            # The second run finds the models pulled and loaded by the first one
+            for run in ("first", "second"):
+                config = {
+                    "warmup": warmup,
+                    "questions": args.questions,
+                    "pdf": args.pdf,
+                    "pdf_backend": args.pdf_backend,
+                    "ollama_url": server.url,
+                }
+                pulls_before = server.pulls
+                completed = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.model_warmup",
+                     "--child", json.dumps(config)],
+                    check=True, capture_output=True, text=True
+                )
+                record = {"warmup": warmup, "run": run, "load_latency": args.load_latency}
+                record.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                record["pulls"] = server.pulls - pulls_before
+                print(json.dumps(record), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+benchmarks/pdf_backends.py
+
+Compares the PDF extraction backends of src/ingestion.py (pages/second and
+extracted characters) on the bundled PDFs or on the given files.
+
+Usage:
+    python -m benchmarks.pdf_backends data/doc1.pdf data/doc2.pdf --repeat 3
+"""
+import argparse
+import json
+import time
+
+import pikepdf
+
+from src.ingestion import load_pdf
+from src.settings import PDF_BACKENDS
+
+DEFAULT_FILES = ["data/doc1.pdf", "data/doc2.pdf"]
+
+
+def main():
+    """Runs the benchmark and prints one JSON line per file and backend."""
+    parser = argparse.ArgumentParser(description="PDF extraction backend benchmark")
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    parser.add_argument("--backends", default=",".join(PDF_BACKENDS))
+    parser.add_argument("--repeat", type=int, default=1,
+                        help="Runs per file and backend, the fastest one is reported")
+    args = parser.parse_args()
+
+    for file_path in args.files:
+        with pikepdf.open(file_path) as pdf:
+            pages = len(pdf.pages)
+        for backend in args.backends.split(","):
+            best = None
+            documents = None
+            for _ in range(max(1, args.repeat)):
+                start = time.perf_counter()
+                documents = load_pdf(file_path, backend)
+                elapsed = time.perf_counter() - start
+                best = elapsed if best is None else min(best, elapsed)
+            if documents is None:
+                print(json.dumps({"file": file_path, "backend": backend, "error": True}))
+                continue
+            fallback_pages = sum(
+                1 for document in documents
+                if document.metadata.get("extraction") == "unstructured"
+            )
+            print(json.dumps({
+                "file": file_path,
+                "backend": backend,
+                "pages": pages,
+                "seconds": round(best, 4),
+                "pages_per_second": round(pages / best, 2),
+                "characters": sum(len(document.page_content) for document in documents),
+                "fallback_pages": fallback_pages,
+            }), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+benchmarks/pipeline_suite.py
+
+Reproducible benchmark of the whole pipeline. Steps 1 to 5 of main.py run against the
+bundled PDFs and the deterministic fake Ollama server (chat and embeddings), for every
+combination of the swept parameters. Each configuration runs in a fresh process, with
+every cache disabled, so that the results (and the peak RSS) do not depend on the
+order of the runs.
+
+One JSON line is written per configuration with the ingestion throughput, the query
+latency percentiles and the peak RSS. With --baseline, each line also gets the
+relative change of those metrics against the matching line of a previous output, so
+two versions can be compared.
+
+Usage:
+    python -m benchmarks.pipeline_suite --chunk-sizes 600,1200 --batch-sizes 16,64 \
+        --concurrency 1,4 --output results.jsonl
+    python -m benchmarks.pipeline_suite --baseline results.jsonl
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+from benchmarks.fake_ollama import FakeOllamaServer
+
+# Metrics compared against the baseline; all of them are better when lower except
+# the throughputs
+COMPARED_METRICS = (
+    "ingestion_chunks_per_second",
+    "queries_per_second",
+    "query_p50_ms",
+    "query_p95_ms",
+    "query_p99_ms",
+    "peak_rss_mb",
+)
+CONFIG_KEYS = ("chunk_size", "batch_size", "concurrency")
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def peak_rss_mb(who: int) -> float:
+    """Returns the peak RSS reported by getrusage, in MB."""
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> Optional[str]:
+    """Returns the current commit of the repository, None outside of git."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], check=True,
+                              capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_configuration(config: Dict) -> Dict:
+    """Runs steps 1 to 5 with one configuration, in the current process."""
+    os.environ.update({
+        "OLLAMA_HOST": config["ollama_url"],
+        "PDF_BACKEND": config["pdf_backend"],
+        "PDF_WORKERS": str(config["pdf_workers"]),
+        "EMBED_BATCH_SIZE": str(config["batch_size"]),
+        "INDEX_CACHE_DIR": "",
+        "EMBEDDING_CACHE_PATH": "",
+        "PARSE_CACHE_DIR": "",
+        "ANSWER_CACHE_PATH": "",
+        "TRACE_FILE": "",
+    })
+    # Imported here so that the Ollama clients are created with the fake server URL
+    import main  # pylint: disable=import-outside-toplevel
+
+    settings = main.load_settings()
+    pdf_files = main.resolve_pdf_files(config["pdf"])
+    chunk_size = config["chunk_size"]
+
+    start = time.perf_counter()
+    chunks = main.step_1_load_and_split_pdf(
+        pdf_files, chunk_size, chunk_size // 4, settings.pdf_workers, settings.pdf_backend
+    )
+    vector_db = main.step_2_setup_vector_database(
+        chunks, "fake-embed", "benchmark", settings
+    )
+    ingestion_seconds = time.perf_counter() - start
+
+    llm = main.step_3_load_language_model("fake-llm")
+    retriever = main.step_4_setup_retrieval_system(vector_db, llm, settings)
+    questions = [f"Pregunta {index}: ¿qué dice el documento sobre el tema {index}?"
+                 for index in range(config["questions"])]
+    start = time.perf_counter()
+    results = main.step_5_process_queries(
+        retriever, llm, None, questions, config["concurrency"]
+    )
+    query_seconds = time.perf_counter() - start
+
+    latencies = [result["latency_seconds"] * 1000 for result in results]
+    ttfts = [result["ttft_seconds"] * 1000 for result in results]
+    return {
+        "chunks": len(chunks),
+        "ingestion_seconds": round(ingestion_seconds, 4),
+        "ingestion_chunks_per_second": round(len(chunks) / ingestion_seconds, 2),
+        "queries": len(results),
+        "queries_per_second": round(len(results) / query_seconds, 2),
+        "query_p50_ms": round(percentile(latencies, 0.50), 2),
+        "query_p95_ms": round(percentile(latencies, 0.95), 2),
+        "query_p99_ms": round(percentile(latencies, 0.99), 2),
+        "ttft_p50_ms": round(percentile(ttfts, 0.50), 2),
+        "peak_rss_mb": round(peak_rss_mb(resource.RUSAGE_SELF), 1),
+        "peak_rss_pdf_workers_mb": round(peak_rss_mb(resource.RUSAGE_CHILDREN), 1),
+    }
+
+
+def load_baseline(path: str) -> Dict[tuple, Dict]:
+    """Loads a previous output, keyed by configuration."""
+    baseline = {}
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                record = json.loads(line)
+                baseline[tuple(record[key] for key in CONFIG_KEYS)] = record
+    return baseline
+
+
+def compare(record: Dict, reference: Dict) -> Dict[str, float]:
+    """Returns the relative change of each compared metric against the reference."""
+    changes = {}
+    for metric in COMPARED_METRICS:
+        if reference.get(metric):
+            changes[metric] = round((record[metric] - reference[metric]) / reference[metric], 4)
+    return changes
+
+
+def main():
+    """Runs the sweep and writes one JSON line per configuration."""
+    parser = argparse.ArgumentParser(description="Pipeline benchmark suite")
+    parser.add_argument("--pdf", default="data/*.pdf")
+    parser.add_argument("--chunk-sizes", type=_int_list, default=[600, 1200])
+    parser.add_argument("--batch-sizes", type=_int_list, default=[16, 64])
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 4])
+    parser.add_argument("--questions", type=int, default=20)
+    parser.add_argument("--pdf-backend", default="fast")
+    parser.add_argument("--pdf-workers", type=int, default=2)
+    parser.add_argument("--request-latency", type=float, default=0.005)
+    parser.add_argument("--item-latency", type=float, default=0.001)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--parallel-slots", type=int, default=4)
+    parser.add_argument("--output", help="JSON lines file, standard output by default")
+    parser.add_argument("--baseline", help="Previous output to compare against")
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(run_configuration(json.loads(args.child))))
+        return
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    output = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    environment = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }
+    try:
+        with FakeOllamaServer(
+            request_latency=args.request_latency,
+            item_latency=args.item_latency,
+            token_latency=args.token_latency,
+            parallel_slots=args.parallel_slots
+        ) as server:
+            for chunk_size, batch_size, concurrency in itertools.product(
+                    args.chunk_sizes, args.batch_sizes, args.concurrency):
+                config = {
+                    "chunk_size": chunk_size,
+                    "batch_size": batch_size,
+                    "concurrency": concurrency,
+                    "questions": args.questions,
+                    "pdf": args.pdf,
+                    "pdf_backend": args.pdf_backend,
+                    "pdf_workers": args.pdf_workers,
+                    "ollama_url": server.url,
+                }
+                # A fresh process per configuration isolates the peak RSS and the
+                # module-level state of the pipeline
+                completed = subprocess.run(
+                    [sys.executable, "-m", "benchmarks.pipeline_suite",
+                     "--child", json.dumps(config)],
+                    check=True, capture_output=True, text=True
+                )
+                record = {key: config[key] for key in CONFIG_KEYS}
+                record.update(json.loads(completed.stdout.strip().splitlines()[-1]))
+                record.update(environment)
+                reference = baseline.get(tuple(record[key] for key in CONFIG_KEYS))
+                if reference is not None:
+                    record["change_vs_baseline"] = compare(record, reference)
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+benchmarks/query_server.py
+
+End-to-end check and load test of the query server (server.py) against the local
+fake Ollama server: the pipeline is set up once on the bundled PDFs, then concurrent
+/query requests are sent and their latency percentiles and throughput reported,
+together with the /health counters.
+
+Usage:
+    python -m benchmarks.query_server --requests 200 --concurrency 1,8,32 \
+        --token-latency 0.005
+"""
+import argparse
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+
+from benchmarks.fake_ollama import FakeOllamaServer
+
+
+def _int_list(value: str) -> List[int]:
+    return [int(item) for item in value.split(",") if item]
+
+
+def post_query(url: str, question: str) -> float:
+    """Sends a query and returns its latency in seconds."""
+    request = urllib.request.Request(
+        f"{url}/query",
+        data=json.dumps({"question": question}).encode("utf-8"),
+        headers={"Content-Type": "application/json"},
+    )
+    start = time.perf_counter()
+    with urllib.request.urlopen(request) as response:
+        payload = json.loads(response.read())
+    if "answer" not in payload:
+        raise RuntimeError(f"Unexpected response: {payload}")
+    return time.perf_counter() - start
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Returns the nearest-rank percentile of the values."""
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def main():
+    """Runs the benchmark and prints one JSON line per concurrency level."""
+    parser = argparse.ArgumentParser(description="Query server benchmark")
+    parser.add_argument("--pdf", default="data/*.pdf")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=_int_list, default=[1, 8])
+    parser.add_argument("--request-latency", type=float, default=0.01)
+    parser.add_argument("--token-latency", type=float, default=0.002)
+    parser.add_argument("--parallel-slots", type=int, default=4)
+    parser.add_argument("--pdf-backend", default="fast")
+    args = parser.parse_args()
+
+    with FakeOllamaServer(
+        request_latency=args.request_latency,
+        token_latency=args.token_latency,
+        parallel_slots=args.parallel_slots
+    ) as ollama_server, tempfile.TemporaryDirectory(prefix="query_server.") as cache_dir:
+        # The Ollama clients read OLLAMA_HOST when they are created, so the pipeline
+        # modules are only imported once the environment points at the fake server
+        os.environ.update({
+            "OLLAMA_HOST": ollama_server.url,
+            "PDF_BACKEND": args.pdf_backend,
+            "INDEX_CACHE_DIR": os.path.join(cache_dir, "index"),
+            "EMBEDDING_CACHE_PATH": "",
+            "PARSE_CACHE_DIR": "",
+            "ANSWER_CACHE_PATH": "",
+            "SERVER_MAX_CONCURRENCY": str(max(args.concurrency)),
+        })
+        server = importlib.import_module("server")
+        settings = importlib.import_module("src.settings").load_settings()
+
+        start = time.perf_counter()
+        pipeline = server.build_pipeline(args.pdf, "fake-embed", "benchmark", "fake-llm", settings)
+        service = server.QueryService(
+            pipeline, settings.server_max_concurrency, time.perf_counter() - start
+        )
+        httpd = server.make_server(service, "127.0.0.1", 0)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        url = "http://%s:%s" % httpd.server_address[:2]
+
+        try:
+            for concurrency in args.concurrency:
+                # Distinct questions so that no cache answers them
+                questions = [f"Pregunta {concurrency}-{index}: resume el documento"
+                             for index in range(args.requests)]
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                    latencies = list(executor.map(lambda q: post_query(url, q), questions))
+                elapsed = time.perf_counter() - start
+                with urllib.request.urlopen(f"{url}/health") as response:
+                    health = json.loads(response.read())
+                print(json.dumps({
+                    "concurrency": concurrency,
+                    "requests": len(questions),
+                    "startup_seconds": round(service.startup_seconds, 3),
+                    "queries_per_second": round(len(questions) / elapsed, 2),
+                    "latency_p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+                    "latency_p95_ms": round(percentile(latencies, 0.95) * 1000, 2),
+                    "latency_p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+                    "served_queries": health["queries"],
+                    "errors": health["errors"],
+                }), flush=True)
+        finally:
+            httpd.shutdown()
+            httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""
+benchmarks/startup_time.py
+
+Startup time budget of the entry points. Each module is imported in a fresh
+interpreter with ``python -X importtime``, and the cumulative import time reported
+by Python is checked against a budget. LangChain, Ollama, FAISS, NumPy, PyArrow, the
+PDF parsers, psutil and the Firebase Admin SDK are imported by the step that needs
+them, so importing the entry points must not load any of them.
+
+The script prints one JSON line per module with its import time and the slowest
+modules it pulled in, and exits with status 1 if a module exceeds the budget or
+imports one of the heavy dependencies, so it can be run in CI.
+
+Usage:
+    python -m benchmarks.startup_time
+    python -m benchmarks.startup_time --modules main,server --budget-ms 250 --repeat 5
+"""
+import argparse
+import json
+import re
+import subprocess
+import sys
+from typing import Dict, List, Tuple
+
+# Budget, in milliseconds, of the cumulative import time of each entry point. The
+# standard library, dotenv and the light modules of src/ fit in it comfortably; a
+# heavy dependency imported at module level does not.
+DEFAULT_BUDGET_MS = 250.0
+
+# Top-level packages that must only be imported by the step that uses them
+HEAVY_MODULES = (
+    "langchain",
+    "langchain_community",
+    "langchain_core",
+    "langchain_ollama",
+    "langchain_text_splitters",
+    "unstructured",
+    "ollama",
+    "firebase_admin",
+    "psutil",
+    "faiss",
+    "numpy",
+    "pyarrow",
+    "pdfplumber",
+    "pikepdf",
+)
+
+# "import time: self [us] | cumulative | imported package" lines of -X importtime
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+def measure_import(module: str) -> List[Tuple[str, int, int]]:
+    """
+    Imports a module in a fresh interpreter with -X importtime.
+
+    Returns:
+        List[Tuple[str, int, int]]: (module, self_us, cumulative_us) of every module
+        imported, in the order reported by Python.
+    """
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True, text=True, check=False
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{completed.stderr.strip()}")
+    imports = []
+    for line in completed.stderr.splitlines():
+        match = _IMPORT_TIME_LINE.match(line)
+        if match:
+            imports.append((match.group(4), int(match.group(1)), int(match.group(2))))
+    return imports
+
+
+def summarize(module: str, runs: List[List[Tuple[str, int, int]]], top: int) -> Dict:
+    """Returns the best import time of a module over several runs and its slowest imports."""
+    best = None
+    for imports in runs:
+        cumulative = next((cumulative for name, _, cumulative in imports if name == module), 0)
+        if best is None or cumulative < best[0]:
+            best = (cumulative, imports)
+    cumulative, imports = best
+    loaded = {name.split(".")[0] for name, _, _ in imports}
+    slowest = sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+    return {
+        "module": module,
+        "import_ms": round(cumulative / 1000, 2),
+        "modules_imported": len(imports),
+        "heavy_modules_imported": sorted(loaded.intersection(HEAVY_MODULES)),
+        "slowest_self_ms": {name: round(self_us / 1000, 2) for name, self_us, _ in slowest},
+    }
+
+
+def main():
+    """Measures the import time of the entry points and checks the budget."""
+    parser = argparse.ArgumentParser(description="Startup time budget")
+    parser.add_argument("--modules", default="main,server",
+                        help="Comma-separated modules to import")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Imports per module; the fastest one is reported")
+    parser.add_argument("--top", type=int, default=10,
+                        help="Number of slowest imports to report")
+    args = parser.parse_args()
+
+    failed = False
+    for module in [item for item in args.modules.split(",") if item]:
+        runs = [measure_import(module) for _ in range(max(1, args.repeat))]
+        record = summarize(module, runs, args.top)
+        record["budget_ms"] = args.budget_ms
+        record["within_budget"] = (record["import_ms"] <= args.budget_ms
+                                   and not record["heavy_modules_imported"])
+        failed = failed or not record["within_budget"]
+        print(json.dumps(record, ensure_ascii=False))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,25 +1,37 @@
+import asyncio
 import dataclasses
+import hashlib
+import json
 import logging
 import os
 import socket
 import sys
 import time
-from functools import wraps
-from typing import Callable, Dict, List, Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections.abc import AsyncIterator, Iterator, Sequence
+from typing import TYPE_CHECKING, Dict, List, Optional, Union
 
 from dotenv import load_dotenv
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from langchain_core.runnables import RunnablePassthrough
 
 from src.chunking import split_text
 from src.data import DataPayload, ModelInfo, SystemInfo, save_data
-from src.ingestion import load_pdf
-from src.model_loader import load_llm
-from src.prompt_template import get_query_prompt
-from src.retrieval import setup_retriever
+from src.index_cache import (corpus_fingerprint, has_index, load_cached_lexical_index,
+                             settings_fingerprint)
+from src.ingestion import load_pdfs, resolve_pdf_files
+from src.resource_monitor import ResourceUsage, sampled, set_sample_interval
+from src.results_sink import BackgroundWriter, create_sink
+from src.settings import DEFAULT_PDF_BACKEND, PipelineSettings, load_settings
+from src.tracing import JsonLinesExporter, propagate, span, traced, tracer
 from src.utils import obtener_info_equipo
-from src.vector_db import setup_vector_db
+
+# Modules importing LangChain, Ollama, FAISS, NumPy or PyArrow are imported by the
+# step that needs them, so that importing this module stays fast (see
+# benchmarks/startup_time.py) and a run only loads what it uses
+if TYPE_CHECKING:
+    from src.answer_cache import AnswerCache
+    from src.dedup import ChunkDeduplicator
+    from src.faiss_index import IndexOptions
+    from src.incremental_index import IndexUpdate
 
 # Constants
 DEFAULT_CHUNK_SIZE = 1200
@@ -33,120 +45,763 @@ class PerformanceData:
     """Represents performance data."""
     steps_times: Dict[str, float]
 
-# Global dictionary to store step times
+# Global dictionary to store step times and pipeline counters
 performance_data: Dict[str, float] = {}
 
+DEFAULT_QUESTIONS = (
+    "Genera un resumen del documento",
+    # "Dime el titulo del documento",
+)
+
+ANSWER_TEMPLATE = (
+    "Answer the question based ONLY on the following context: {context}\nQuestion: {question}")
+
+# Model load time above which Ollama loaded the model for the query (cold start)
+COLD_START_LOAD_SECONDS = 0.1
+
+# RAG chains built by get_rag_chain, keyed by the ids of their retriever and LLM
+_rag_chains: Dict[tuple, tuple] = {}
+
 class ProcessingError(Exception):
     """Custom exception for processing errors."""
 
-def timed_function(func: Callable) -> Callable:
+def build_pipeline_embeddings(embedding_model: str, settings: PipelineSettings):
+    """Creates the embeddings configured in the settings."""
+    from src.ollama_client import get_client, parse_keep_alive
+    from src.vector_db import build_embeddings
+
+    return build_embeddings(
+        embedding_model,
+        settings.embedding_cache_path or None,
+        settings.embedding_cache_max_entries,
+        settings.embed_batch_size,
+        settings.embed_max_in_flight,
+        settings.embed_max_retries,
+        get_client(pool_size=settings.ollama_pool_size),
+        parse_keep_alive(settings.ollama_keep_alive)
+    )
+
+def start_model_warmup(model_name: str, embedding_model: str,
+                       settings: PipelineSettings) -> Optional[Future]:
     """
-    Decorator to measure and log the execution time of a function and store it in steps_times.
+    Starts pulling (if missing) and loading the chat and embedding models in the
+    background, so that it overlaps with the PDF parsing. None if disabled.
+    """
+    if not settings.ollama_warmup:
+        return None
+    from src.ollama_client import get_client, parse_keep_alive, warm_up
+
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="warmup")
+    future = executor.submit(
+        propagate(warm_up),
+        model_name,
+        embedding_model,
+        parse_keep_alive(settings.ollama_keep_alive),
+        get_client(pool_size=settings.ollama_pool_size)
+    )
+    executor.shutdown(wait=False)
+    return future
+
+def finish_model_warmup(future: Optional[Future]) -> None:
+    """Waits for the model warm-up and stores its timings in performance_data."""
+    if future is None:
+        return
+    try:
+        performance_data.update(future.result())
+    except Exception as e:
+        # The models are then loaded by the first request, as without warm-up
+        logging.warning("Error warming up the Ollama models: %s", e)
+
+def build_index_options(settings: PipelineSettings) -> "IndexOptions":
+    """Creates the FAISS index options configured in the settings."""
+    from src.faiss_index import IndexOptions
 
-    Args:
-        func (Callable): The function to be timed.
+    return IndexOptions(
+        index_type=settings.faiss_index_type,
+        nlist=settings.faiss_nlist,
+        pq_m=settings.faiss_pq_m,
+        hnsw_m=settings.faiss_hnsw_m,
+        nprobe=settings.faiss_nprobe,
+        ef_search=settings.faiss_ef_search
+    )
+
+def build_index_params(settings: PipelineSettings) -> Dict[str, object]:
+    """Returns the parameters of the index built by step 2, for cache keys."""
+    params = build_index_options(settings).build_params()
+    if settings.index_shards > 1:
+        params = {**params, "shards": settings.index_shards, "shard_by": settings.shard_by}
+    return params
 
-    Returns:
-        Callable: The wrapped function.
+def answer_cache_version(cache_key: str, model_name: str, settings: PipelineSettings) -> str:
+    """
+    Returns the version of the cached answers: the indexed corpus, the language model
+    and every setting that changes how the answer of a question is retrieved or built.
     """
-    @wraps(func)
-    def wrapper(*args, **kwargs):
-        start_time: float = time.time()
-        result = func(*args, **kwargs)
-        end_time: float = time.time()
-        elapsed_time: float = end_time - start_time
-        logging.info('Function %s took %4f seconds to execute.', func.__name__, elapsed_time)
-        # Store the elapsed time in the global dictionary
-        performance_data[func.__name__] = elapsed_time
+    answer_settings = {
+        "retriever_mode": settings.retriever_mode,
+        "retrieval_k": settings.retrieval_k,
+        "skip_expansion_score": settings.skip_expansion_score,
+        "context_token_budget": settings.context_token_budget,
+        "faiss_nprobe": settings.faiss_nprobe,
+        "faiss_ef_search": settings.faiss_ef_search,
+        "index": build_index_params(settings),
+        "dedup_threshold": settings.dedup_threshold,
+        "dedup_num_perm": settings.dedup_num_perm,
+        "template": ANSWER_TEMPLATE,
+    }
+    digest = hashlib.sha256(
+        json.dumps(answer_settings, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+    return f"{cache_key}:{model_name}:{digest}"
+
+def build_deduplicator(settings: PipelineSettings) -> Optional["ChunkDeduplicator"]:
+    """Creates the chunk deduplicator configured in the settings, None if disabled."""
+    if not settings.dedup_threshold:
+        return None
+    from src.dedup import ChunkDeduplicator
+
+    return ChunkDeduplicator(settings.dedup_threshold, settings.dedup_num_perm)
 
-        return result
+def record_dedup_stats(deduplicator: Optional["ChunkDeduplicator"], batch_size: int) -> None:
+    """Stores the chunks removed by the deduplicator and the embedding calls saved."""
+    if deduplicator is None or not deduplicator.stats.chunks_in:
+        return
+    stats = deduplicator.stats
+    performance_data["dedup_chunks_in"] = stats.chunks_in
+    performance_data["dedup_exact_duplicates"] = stats.exact_duplicates
+    performance_data["dedup_near_duplicates"] = stats.near_duplicates
+    # Every removed chunk is a text not embedded, and fewer texts need fewer requests
+    performance_data["dedup_embedding_texts_saved"] = stats.removed
+    performance_data["dedup_embedding_requests_saved"] = (
+        -(-stats.chunks_in // batch_size) - -(-stats.chunks_out // batch_size))
+    logging.info("Deduplication: %d of %d chunks removed (%d exact, %d near duplicates)",
+                 stats.removed, stats.chunks_in, stats.exact_duplicates,
+                 stats.near_duplicates)
 
-    return wrapper
+def chunk_sources(chunks: Sequence) -> List[str]:
+    """Returns the paths of the PDFs with at least one chunk."""
+    # LazyDocuments (parse cache) know their sources without reading every chunk
+    if hasattr(chunks, "sources"):
+        return sorted(chunks.sources)
+    return sorted({chunk.metadata["source"] for chunk in chunks})
 
-@timed_function
-def step_1_load_and_split_pdf(pdf_file: str, chunk_size: int, chunk_overlap: int) -> List[str]:
-    """Loads a PDF and splits it into chunks."""
+def record_step_resources(step_name: str, usage: ResourceUsage) -> None:
+    """Adds the resources used by a step to performance_data["resources"]."""
+    performance_data.setdefault("resources", {})[step_name] = usage.to_dict()
+
+def record_embedding_cache_stats(embeddings) -> None:
+    """Stores the hit/miss counts of the chunk embedding cache in performance_data."""
+    from src.embedding_cache import CachedEmbeddings
+
+    if isinstance(embeddings, CachedEmbeddings):
+        performance_data["embedding_cache_hits"] = embeddings.hits
+        performance_data["embedding_cache_misses"] = embeddings.misses
+
+def record_failed_pdfs(pdf_files: List[str], failed: List[str]) -> None:
+    """Logs the PDFs that could not be loaded and stores the counts in performance_data."""
+    performance_data["pdf_files_loaded"] = len(pdf_files) - len(failed)
+    performance_data["pdf_files_failed"] = len(failed)
+    for path in failed:
+        logging.warning("Skipping PDF that could not be loaded: %s", path)
+
+@traced()
+@sampled(record_step_resources)
+def step_1_load_and_split_pdf(
+    pdf_file: Union[str, List[str]],
+    chunk_size: int,
+    chunk_overlap: int,
+    max_workers: Optional[int] = None,
+    pdf_backend: str = DEFAULT_PDF_BACKEND,
+    parse_cache_dir: Optional[str] = None
+    ) -> Sequence:
+    """
+    Loads one or more PDFs and splits them into chunks.
+
+    pdf_file is either a list of PDF paths or a single string, which may be a file,
+    a directory or a glob pattern (see resolve_pdf_files). The PDFs are parsed in
+    parallel by up to max_workers processes, with the given extraction backend.
+    With a parse_cache_dir, files whose pages or chunks are cached are not parsed
+    again and the cached chunks are returned lazily (see src/parse_cache.py).
+    """
     logging.info("Loading and splitting PDF: %s", pdf_file)
 
-    if not isinstance(pdf_file, str):
-        raise ValueError("pdf_file must be a string")
+    if isinstance(pdf_file, str):
+        pdf_file = resolve_pdf_files(pdf_file)
+    if not isinstance(pdf_file, list) or not all(isinstance(path, str) for path in pdf_file):
+        raise ValueError("pdf_file must be a string or a list of strings")
+    if not pdf_file:
+        raise ProcessingError("No PDF files found.")
     if not isinstance(chunk_size, int) or chunk_size <= 0:
         raise ValueError("chunk_size must be a positive integer")
     if not isinstance(chunk_overlap, int) or chunk_overlap < 0:
         raise ValueError("chunk_overlap must be a non-negative integer")
 
-    documents = load_pdf(pdf_file)
+    if parse_cache_dir:
+        from src.parse_cache import load_and_split_cached
+
+        # Parsing and chunking are interleaved per file with the parse cache
+        with span("pdf_parse", files=len(pdf_file), parse_cache=True):
+            chunks, failed, cache_stats = load_and_split_cached(
+                pdf_file, chunk_size, chunk_overlap, parse_cache_dir, max_workers, pdf_backend
+            )
+        performance_data.update(cache_stats)
+        record_failed_pdfs(pdf_file, failed)
+        if not chunks:
+            raise ProcessingError("Error loading PDF.")
+        logging.info("Text split into %s chunks", len(chunks))
+        return chunks
+
+    with span("pdf_parse", files=len(pdf_file)) as parse_span:
+        documents, failed = load_pdfs(pdf_file, max_workers, pdf_backend)
+        parse_span.set(documents=len(documents), failed=len(failed))
+    record_failed_pdfs(pdf_file, failed)
 
     if not documents:
         raise ProcessingError("Error loading PDF.")
 
-    chunks = split_text (documents, chunk_size, chunk_overlap)
+    with span("chunking", documents=len(documents)):
+        chunks = split_text (documents, chunk_size, chunk_overlap)
     if not chunks:
         raise ProcessingError("Error splitting text.")
     logging.info("Text split into %s chunks", len(chunks))
     
     return chunks
 
-@timed_function
-def step_2_setup_vector_database(chunks: List, embedding_model: str, collection_name: str):
-    """Sets up the vector database."""
+@traced()
+@sampled(record_step_resources)
+def step_2_setup_vector_database(
+    chunks: Sequence,
+    embedding_model: str,
+    collection_name: str,
+    settings: Optional[PipelineSettings] = None,
+    cache_key: Optional[str] = None,
+    deduplicator: Optional["ChunkDeduplicator"] = None
+    ):
+    """
+    Sets up the vector database, reusing the cached index when the key matches.
+
+    With a deduplicator, duplicate and near-duplicate chunks are dropped before they
+    are embedded; the cache key must then include its parameters. With INDEX_SHARDS
+    above 1, the index is partitioned into shards searched in parallel processes.
+    """
     logging.info("Setting up vector database...")
-    if not isinstance(chunks, list):
-        raise ValueError("chunks must be a list")
+    if not isinstance(chunks, Sequence):
+        raise ValueError("chunks must be a sequence")
     if not isinstance(embedding_model, str):
         raise ValueError("embedding_model must be a string")
     if not isinstance(collection_name, str):
         raise ValueError("collection_name must be a string")
     
-    vector_db = setup_vector_db (chunks, embedding_model)
+    if settings is None:
+        settings = load_settings()
+
+    from src.vector_db import setup_sharded_vector_db, setup_vector_db
+
+    embeddings = build_pipeline_embeddings(embedding_model, settings)
+    if settings.index_shards > 1:
+        vector_db = setup_sharded_vector_db(
+            chunks,
+            embedding_model,
+            settings.index_shards,
+            settings.shard_by,
+            settings.index_cache_dir or None,
+            cache_key,
+            embeddings,
+            build_index_options(settings),
+            deduplicator,
+            settings.search_processes
+        )
+    else:
+        vector_db = setup_vector_db(
+            chunks,
+            embedding_model,
+            settings.index_cache_dir or None,
+            cache_key,
+            embeddings,
+            build_index_options(settings),
+            deduplicator
+        )
     if not vector_db:
         raise ProcessingError("Error setting up vector database.")
+    record_embedding_cache_stats(embeddings)
+    record_dedup_stats(deduplicator, settings.embed_batch_size)
     return vector_db
 
-@timed_function
-def step_3_load_language_model(model_name: str):
-    """Loads the language model."""
+@traced()
+@sampled(record_step_resources)
+def step_2_update_vector_database(
+    chunks: Sequence,
+    loaded_files: List[str],
+    update: "IndexUpdate",
+    embedding_model: str,
+    collection_name: str,
+    settings: PipelineSettings,
+    cache_key: str,
+    deduplicator: Optional["ChunkDeduplicator"] = None
+    ):
+    """
+    Applies the changes of the corpus to its cached vector database (INCREMENTAL_INDEX).
+
+    Only the chunks of the new and modified PDFs are embedded, and the chunks of the
+    removed and modified ones are deleted from the index (see src/incremental_index.py).
+    """
+    logging.info("Updating vector database...")
+    if not isinstance(chunks, Sequence):
+        raise ValueError("chunks must be a sequence")
+    if not isinstance(embedding_model, str):
+        raise ValueError("embedding_model must be a string")
+    if not isinstance(collection_name, str):
+        raise ValueError("collection_name must be a string")
+
+    from src.vector_db import setup_incremental_vector_db
+
+    embeddings = build_pipeline_embeddings(embedding_model, settings)
+    vector_db, update_stats = setup_incremental_vector_db(
+        update,
+        chunks,
+        loaded_files,
+        embedding_model,
+        settings.index_cache_dir,
+        cache_key,
+        embeddings,
+        build_index_options(settings),
+        deduplicator
+    )
+    performance_data.update(update_stats)
+    if not vector_db:
+        raise ProcessingError("Error updating vector database.")
+    record_embedding_cache_stats(embeddings)
+    record_dedup_stats(deduplicator, settings.embed_batch_size)
+    return vector_db
+
+def build_incremental_vector_db(
+    pdf_file: str,
+    pdf_files: List[str],
+    embedding_model: str,
+    collection_name: str,
+    settings: PipelineSettings,
+    deduplicator: Optional["ChunkDeduplicator"] = None
+    ) -> tuple:
+    """
+    Runs steps 1 and 2 on the PDFs that changed since the cached index of the corpus
+    was built, and returns the vector database and its cache key.
+    """
+    from src.incremental_index import plan_update
+
+    dedup_params = deduplicator.params() if deduplicator is not None else None
+    settings_key = settings_fingerprint(
+        pdf_file,
+        embedding_model,
+        DEFAULT_CHUNK_SIZE,
+        DEFAULT_CHUNK_OVERLAP,
+        settings.pdf_backend,
+        build_index_params(settings),
+        dedup_params
+    )
+    with span("index_plan", files=len(pdf_files)) as plan_span:
+        update = plan_update(pdf_files, settings.index_cache_dir, settings_key)
+        plan_span.set(**update.stats())
+    logging.info("Corpus changes: %d added, %d modified, %d removed, %d unchanged PDF files",
+                 len(update.added), len(update.changed), len(update.removed),
+                 len(update.unchanged))
+
+    chunks: Sequence = []
+    if update.files_to_parse:
+        try:
+            chunks = step_1_load_and_split_pdf(
+                update.files_to_parse,
+                DEFAULT_CHUNK_SIZE,
+                DEFAULT_CHUNK_OVERLAP,
+                settings.pdf_workers,
+                settings.pdf_backend,
+                settings.parse_cache_dir or None
+            )
+        except ProcessingError:
+            # The unchanged PDFs can still be queried
+            if not update.unchanged:
+                raise
+            logging.warning("None of the new or modified PDF files could be loaded")
+    loaded_files = chunk_sources(chunks)
+    indexed_files = update.indexed_files(loaded_files)
+    if not indexed_files:
+        raise ProcessingError("Error loading PDF.")
+    cache_key = corpus_fingerprint(
+        indexed_files,
+        embedding_model,
+        DEFAULT_CHUNK_SIZE,
+        DEFAULT_CHUNK_OVERLAP,
+        settings.pdf_backend,
+        build_index_params(settings),
+        dedup_params,
+        update.file_hashes
+    )
+    vector_db = step_2_update_vector_database(
+        chunks,
+        loaded_files,
+        update,
+        embedding_model,
+        collection_name,
+        settings,
+        cache_key,
+        deduplicator
+    )
+    return vector_db, cache_key
+
+@traced()
+@sampled(record_step_resources)
+def step_1_2_stream_pdf_to_vector_database(
+    pdf_files: List[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    embedding_model: str,
+    settings: Optional[PipelineSettings] = None,
+    cache_key: Optional[str] = None,
+    deduplicator: Optional["ChunkDeduplicator"] = None
+    ):
+    """
+    Streams the PDFs through parsing, chunking and embedding into the vector database.
+
+    Replaces steps 1 and 2 when INGESTION_MODE=stream: embedding overlaps with parsing,
+    and the memory used does not grow with the size of the corpus.
+    """
+    logging.info("Streaming %d PDF files into the vector database...", len(pdf_files))
+    if not isinstance(pdf_files, list) or not all(isinstance(path, str) for path in pdf_files):
+        raise ValueError("pdf_files must be a list of strings")
+    if not pdf_files:
+        raise ProcessingError("No PDF files found.")
+    if not isinstance(chunk_size, int) or chunk_size <= 0:
+        raise ValueError("chunk_size must be a positive integer")
+    if not isinstance(chunk_overlap, int) or chunk_overlap < 0:
+        raise ValueError("chunk_overlap must be a non-negative integer")
+    if not isinstance(embedding_model, str):
+        raise ValueError("embedding_model must be a string")
+
+    if settings is None:
+        settings = load_settings()
+
+    from src.vector_db import setup_vector_db_streaming
+
+    embeddings = build_pipeline_embeddings(embedding_model, settings)
+    vector_db, stage_stats = setup_vector_db_streaming(
+        pdf_files,
+        embedding_model,
+        chunk_size,
+        chunk_overlap,
+        embeddings,
+        # Enough chunks per batch to keep every embedding request slot busy
+        settings.embed_batch_size * settings.embed_max_in_flight,
+        settings.index_cache_dir or None,
+        cache_key,
+        settings.stream_queue_size,
+        settings.pdf_workers,
+        settings.pdf_backend,
+        build_index_options(settings),
+        deduplicator
+    )
+    performance_data.update(stage_stats)
+    if not vector_db:
+        raise ProcessingError("Error setting up vector database.")
+    record_embedding_cache_stats(embeddings)
+    record_dedup_stats(deduplicator, settings.embed_batch_size)
+    return vector_db
+
+@traced()
+@sampled(record_step_resources)
+def step_3_load_language_model(model_name: str,
+                               settings: Optional[PipelineSettings] = None):
+    """Loads the language model, with the HTTP connection pool size of the settings."""
     logging.info("Loading language model: %s", model_name)
     if not isinstance(model_name, str):
         raise ValueError("model_name must be a string")
-    llm = load_llm(model_name)
+    if settings is None:
+        settings = load_settings()
+    from src.model_loader import load_llm
+    from src.ollama_client import client_kwargs, parse_keep_alive
+
+    llm = load_llm(
+        model_name,
+        parse_keep_alive(settings.ollama_keep_alive),
+        client_kwargs(settings.ollama_pool_size)
+    )
     if not llm:
         raise ProcessingError(f"Error loading language model: {model_name}")
     return llm
 
-@timed_function
-def step_4_setup_retrieval_system(vector_db, llm):
+@traced()
+@sampled(record_step_resources)
+def step_4_setup_retrieval_system(
+    vector_db,
+    llm,
+    settings: Optional[PipelineSettings] = None,
+    cache_key: Optional[str] = None
+    ):
     """Sets up the retrieval system."""
     logging.info("Setting up retrieval system...")
     if vector_db is None:
         raise ValueError("vector_db cannot be None")
     if llm is None:
         raise ValueError("llm cannot be None")
+    if settings is None:
+        settings = load_settings()
+    from src.lexical_index import LexicalIndex
+    from src.prompt_template import get_query_prompt
+    from src.retrieval import setup_retriever
+
+    lexical_index = None
+    if settings.retriever_mode in ("hybrid", "lexical"):
+        if settings.index_cache_dir and cache_key:
+            lexical_index = load_cached_lexical_index(settings.index_cache_dir, cache_key)
+        if lexical_index is None:
+            lexical_index = LexicalIndex.from_vector_db(vector_db)
     query_prompt = get_query_prompt()
-    retriever = setup_retriever(vector_db, llm, query_prompt)
+    retriever = setup_retriever(
+        vector_db,
+        llm,
+        query_prompt,
+        settings.retriever_mode,
+        settings.retrieval_k,
+        settings.skip_expansion_score,
+        lexical_index,
+        settings.retrieval_workers
+    )
     if not retriever:
         raise ProcessingError("Error setting up retrieval system.")
     return retriever
 
-def execute_llm_query(retriever, llm, question: str) -> Dict:
-    """Executes a query and returns the result and elapsed time."""
-    logging.info('Executing query: %s', question)
+def get_rag_chain(retriever, llm, settings: Optional[PipelineSettings] = None):
+    """
+    Returns the RAG chain of a retriever and an LLM, building it only once.
+
+    The retrieved chunks are packed into the prompt context within the token budget
+    of the settings (see src/context_packing.py). The chain yields the message chunks
+    of the LLM, whose metadata carries the prompt statistics reported by Ollama.
+    """
+    key = (id(retriever), id(llm))
+    cached = _rag_chains.get(key)
+    # The cached entry keeps retriever and llm alive, so their ids cannot be reused
+    if cached is not None and cached[0] is retriever and cached[1] is llm:
+        return cached[2]
+    if settings is None:
+        settings = load_settings()
+    from langchain.prompts import ChatPromptTemplate
+    from langchain_core.runnables import RunnableLambda, RunnablePassthrough
+
+    from src.context_packing import ContextPacker
+
+    packer = ContextPacker(settings.context_token_budget)
+    template = ChatPromptTemplate.from_template(ANSWER_TEMPLATE)
+    chain = (
+        {"context": retriever | RunnableLambda(packer), "question": RunnablePassthrough()}
+        | template
+        | llm
+    )
+    _rag_chains[key] = (retriever, llm, chain)
+    return chain
+
+def _check_query_args(retriever, llm, question: str) -> None:
     if retriever is None:
         raise ValueError("retriever cannot be None")
     if llm is None:
         raise ValueError("llm cannot be None")
     if not isinstance(question, str):
         raise ValueError("question must be a string")
-    template = ChatPromptTemplate.from_template(
-        "Answer the question based ONLY on the following context: {context}\nQuestion: {question}")
-    chain = (
-        {"context": retriever, "question": RunnablePassthrough()}
-        | template
-        | llm
-        | StrOutputParser()
-    )
-    result = chain.invoke(input=(question,))
-    return {"question": question, "answer": result}
+
+def generation_metrics(start_time: float, first_token_time: Optional[float],
+                       end_time: float, tokens: int) -> Dict[str, float]:
+    """
+    Computes the streaming metrics of an answer from perf_counter timestamps.
+
+    Ollama streams one token per chunk, so the number of chunks is the number of
+    generated tokens. The time to first token includes retrieval and prompt prefill;
+    the generation time and the tokens per second only cover the decoding.
+    """
+    if first_token_time is None:
+        first_token_time = end_time
+    generation_seconds = end_time - first_token_time
+    return {
+        "ttft_seconds": first_token_time - start_time,
+        "generation_seconds": generation_seconds,
+        "tokens": tokens,
+        "tokens_per_second": tokens / generation_seconds if generation_seconds > 0 else 0.0,
+    }
+
+def prompt_metrics(query_span, question: str, response_metadata: Dict,
+                   first_token_time: Optional[float]) -> Dict:
+    """
+    Returns the context packing counters, the prompt tokens and the prefill time of
+    a query.
+
+    Ollama reports the prompt tokens, the prefill time and the model load time in
+    the last chunk of the answer. Without them, the prompt tokens are estimated from
+    its length and the prefill time is the time from the end of the context packing
+    to the first token. A query that had to load the model is a cold start.
+    """
+    from src.context_packing import estimate_tokens
+
+    metrics: Dict = {}
+    packing = next((child for child in tracer.children(query_span)
+                    if child.name == "context_packing"), None)
+    if packing is not None:
+        metrics.update({name: value for name, value in packing.attributes.items()
+                        if name.startswith("context_")})
+        if first_token_time is not None:
+            tracer.record("llm_prefill", packing.end, first_token_time, query_span)
+    prompt_tokens = response_metadata.get("prompt_eval_count")
+    if prompt_tokens is None and "context_tokens" in metrics:
+        prompt_tokens = metrics["context_tokens"] + estimate_tokens(ANSWER_TEMPLATE + question)
+    if prompt_tokens is not None:
+        metrics["prompt_tokens"] = prompt_tokens
+    load_ns = response_metadata.get("load_duration")
+    if load_ns is not None:
+        metrics["model_load_seconds"] = load_ns / 1e9
+        metrics["cold_start"] = load_ns / 1e9 >= COLD_START_LOAD_SECONDS
+    prefill_ns = response_metadata.get("prompt_eval_duration")
+    if prefill_ns is not None:
+        metrics["prefill_seconds"] = prefill_ns / 1e9
+    elif packing is not None and first_token_time is not None:
+        metrics["prefill_seconds"] = first_token_time - packing.end
+    return metrics
+
+def stream_llm_query(retriever, llm, question: str,
+                     answer_cache: Optional["AnswerCache"] = None,
+                     metrics: Optional[Dict] = None) -> Iterator[str]:
+    """
+    Executes a query and yields the answer tokens as the LLM generates them.
+
+    A cached answer is yielded at once. When the generator is exhausted, the metrics
+    dict (if given) holds the streaming metrics of generation_metrics and the prompt
+    metrics of prompt_metrics, or "cache" with the match tier when the answer came
+    from the answer cache.
+
+    The query is traced as a "query" span, nested in the current span if any. The
+    span is only made current while the generator runs, not while it is suspended.
+    """
+    logging.info('Executing query: %s', question)
+    _check_query_args(retriever, llm, question)
+    start_time = time.perf_counter()
+    query_span = tracer.start_span("query", question=question)
+    try:
+        lookup = None
+        if answer_cache is not None:
+            with tracer.activate(query_span):
+                lookup = answer_cache.lookup(question)
+            if lookup.answer is not None:
+                logging.info("Answer found in the cache (%s match)", lookup.tier)
+                query_span.set(cache=lookup.tier)
+                if metrics is not None:
+                    metrics.update(generation_metrics(start_time, None, time.perf_counter(), 0))
+                    metrics["cache"] = lookup.tier
+                yield lookup.answer
+                return
+
+        chain = get_rag_chain(retriever, llm)
+        first_token_time = None
+        parts = []
+        response_metadata: Dict = {}
+        chunks = iter(chain.stream(question))
+        while True:
+            # Retrieval and context packing run inside the chain, on the first call to next
+            with tracer.activate(query_span):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            response_metadata.update(chunk.response_metadata or {})
+            token = chunk.content
+            if not token:
+                continue
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            parts.append(token)
+            yield token
+        end_time = time.perf_counter()
+        if first_token_time is not None:
+            tracer.record("llm_generation", first_token_time, end_time, query_span,
+                          tokens=len(parts))
+        query_metrics = prompt_metrics(query_span, question, response_metadata, first_token_time)
+        query_span.set(**query_metrics)
+        if metrics is not None:
+            metrics.update(generation_metrics(start_time, first_token_time, end_time, len(parts)))
+            metrics.update(query_metrics)
+        if answer_cache is not None:
+            with tracer.activate(query_span):
+                answer_cache.store(question, "".join(parts), lookup.embedding)
+    except Exception as e:
+        query_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tracer.end_span(query_span)
+
+async def astream_llm_query(retriever, llm, question: str,
+                            answer_cache: Optional["AnswerCache"] = None,
+                            metrics: Optional[Dict] = None) -> AsyncIterator[str]:
+    """Asynchronous version of stream_llm_query, built on chain.astream."""
+    logging.info('Executing query: %s', question)
+    _check_query_args(retriever, llm, question)
+    start_time = time.perf_counter()
+    query_span = tracer.start_span("query", question=question)
+    try:
+        lookup = None
+        if answer_cache is not None:
+            # The answer cache uses SQLite and an embedding request, both blocking
+            with tracer.activate(query_span):
+                lookup = await asyncio.to_thread(answer_cache.lookup, question)
+            if lookup.answer is not None:
+                logging.info("Answer found in the cache (%s match)", lookup.tier)
+                query_span.set(cache=lookup.tier)
+                if metrics is not None:
+                    metrics.update(generation_metrics(start_time, None, time.perf_counter(), 0))
+                    metrics["cache"] = lookup.tier
+                yield lookup.answer
+                return
+
+        chain = get_rag_chain(retriever, llm)
+        first_token_time = None
+        parts = []
+        response_metadata: Dict = {}
+        chunks = chain.astream(question).__aiter__()
+        while True:
+            with tracer.activate(query_span):
+                try:
+                    chunk = await chunks.__anext__()
+                except StopAsyncIteration:
+                    break
+            response_metadata.update(chunk.response_metadata or {})
+            token = chunk.content
+            if not token:
+                continue
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            parts.append(token)
+            yield token
+        end_time = time.perf_counter()
+        if first_token_time is not None:
+            tracer.record("llm_generation", first_token_time, end_time, query_span,
+                          tokens=len(parts))
+        query_metrics = prompt_metrics(query_span, question, response_metadata, first_token_time)
+        query_span.set(**query_metrics)
+        if metrics is not None:
+            metrics.update(generation_metrics(start_time, first_token_time, end_time, len(parts)))
+            metrics.update(query_metrics)
+        if answer_cache is not None:
+            with tracer.activate(query_span):
+                await asyncio.to_thread(answer_cache.store, question, "".join(parts),
+                                        lookup.embedding)
+    except Exception as e:
+        query_span.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        tracer.end_span(query_span)
+
+def execute_llm_query(retriever, llm, question: str,
+                      answer_cache: Optional["AnswerCache"] = None) -> Dict:
+    """
+    Executes a query and returns the result with its streaming metrics.
+
+    When an answer cache is given, a cached answer to the same (or a semantically
+    equivalent) question is returned without running the chain.
+    """
+    metrics: Dict = {}
+    answer = "".join(stream_llm_query(retriever, llm, question, answer_cache, metrics))
+    return {"question": question, "answer": answer, **metrics}
 
 def load_config():
     """Loads configuration from environment variables."""
@@ -166,19 +821,89 @@ def load_config():
 
     return pdf_file, embedding_model, collection_name, model_name
 
-@timed_function
-def step_5_process_queries(retriever, llm) -> List[Dict]:
-    """Processes the queries and returns the results."""
-    query_results = [
-        execute_llm_query(retriever, llm, "Genera un resumen del documento"),
-        # execute_query(retriever, llm, "Dime el titulo del documento")
-    ]
+def load_questions(questions_file: Optional[str]) -> List[str]:
+    """Loads the questions to answer, one per line, or returns the default questions."""
+    if not questions_file:
+        return list(DEFAULT_QUESTIONS)
+    with open(questions_file, encoding="utf-8") as file:
+        questions = [line.strip() for line in file if line.strip()]
+    if not questions:
+        raise ValueError(f"No questions found in {questions_file}")
+    return questions
+
+def timed_llm_query(retriever, llm, question: str,
+                    answer_cache: Optional["AnswerCache"] = None) -> Dict:
+    """Executes a query and adds its latency to the result."""
+    start_time = time.perf_counter()
+    result = execute_llm_query(retriever, llm, question, answer_cache)
+    result["latency_seconds"] = time.perf_counter() - start_time
+    return result
+
+@traced()
+@sampled(record_step_resources)
+def step_5_process_queries(
+    retriever,
+    llm,
+    answer_cache: Optional["AnswerCache"] = None,
+    questions: Optional[List[str]] = None,
+    concurrency: int = 1
+    ) -> List[Dict]:
+    """
+    Processes the queries and returns the results, in the order of the questions.
+
+    Up to concurrency queries run at the same time against the same chain, which is
+    the throughput path when many questions are asked about the same index.
+    """
+    if questions is None:
+        questions = list(DEFAULT_QUESTIONS)
+    if not isinstance(concurrency, int) or concurrency <= 0:
+        raise ValueError("concurrency must be a positive integer")
+
+    # Build the chain before the workers start so that they all share it
+    get_rag_chain(retriever, llm)
+    start_time = time.perf_counter()
+    if concurrency == 1 or len(questions) <= 1:
+        query_results = [
+            timed_llm_query(retriever, llm, question, answer_cache) for question in questions
+        ]
+    else:
+        with ThreadPoolExecutor(max_workers=min(concurrency, len(questions)),
+                                thread_name_prefix="query") as executor:
+            # map returns the results in the order of the questions
+            # propagate nests the query spans of the workers under this step
+            query_results = list(executor.map(
+                propagate(lambda question: timed_llm_query(retriever, llm, question,
+                                                           answer_cache)),
+                questions
+            ))
+    elapsed_time = time.perf_counter() - start_time
+    performance_data["queries"] = len(questions)
+    performance_data["queries_per_second"] = len(questions) / elapsed_time if elapsed_time else 0.0
+
+    generated = [result for result in query_results if "cache" not in result]
+    if generated:
+        performance_data["ttft_seconds_mean"] = (
+            sum(result["ttft_seconds"] for result in generated) / len(generated))
+        performance_data["tokens_per_second_mean"] = (
+            sum(result["tokens_per_second"] for result in generated) / len(generated))
+        for metric in ("prompt_tokens", "prefill_seconds", "context_tokens"):
+            values = [result[metric] for result in generated if metric in result]
+            if values:
+                performance_data[f"{metric}_mean"] = sum(values) / len(values)
+        # Queries that had to load the model, and the ones served by a loaded model
+        if any("cold_start" in result for result in generated):
+            for name, cold in (("cold", True), ("warm", False)):
+                values = [result["ttft_seconds"] for result in generated
+                          if result.get("cold_start") is cold]
+                performance_data[f"queries_{name}"] = len(values)
+                if values:
+                    performance_data[f"ttft_{name}_seconds_mean"] = sum(values) / len(values)
+    if answer_cache is not None:
+        for tier, count in answer_cache.stats.items():
+            performance_data[f"answer_cache_{tier}"] = count
     questions_and_answers: List[Dict] = []
     for result in query_results:
-        questions_and_answers.append({
-            "question": result["question"],
-            "answer": result["answer"]
-        })
+        questions_and_answers.append(dict(result))
     return questions_and_answers
 
 def create_data_payload(
@@ -205,24 +930,190 @@ def create_data_payload(
     )
     return data_payload
 
+@dataclasses.dataclass
+class Pipeline:
+    """Represents the warm objects needed to answer queries."""
+    vector_db: object
+    llm: object
+    retriever: object
+    answer_cache: Optional["AnswerCache"]
+    cache_key: str
+    model_name: str
+    embedding_model: str
+
+def build_pipeline(
+    pdf_file: str,
+    embedding_model: str,
+    collection_name: str,
+    model_name: str,
+    settings: PipelineSettings
+    ) -> Pipeline:
+    """
+    Runs steps 1 to 4: builds or loads the index, loads the LLM and sets up retrieval.
+
+    The returned pipeline can answer any number of queries, either once (main) or
+    for the lifetime of the query server (server.py).
+    """
+    set_sample_interval(settings.resource_sample_interval)
+    pdf_files = resolve_pdf_files(pdf_file)
+    warmup = start_model_warmup(model_name, embedding_model, settings)
+    deduplicator = build_deduplicator(settings)
+    dedup_params = deduplicator.params() if deduplicator is not None else None
+    incremental = settings.incremental_index
+    if incremental and not settings.index_cache_dir:
+        logging.warning("INCREMENTAL_INDEX requires INDEX_CACHE_DIR, rebuilding the index")
+        incremental = False
+    if incremental and (settings.ingestion_mode == "stream" or settings.index_shards > 1):
+        logging.warning("INCREMENTAL_INDEX is only applied to the batch ingestion "
+                        "of a single index")
+        incremental = False
+    if settings.ingestion_mode == "stream":
+        if settings.index_shards > 1:
+            logging.warning("INDEX_SHARDS is ignored by the streaming ingestion, "
+                            "which builds a single index")
+        cache_key = corpus_fingerprint(
+            pdf_files,
+            embedding_model,
+            DEFAULT_CHUNK_SIZE,
+            DEFAULT_CHUNK_OVERLAP,
+            settings.pdf_backend,
+            build_index_options(settings).build_params(),
+            dedup_params
+        )
+        vector_db = step_1_2_stream_pdf_to_vector_database(
+            pdf_files,
+            DEFAULT_CHUNK_SIZE,
+            DEFAULT_CHUNK_OVERLAP,
+            embedding_model,
+            settings,
+            cache_key,
+            deduplicator
+        )
+    elif incremental:
+        vector_db, cache_key = build_incremental_vector_db(
+            pdf_file,
+            pdf_files,
+            embedding_model,
+            collection_name,
+            settings,
+            deduplicator
+        )
+    else:
+        def batch_cache_key(files: List[str]) -> str:
+            return corpus_fingerprint(
+                files,
+                embedding_model,
+                DEFAULT_CHUNK_SIZE,
+                DEFAULT_CHUNK_OVERLAP,
+                settings.pdf_backend,
+                build_index_params(settings),
+                dedup_params
+            )
+
+        vector_db = None
+        if settings.index_cache_dir:
+            # An index of every PDF is loaded from the cache without parsing them
+            cache_key = batch_cache_key(pdf_files)
+            if has_index(settings.index_cache_dir, cache_key):
+                try:
+                    vector_db = step_2_setup_vector_database(
+                        [],
+                        embedding_model,
+                        collection_name,
+                        settings,
+                        cache_key,
+                        deduplicator
+                    )
+                except ProcessingError:
+                    logging.warning("Cached index %s could not be loaded, parsing the PDFs",
+                                    cache_key)
+        if vector_db is None:
+            chunks = step_1_load_and_split_pdf(
+                pdf_files,
+                DEFAULT_CHUNK_SIZE,
+                DEFAULT_CHUNK_OVERLAP,
+                settings.pdf_workers,
+                settings.pdf_backend,
+                settings.parse_cache_dir or None
+            )
+            # Only the PDFs that were loaded are part of the index
+            indexed_files = chunk_sources(chunks)
+            if settings.index_cache_dir and len(indexed_files) < len(pdf_files):
+                logging.warning("%d PDF(s) have no chunks: the index is cached without them "
+                                "and the PDFs are parsed on every run until they load",
+                                len(pdf_files) - len(indexed_files))
+            cache_key = batch_cache_key(indexed_files)
+            vector_db = step_2_setup_vector_database(
+                chunks,
+                embedding_model,
+                collection_name,
+                settings,
+                cache_key,
+                deduplicator
+            )
+    llm = step_3_load_language_model(model_name, settings)
+    retriever = step_4_setup_retrieval_system(vector_db, llm, settings, cache_key)
+    finish_model_warmup(warmup)
+    answer_cache = None
+    if settings.answer_cache_path:
+        from src.answer_cache import AnswerCache
+
+        # Answers depend on the indexed corpus, the language model and the retrieval
+        answer_cache = AnswerCache(
+            settings.answer_cache_path,
+            answer_cache_version(cache_key, model_name, settings),
+            vector_db.embeddings,
+            settings.answer_cache_similarity,
+            settings.answer_cache_ttl_seconds,
+            settings.answer_cache_max_entries
+        )
+    return Pipeline(
+        vector_db=vector_db,
+        llm=llm,
+        retriever=retriever,
+        answer_cache=answer_cache,
+        cache_key=cache_key,
+        model_name=model_name,
+        embedding_model=embedding_model
+    )
+
 def main():
     """Main function to execute the processing pipeline."""
     try:
         system_info: SystemInfo = obtener_info_equipo()
         pdf_file, embedding_model, collection_name, model_name = load_config()
-
-        chunks = step_1_load_and_split_pdf(pdf_file, DEFAULT_CHUNK_SIZE, DEFAULT_CHUNK_OVERLAP)
-        vector_db = step_2_setup_vector_database(chunks, embedding_model, collection_name)
-        llm = step_3_load_language_model(model_name)
-        retriever = step_4_setup_retrieval_system(vector_db, llm)
-        questions_and_answers = step_5_process_queries(retriever, llm)
-        data_payload = create_data_payload(
-            system_info,
-            model_name,
-            embedding_model,
-            questions_and_answers
+        settings = load_settings()
+        if settings.trace_file:
+            tracer.add_exporter(JsonLinesExporter(settings.trace_file))
+        # Started first so that results left queued by previous runs are sent meanwhile
+        writer = BackgroundWriter(
+            create_sink(settings.results_sink, settings.results_path),
+            settings.results_queue_path,
+            settings.results_batch_size
         )
-        save_data(data_payload)
+
+        with span("run") as run_span:
+            pipeline = build_pipeline(
+                pdf_file, embedding_model, collection_name, model_name, settings
+            )
+            questions_and_answers = step_5_process_queries(
+                pipeline.retriever,
+                pipeline.llm,
+                pipeline.answer_cache,
+                load_questions(settings.questions_file or None),
+                settings.query_concurrency
+            )
+            # Step times are the durations of the step spans of this run
+            performance_data.update(tracer.child_durations(run_span))
+            performance_data["trace_id"] = run_span.trace_id
+            data_payload = create_data_payload(
+                system_info,
+                model_name,
+                embedding_model,
+                questions_and_answers
+            )
+            save_data(data_payload, writer)
+        writer.close(settings.results_flush_timeout)
 
     except ProcessingError as e:
         logging.error("A processing error occurred: %s", e)
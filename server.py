@@ -0,0 +1,319 @@
+"""
+server.py
+
+Long-running query service. The index, the language model and the retrieval system
+are set up once (steps 1 to 4 of main.py), then questions are answered over HTTP
+against the warm pipeline:
+
+- POST /query with a JSON body {"question": "..."} returns the answer and the
+  timing of the request. With {"question": "...", "stream": true} the answer is
+  streamed as newline-delimited JSON: one {"token": "..."} object per token, then
+  a final {"done": true, ...} object with the timing of the request.
+- GET /health returns the status of the service and its counters.
+- GET /metrics returns the duration histograms of the traced spans (setup steps,
+  queries, retrieval, LLM generation...) in the Prometheus text format.
+
+Usage:
+    python server.py --port 8000
+    curl -s localhost:8000/query -d '{"question": "Genera un resumen del documento"}'
+"""
+import argparse
+import json
+import logging
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, Tuple, Union
+
+from main import (
+    Pipeline,
+    ProcessingError,
+    build_pipeline,
+    get_rag_chain,
+    load_config,
+    stream_llm_query,
+    timed_llm_query,
+)
+from src.settings import load_settings
+from src.tracing import JsonLinesExporter, span, tracer
+
+MAX_REQUEST_BYTES = 64 * 1024
+
+
+class QueryService:
+    """Answers queries against a warm pipeline and keeps the service counters."""
+
+    def __init__(self, pipeline: Pipeline, max_concurrency: int, startup_seconds: float = 0.0):
+        if max_concurrency <= 0:
+            raise ValueError("max_concurrency must be a positive integer")
+        self.pipeline = pipeline
+        self.startup_seconds = startup_seconds
+        self.started_at = time.time()
+        self.queries = 0
+        self.errors = 0
+        self.in_flight = 0
+        self._slots = threading.BoundedSemaphore(max_concurrency)
+        self._lock = threading.Lock()
+        # Build the chain before the first request so that all requests share it
+        get_rag_chain(pipeline.retriever, pipeline.llm)
+
+    def _start(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def _finish(self, failed: bool) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            if failed:
+                self.errors += 1
+            else:
+                self.queries += 1
+
+    def query(self, question: str) -> Dict:
+        """
+        Answers a question.
+
+        Args:
+            question (str): The question.
+
+        Returns:
+            Dict: The question, the answer and the timing of the request: the time spent
+            waiting for a free slot and the time spent answering.
+        """
+        start_time = time.perf_counter()
+        with self._slots:
+            queued_seconds = time.perf_counter() - start_time
+            self._start()
+            failed = True
+            try:
+                result = timed_llm_query(
+                    self.pipeline.retriever,
+                    self.pipeline.llm,
+                    question,
+                    self.pipeline.answer_cache
+                )
+                failed = False
+            finally:
+                self._finish(failed)
+        result["queued_seconds"] = queued_seconds
+        return result
+
+    def stream(self, question: str) -> Iterator[Dict]:
+        """
+        Answers a question token by token.
+
+        Args:
+            question (str): The question.
+
+        Yields:
+            Dict: {"token": ...} for each generated token, then {"done": True, ...}
+            with the streaming metrics and the timing of the request.
+        """
+        start_time = time.perf_counter()
+        with self._slots:
+            queued_seconds = time.perf_counter() - start_time
+            self._start()
+            failed = True
+            metrics: Dict = {}
+            try:
+                for token in stream_llm_query(
+                    self.pipeline.retriever,
+                    self.pipeline.llm,
+                    question,
+                    self.pipeline.answer_cache,
+                    metrics
+                ):
+                    yield {"token": token}
+                failed = False
+            finally:
+                self._finish(failed)
+        yield {
+            "done": True,
+            "question": question,
+            **metrics,
+            "latency_seconds": time.perf_counter() - start_time - queued_seconds,
+            "queued_seconds": queued_seconds,
+        }
+
+    def health(self) -> Dict:
+        """Returns the status of the service and its counters."""
+        with self._lock:
+            counters = {"queries": self.queries, "errors": self.errors,
+                        "in_flight": self.in_flight}
+        return {
+            "status": "ok",
+            "model": self.pipeline.model_name,
+            "embedding_model": self.pipeline.embedding_model,
+            "index": self.pipeline.cache_key,
+            "startup_seconds": self.startup_seconds,
+            "uptime_seconds": time.time() - self.started_at,
+            **counters,
+        }
+
+
+def handle_request(service: QueryService, method: str, path: str,
+                   body: bytes) -> Tuple[int, Union[Dict, str, Iterator[Dict]]]:
+    """
+    Returns the (status, payload) of an HTTP request. Streamed answers return an
+    iterator of payloads, sent as newline-delimited JSON, and metrics return text.
+    """
+    if path == "/health":
+        if method != "GET":
+            return 405, {"error": "use GET"}
+        return 200, service.health()
+    if path == "/metrics":
+        if method != "GET":
+            return 405, {"error": "use GET"}
+        return 200, tracer.prometheus_text()
+    if path == "/query":
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            request = json.loads(body or b"{}")
+            question = request.get("question")
+        except (ValueError, AttributeError):
+            return 400, {"error": "the body must be a JSON object"}
+        if not isinstance(question, str) or not question.strip():
+            return 400, {"error": "question must be a non-empty string"}
+        if request.get("stream"):
+            return 200, service.stream(question.strip())
+        try:
+            return 200, service.query(question.strip())
+        except Exception as e:
+            logging.error("Error answering %r: %s", question, e)
+            return 500, {"error": str(e)}
+    return 404, {"error": f"unknown endpoint {path}"}
+
+
+def make_server(service: QueryService, host: str, port: int) -> ThreadingHTTPServer:
+    """
+    Creates the HTTP server of a query service. Every request is handled in its own
+    thread; at most max_concurrency of them run a query at the same time.
+
+    Args:
+        service (QueryService): The query service.
+        host (str): Address to listen on.
+        port (int): Port to listen on, 0 for any free port.
+
+    Returns:
+        ThreadingHTTPServer: The server, not started yet.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        """Request handler delegating to handle_request."""
+
+        protocol_version = "HTTP/1.1"
+
+        def _handle(self, method: str) -> None:
+            start_time = time.perf_counter()
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+            except ValueError:
+                length = -1
+            if length < 0:
+                # The end of the body is unknown, so the connection cannot be reused
+                status, payload = 400, {"error": "invalid Content-Length header"}
+                self.close_connection = True
+            elif length > MAX_REQUEST_BYTES:
+                status, payload = 413, {"error": "request too large"}
+                self.close_connection = True
+            else:
+                body = self.rfile.read(length) if length else b""
+                status, payload = handle_request(service, method, self.path, body)
+            if isinstance(payload, str):
+                data = payload.encode("utf-8")
+                content_type = "text/plain; version=0.0.4; charset=utf-8"
+            elif isinstance(payload, dict):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                content_type = "application/json; charset=utf-8"
+            else:
+                self._stream(status, payload)
+                return
+            elapsed_ms = (time.perf_counter() - start_time) * 1000
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Server-Timing", f"total;dur={elapsed_ms:.1f}")
+            self.end_headers()
+            self.wfile.write(data)
+            if self.path == "/query":
+                logging.info("%s %s %d %.1f ms", method, self.path, status, elapsed_ms)
+
+        def _stream(self, status: int, payloads: Iterator[Dict]) -> None:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            try:
+                for payload in payloads:
+                    self._write_chunk(payload)
+            except (BrokenPipeError, ConnectionResetError):
+                logging.info("Client disconnected while streaming the answer")
+                return
+            except Exception as e:
+                logging.error("Error streaming the answer: %s", e)
+                self._write_chunk({"done": True, "error": str(e)})
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, payload: Dict) -> None:
+            line = json.dumps(payload, ensure_ascii=False).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):  # pylint: disable=invalid-name
+            self._handle("GET")
+
+        def do_POST(self):  # pylint: disable=invalid-name
+            self._handle("POST")
+
+        def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+            pass
+
+    httpd = ThreadingHTTPServer((host, port), Handler)
+    httpd.daemon_threads = True
+    return httpd
+
+
+def main():
+    """Sets up the pipeline once and serves queries until interrupted."""
+    parser = argparse.ArgumentParser(description="RAG query server")
+    parser.add_argument("--host", help="Overrides SERVER_HOST")
+    parser.add_argument("--port", type=int, help="Overrides SERVER_PORT")
+    args = parser.parse_args()
+
+    try:
+        pdf_file, embedding_model, collection_name, model_name = load_config()
+        settings = load_settings()
+        if settings.trace_file:
+            tracer.add_exporter(JsonLinesExporter(settings.trace_file))
+        # The setup is one trace; every query is then a trace of its own
+        with span("startup") as startup_span:
+            pipeline = build_pipeline(
+                pdf_file, embedding_model, collection_name, model_name, settings
+            )
+        service = QueryService(
+            pipeline, settings.server_max_concurrency, startup_span.duration
+        )
+        httpd = make_server(
+            service,
+            args.host or settings.server_host,
+            args.port if args.port is not None else settings.server_port
+        )
+    except (ProcessingError, ValueError) as e:
+        logging.error("Error starting the query server: %s", e)
+        sys.exit(1)
+
+    host, port = httpd.server_address[:2]
+    logging.info("Query server ready on http://%s:%s (startup %.2f s)",
+                 host, port, service.startup_seconds)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+"""
+src/answer_cache.py
+
+This module implements a two-tier cache of the answers generated by the RAG chain:
+
+1. Exact tier: the normalized question, scoped to an index version.
+2. Semantic tier: the cosine similarity between the question embedding and the
+   embeddings of the cached questions of the same index version, above a threshold.
+
+Entries expire after a TTL, the least recently used ones are evicted past a maximum
+number of entries, and everything is stored in SQLite so the cache survives restarts.
+"""
+import dataclasses
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.settings import (
+    DEFAULT_ANSWER_CACHE_MAX_ENTRIES,
+    DEFAULT_ANSWER_CACHE_SIMILARITY,
+    DEFAULT_ANSWER_CACHE_TTL_SECONDS,
+)
+
+_PUNCTUATION = re.compile(r"[¿?¡!.,;:\"'«»()\[\]]+")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_question(question: str) -> str:
+    """
+    Normalizes a question for the exact tier: Unicode normalization, case folding,
+    and removal of punctuation and repeated whitespace.
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = _PUNCTUATION.sub(" ", text)
+    return _WHITESPACE.sub(" ", text).strip()
+
+
+@dataclasses.dataclass
+class CacheLookup:
+    """Represents the result of an answer cache lookup."""
+    answer: Optional[str]
+    tier: Optional[str]
+    embedding: Optional[List[float]] = None
+
+
+class AnswerCache:
+    """Two-tier (exact and semantic) answer cache backed by SQLite."""
+
+    def __init__(
+        self,
+        path: str,
+        index_version: str,
+        embeddings: Optional[Embeddings] = None,
+        similarity_threshold: float = DEFAULT_ANSWER_CACHE_SIMILARITY,
+        ttl_seconds: float = DEFAULT_ANSWER_CACHE_TTL_SECONDS,
+        max_entries: int = DEFAULT_ANSWER_CACHE_MAX_ENTRIES
+    ):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.index_version = index_version
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats: Dict[str, int] = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS answers ("
+            " key TEXT PRIMARY KEY,"
+            " index_version TEXT NOT NULL,"
+            " question TEXT NOT NULL,"
+            " embedding BLOB,"
+            " answer TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used)"
+        )
+        self._conn.commit()
+        self._purge_expired()
+        self._load_vectors()
+
+    def _key(self, question: str) -> str:
+        digest = hashlib.sha256()
+        digest.update(self.index_version.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(normalize_question(question).encode("utf-8"))
+        return digest.hexdigest()
+
+    def _purge_expired(self) -> None:
+        cutoff = time.time() - self.ttl_seconds
+        self._conn.execute("DELETE FROM answers WHERE created_at < ?", (cutoff,))
+        self._conn.commit()
+
+    def _load_vectors(self) -> None:
+        """Loads the normalized question embeddings of the current index version."""
+        self._vector_keys: List[str] = []
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        if self.embeddings is None:
+            return
+        rows = self._conn.execute(
+            "SELECT key, embedding FROM answers WHERE index_version = ? AND embedding IS NOT NULL",
+            (self.index_version,)
+        ).fetchall()
+        if rows:
+            self._vector_keys = [key for key, _ in rows]
+            self._vectors = np.stack([np.frombuffer(blob, dtype=np.float32) for _, blob in rows])
+
+    def _remove_vectors(self, keys) -> None:
+        keys = set(keys)
+        keep = [position for position, key in enumerate(self._vector_keys) if key not in keys]
+        if len(keep) != len(self._vector_keys):
+            self._vector_keys = [self._vector_keys[position] for position in keep]
+            self._vectors = self._vectors[keep]
+
+    def _fetch(self, key: str) -> Optional[str]:
+        """Returns the live answer of a key and marks it as recently used."""
+        row = self._conn.execute(
+            "SELECT answer, created_at FROM answers WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        answer, created_at = row
+        now = time.time()
+        if created_at < now - self.ttl_seconds:
+            self._conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+            self._conn.commit()
+            self._remove_vectors([key])
+            return None
+        self._conn.execute("UPDATE answers SET last_used = ? WHERE key = ?", (now, key))
+        self._conn.commit()
+        return answer
+
+    def lookup(self, question: str) -> CacheLookup:
+        """
+        Looks up the answer of a question in the exact tier, then in the semantic tier.
+
+        Returns:
+            CacheLookup: The answer and the tier that matched, or None for both on a miss.
+            On a semantic miss, the question embedding is returned to be reused by store.
+        """
+        with self._lock:
+            answer = self._fetch(self._key(question))
+            if answer is not None:
+                self.stats["exact_hits"] += 1
+            elif self.embeddings is None:
+                self.stats["misses"] += 1
+        if answer is not None:
+            return CacheLookup(answer, "exact")
+        if self.embeddings is None:
+            return CacheLookup(None, None)
+
+        embedding = self.embeddings.embed_query(question)
+        vector = _unit_vector(embedding)
+        with self._lock:
+            if self._vector_keys and self._vectors.shape[1] == vector.shape[0]:
+                similarities = self._vectors @ vector
+                best = int(np.argmax(similarities))
+                if similarities[best] >= self.similarity_threshold:
+                    answer = self._fetch(self._vector_keys[best])
+            self.stats["semantic_hits" if answer is not None else "misses"] += 1
+        if answer is not None:
+            return CacheLookup(answer, "semantic", embedding)
+        return CacheLookup(None, None, embedding)
+
+    def store(self, question: str, answer: str, embedding: Optional[List[float]] = None) -> None:
+        """Stores the answer of a question, evicting the least recently used entries."""
+        key = self._key(question)
+        vector = _unit_vector(embedding) if embedding is not None else None
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO answers"
+                " (key, index_version, question, embedding, answer, created_at, last_used)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, self.index_version, question,
+                 vector.tobytes() if vector is not None else None, answer, now, now)
+            )
+            self._remove_vectors([key])
+            if vector is not None and (not self._vector_keys
+                                       or self._vectors.shape[1] == vector.shape[0]):
+                self._vector_keys.append(key)
+                self._vectors = (np.vstack([self._vectors, vector]) if self._vectors.size
+                                 else vector[np.newaxis, :])
+
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM answers").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                evicted = [row[0] for row in self._conn.execute(
+                    "SELECT key FROM answers ORDER BY last_used ASC LIMIT ?", (excess,)
+                )]
+                self._conn.executemany("DELETE FROM answers WHERE key = ?",
+                                       [(evicted_key,) for evicted_key in evicted])
+                self._remove_vectors(evicted)
+                logging.info("Answer cache evicted %d entries", len(evicted))
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def _unit_vector(embedding: List[float]) -> np.ndarray:
+    vector = np.asarray(embedding, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
@@ -1,8 +1,6 @@
 
 import logging
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
 
 def split_text(documents, chunk_size=1200, chunk_overlap=300):
     """
@@ -29,6 +27,9 @@ def split_text(documents, chunk_size=1200, chunk_overlap=300):
     Ejemplo de uso:
     chunks = split_text(documents, chunk_size=1000, chunk_overlap=200)
     """
+    # Importado aquí para no cargar langchain_text_splitters cuando no hay que fragmentar
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
     try:
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=chunk_size, chunk_overlap=chunk_overlap
@@ -0,0 +1,189 @@
+"""
+src/context_packing.py
+
+This module assembles the context of the answer prompt from the retrieved chunks.
+The multi-query and fusion retrievers return several chunks per query variant, and
+consecutive chunks of a PDF overlap (chunk_overlap), so the raw list often holds the
+same text more than once and the prompt prefill time grows with it.
+
+The packer, in rank order:
+
+- drops the chunks whose text is already part of the context,
+- merges the chunks of the same source that overlap (the end of one is the start of
+  the other) into a single segment,
+- adds the segments, best ranked first, while they fit in the token budget.
+
+Tokens are estimated from the number of characters, which is enough to bound the
+prompt size without loading the tokenizer of the model.
+"""
+import dataclasses
+from typing import List, Optional, Sequence
+
+from langchain_core.documents import Document
+
+from src.settings import DEFAULT_CONTEXT_TOKEN_BUDGET
+from src.tracing import span
+
+# About 4 characters per token for English and Spanish text with Llama tokenizers
+DEFAULT_CHARS_PER_TOKEN = 4
+# Shortest common text accepted as the overlap of two chunks
+DEFAULT_MIN_OVERLAP = 40
+SEGMENT_SEPARATOR = "\n\n"
+
+
+def estimate_tokens(text: str, chars_per_token: int = DEFAULT_CHARS_PER_TOKEN) -> int:
+    """Returns an estimate of the number of tokens of a text."""
+    return -(-len(text) // chars_per_token)
+
+
+def overlap_length(left: str, right: str, min_overlap: int = DEFAULT_MIN_OVERLAP) -> int:
+    """
+    Returns the length of the longest suffix of left that is also a prefix of right,
+    0 if it is shorter than min_overlap.
+    """
+    if len(left) < min_overlap or len(right) < min_overlap:
+        return 0
+    probe = right[:min_overlap]
+    # The first match of the probe gives the longest overlap
+    position = left.find(probe, max(0, len(left) - len(right)))
+    while position != -1:
+        if right.startswith(left[position:]):
+            return len(left) - position
+        position = left.find(probe, position + 1)
+    return 0
+
+
+@dataclasses.dataclass
+class _Segment:
+    source: Optional[str]
+    text: str
+
+
+@dataclasses.dataclass
+class PackedContext:
+    """Represents the context of a prompt and how it was assembled."""
+    text: str
+    tokens: int
+    documents: int
+    duplicates: int
+    merged: int
+    segments: int
+    dropped: int
+    truncated: bool
+
+    def stats(self) -> dict:
+        """Returns the counters of the packing, for span attributes and metrics."""
+        return {
+            "context_tokens": self.tokens,
+            "context_documents": self.documents,
+            "context_duplicates": self.duplicates,
+            "context_merged": self.merged,
+            "context_segments": self.segments,
+            "context_dropped": self.dropped,
+            "context_truncated": self.truncated,
+        }
+
+
+class ContextPacker:
+    """Builds the prompt context from the ranked chunks, within a token budget."""
+
+    def __init__(
+        self,
+        token_budget: int = DEFAULT_CONTEXT_TOKEN_BUDGET,
+        chars_per_token: int = DEFAULT_CHARS_PER_TOKEN,
+        min_overlap: int = DEFAULT_MIN_OVERLAP
+    ):
+        if token_budget < 0:
+            raise ValueError("token_budget must be a non-negative integer, 0 for no limit")
+        if chars_per_token <= 0:
+            raise ValueError("chars_per_token must be a positive integer")
+        self.token_budget = token_budget
+        self.chars_per_token = chars_per_token
+        self.min_overlap = min_overlap
+
+    def _merge(self, segment: _Segment, text: str) -> bool:
+        """Extends the segment with an overlapping text of the same source."""
+        overlap = overlap_length(segment.text, text, self.min_overlap)
+        if overlap:
+            segment.text += text[overlap:]
+            return True
+        overlap = overlap_length(text, segment.text, self.min_overlap)
+        if overlap:
+            segment.text = text + segment.text[overlap:]
+            return True
+        if segment.text in text:
+            segment.text = text
+            return True
+        return False
+
+    def _segments(self, documents: Sequence[Document]) -> tuple:
+        segments: List[_Segment] = []
+        duplicates = merged = 0
+        for document in documents:
+            text = document.page_content.strip()
+            if not text or any(text in segment.text for segment in segments):
+                duplicates += 1
+                continue
+            source = document.metadata.get("source")
+            target = next((segment for segment in segments if segment.source == source
+                           and self._merge(segment, text)), None)
+            if target is None:
+                segments.append(_Segment(source, text))
+                continue
+            merged += 1
+            # The extended segment may now overlap a lower ranked one
+            for other in [segment for segment in segments
+                          if segment is not target and segment.source == source]:
+                if self._merge(target, other.text):
+                    segments.remove(other)
+                    merged += 1
+        return segments, duplicates, merged
+
+    def pack(self, documents: Sequence[Document]) -> PackedContext:
+        """
+        Assembles the context of the ranked documents.
+
+        Args:
+            documents (Sequence[Document]): Retrieved chunks, best ranked first.
+
+        Returns:
+            PackedContext: The context text and the counters of the packing.
+        """
+        segments, duplicates, merged = self._segments(documents)
+        budget = self.token_budget
+        separator_tokens = estimate_tokens(SEGMENT_SEPARATOR, self.chars_per_token)
+        parts: List[str] = []
+        tokens = dropped = 0
+        truncated = False
+        for segment in segments:
+            segment_tokens = estimate_tokens(segment.text, self.chars_per_token)
+            if parts:
+                segment_tokens += separator_tokens
+            if budget and tokens + segment_tokens > budget:
+                if parts:
+                    # Smaller, lower ranked segments may still fit
+                    dropped += 1
+                    continue
+                # The best ranked segment alone exceeds the budget: keep its start
+                segment.text = segment.text[:budget * self.chars_per_token]
+                segment_tokens = estimate_tokens(segment.text, self.chars_per_token)
+                truncated = True
+            parts.append(segment.text)
+            tokens += segment_tokens
+        return PackedContext(
+            text=SEGMENT_SEPARATOR.join(parts),
+            tokens=tokens,
+            documents=len(documents),
+            duplicates=duplicates,
+            merged=merged,
+            segments=len(parts),
+            dropped=dropped,
+            truncated=truncated,
+        )
+
+    def __call__(self, documents: Sequence[Document]) -> str:
+        """Returns the context text, traced as a "context_packing" span with its counters."""
+        with span("context_packing", documents=len(documents)) as packing_span:
+            packed = self.pack(documents)
+            packing_span.set(**packed.stats())
+        return packed.text
@@ -1,23 +1,18 @@
 """
 src/data.py
 
-This module defines data structures (dataclasses) and functions for interacting with
-Firebase Realtime Database. It provides a way to serialize and save structured
-data, including system information, model details, and question-answer pairs.
+This module defines data structures (dataclasses) and functions for saving the
+results of a run. It provides a way to serialize and save structured data,
+including system information, model details, and question-answer pairs, through
+a results sink (see src/results_sink.py), Firebase Realtime Database by default.
 """
 import dataclasses
-import os
 
 from datetime import datetime
 
-from typing import Dict, List
+from typing import Any, Dict, List
 
-import firebase_admin
-from firebase_admin import credentials, db
-
-# Initialize Firebase Admin SDK (only once)
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-firebase_admin.initialize_app(cred, {"databaseURL": os.getenv("FIREBASE_URL")})
+from src.results_sink import BackgroundWriter
 
 
 @dataclasses.dataclass
@@ -56,7 +51,7 @@ class DataPayload:
     server_data: SystemInfo
     performance_data: Dict[str, float]
     model_info: ModelInfo
-    questions_and_answers: List[Dict[str, str]]
+    questions_and_answers: List[Dict[str, Any]]
 
 def serialize_data_payload(data_payload: DataPayload) -> Dict:
     """
@@ -84,18 +79,24 @@ def serialize_data_payload(data_payload: DataPayload) -> Dict:
             "embedding_model": data_payload.model_info.embedding_model
         },
         "questions_and_answers": [
-            {"question": qa["question"], "answer": qa["answer"]}  # Access as dictionary keys
+            # Keep per-query metrics such as latency_seconds next to the Q&A pair
+            dict(qa)
             for qa in data_payload.questions_and_answers
         ]
     }
 
 
-def save_data(data_payload: DataPayload):
+def save_data(data_payload: DataPayload, writer: BackgroundWriter):
     """
-    Saves the data payload to Firebase Realtime Database.
+    Queues the data payload for delivery to the results sink.
+
+    The payload is written to the durable queue of the writer and sent in the
+    background, so this function neither waits for the network nor fails when the
+    sink is unreachable.
 
     Args:
         data_payload (DataPayload): The data payload object to be saved.
+        writer (BackgroundWriter): The writer delivering the results.
     """
     try:
         now = datetime.now()
@@ -106,13 +107,9 @@ def save_data(data_payload: DataPayload):
         # Serialize the DataPayload object, including the timestamp
         data = serialize_data_payload(data_payload)
 
-        # Get a reference to the database, creating a new node with the timestamp in the key
-        ref = db.reference(f"/{data_payload.server_name}/{timestamp_str}")
-
-        # Push the data to the database
-        ref.set(data)
-
-        print(f"Data sent successfully to Firebase at /{data_payload.server_name}")
+        # The key creates a new node per run, with the timestamp in the key
+        if writer.submit({"key": f"{data_payload.server_name}/{timestamp_str}", "data": data}):
+            print(f"Data queued for /{data_payload.server_name}")
 
     except (Exception) as e:
-        print(f"An error occurred while saving data to Firebase: {e}")
+        print(f"An error occurred while saving data: {e}")
@@ -0,0 +1,183 @@
+"""
+src/dedup.py
+
+This module removes duplicate and near-duplicate chunks before they are embedded.
+PDFs repeat headers, footers and boilerplate pages, and consecutive chunks overlap,
+so a share of the chunks carry text that is already in the index: embedding them
+costs requests and fills the retrieved context with the same text.
+
+Each chunk is normalized (lowercase, collapsed whitespace) and reduced to the set of
+its word shingles. Chunks with the same normalized text are exact duplicates. For
+the rest, a MinHash signature estimates the Jaccard similarity of the shingle sets,
+and locality-sensitive hashing (LSH) over bands of the signature finds the
+previously kept chunks that may be similar without comparing every pair.
+
+The first chunk of each group is kept. The sources and pages of the chunks dropped
+in its favour are added to its metadata under "duplicates", so the provenance of the
+removed text is not lost.
+"""
+import dataclasses
+import hashlib
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+
+from src.settings import DEFAULT_DEDUP_NUM_PERM, DEFAULT_DEDUP_THRESHOLD
+
+DEFAULT_SHINGLE_SIZE = 5
+# Rows per LSH band: with 64 permutations, 16 bands of 4 rows make pairs above a
+# Jaccard similarity of about 0.5 likely candidates, which are then checked against
+# the threshold
+DEFAULT_BAND_ROWS = 4
+
+# Metadata copied from a dropped chunk to the "duplicates" list of the kept one
+PROVENANCE_KEYS = ("source", "file_name", "page_number", "page")
+
+# Prime above 2**32 for the universal hashes (a * x + b) mod p of the permutations
+_PRIME = (1 << 32) + 15
+_WHITESPACE = re.compile(r"\s+")
+
+
+@dataclasses.dataclass
+class DedupStats:
+    """Represents the work done by a ChunkDeduplicator."""
+    chunks_in: int = 0
+    chunks_out: int = 0
+    exact_duplicates: int = 0
+    near_duplicates: int = 0
+
+    @property
+    def removed(self) -> int:
+        """Number of chunks that are not embedded."""
+        return self.exact_duplicates + self.near_duplicates
+
+
+class ChunkDeduplicator:
+    """
+    Drops the chunks that duplicate, or nearly duplicate, a chunk already seen.
+
+    The deduplicator keeps its state across calls to ``filter``, so the chunks of a
+    streamed corpus can be filtered batch by batch. A threshold of 0, the default,
+    keeps every chunk.
+    """
+
+    def __init__(
+        self,
+        threshold: float = DEFAULT_DEDUP_THRESHOLD,
+        num_perm: int = DEFAULT_DEDUP_NUM_PERM,
+        shingle_size: int = DEFAULT_SHINGLE_SIZE,
+        band_rows: int = DEFAULT_BAND_ROWS,
+        seed: int = 1
+    ):
+        if not 0 <= threshold <= 1:
+            raise ValueError("threshold must be in [0, 1]")
+        if num_perm <= 0 or band_rows <= 0 or num_perm % band_rows:
+            raise ValueError("num_perm must be a positive multiple of band_rows")
+        if shingle_size <= 0:
+            raise ValueError("shingle_size must be a positive integer")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.band_rows = band_rows
+        self.stats = DedupStats()
+        rng = np.random.default_rng(seed)
+        # a < 2**31 and x < 2**32 keep a * x + b within uint64
+        self._a = rng.integers(1, 1 << 31, size=(num_perm, 1), dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 32, size=(num_perm, 1), dtype=np.uint64)
+        self._exact: Dict[bytes, Document] = {}
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+        self._kept: List[Document] = []
+
+    def params(self) -> dict:
+        """Returns the parameters that change which chunks are kept, for cache keys."""
+        return {
+            "threshold": self.threshold,
+            "num_perm": self.num_perm,
+            "shingle_size": self.shingle_size,
+            "band_rows": self.band_rows,
+        }
+
+    def _shingles(self, words: List[str]) -> np.ndarray:
+        if len(words) <= self.shingle_size:
+            shingles = {" ".join(words)}
+        else:
+            shingles = {" ".join(words[position:position + self.shingle_size])
+                        for position in range(len(words) - self.shingle_size + 1)}
+        return np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingles),
+                           dtype=np.uint64, count=len(shingles))
+
+    def signature(self, text: str) -> np.ndarray:
+        """Returns the MinHash signature of the word shingles of a text."""
+        hashes = self._shingles(_WHITESPACE.sub(" ", text.lower()).split())
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def _bands(self, signature: np.ndarray) -> Iterable[Tuple[int, bytes]]:
+        for band in range(self.num_perm // self.band_rows):
+            rows = signature[band * self.band_rows:(band + 1) * self.band_rows]
+            yield band, rows.tobytes()
+
+    def _near_duplicate_of(self, signature: np.ndarray) -> Optional[Document]:
+        checked = set()
+        for band in self._bands(signature):
+            for candidate in self._buckets.get(band, ()):
+                if candidate in checked:
+                    continue
+                checked.add(candidate)
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.threshold:
+                    return self._kept[candidate]
+        return None
+
+    def filter(self, chunks: Iterable[Document]) -> List[Document]:
+        """
+        Returns the chunks that do not duplicate a chunk kept before, in order.
+
+        Args:
+            chunks (Iterable[Document]): Chunks to filter.
+
+        Returns:
+            List[Document]: The kept chunks. Their metadata lists the provenance of
+            the chunks dropped in their favour under "duplicates".
+        """
+        if not self.threshold:
+            kept = list(chunks)
+            self.stats.chunks_in += len(kept)
+            self.stats.chunks_out += len(kept)
+            return kept
+        kept = []
+        for chunk in chunks:
+            self.stats.chunks_in += 1
+            normalized = _WHITESPACE.sub(" ", chunk.page_content.lower()).strip()
+            digest = hashlib.sha1(normalized.encode("utf-8")).digest()
+            original = self._exact.get(digest)
+            if original is not None:
+                self.stats.exact_duplicates += 1
+                _add_provenance(original, chunk)
+                continue
+            signature = None
+            if self.threshold < 1:
+                signature = self.signature(normalized)
+                original = self._near_duplicate_of(signature)
+                if original is not None:
+                    self.stats.near_duplicates += 1
+                    _add_provenance(original, chunk)
+                    continue
+                position = len(self._kept)
+                for band in self._bands(signature):
+                    self._buckets.setdefault(band, []).append(position)
+                self._signatures.append(signature)
+                self._kept.append(chunk)
+            self._exact[digest] = chunk
+            kept.append(chunk)
+        self.stats.chunks_out += len(kept)
+        return kept
+
+
+def _add_provenance(original: Document, duplicate: Document) -> None:
+    provenance = {key: duplicate.metadata[key] for key in PROVENANCE_KEYS
+                  if key in duplicate.metadata}
+    original.metadata.setdefault("duplicates", []).append(provenance)
@@ -0,0 +1,154 @@
+"""
+src/embedding_cache.py
+
+This module implements a content-addressed cache of chunk embeddings. Vectors are
+stored as float32 blobs in a local SQLite database, keyed by a hash of the chunk
+text and the embedding model, and the least recently used entries are evicted
+once the store grows past its size limit.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Sequence
+
+from langchain_core.embeddings import Embeddings
+
+from src.settings import DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES
+
+# SQLite limits the number of host parameters of a single statement
+_SQL_BATCH_SIZE = 500
+
+
+def embedding_key(text: str, model_name: str) -> str:
+    """
+    Computes the cache key of a chunk embedding.
+
+    Args:
+        text (str): Text of the chunk.
+        model_name (str): Name of the embedding model.
+
+    Returns:
+        str: The hexadecimal key.
+    """
+    digest = hashlib.sha256()
+    digest.update(model_name.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class EmbeddingStore:
+    """SQLite store of float32 vectors with size-bounded LRU eviction."""
+
+    def __init__(self, path: str, max_entries: int = DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES):
+        if max_entries <= 0:
+            raise ValueError("max_entries must be a positive integer")
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " key TEXT PRIMARY KEY,"
+            " vector BLOB NOT NULL,"
+            " last_used REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)"
+        )
+        self._conn.commit()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        """Returns the stored vectors of the given keys and marks them as recently used."""
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(keys), _SQL_BATCH_SIZE):
+                batch = list(keys[start:start + _SQL_BATCH_SIZE])
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def put_many(self, items: Dict[str, List[float]]) -> None:
+        """Stores the given vectors and evicts the least recently used entries if needed."""
+        if not items:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+            )
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            excess = count - self.max_entries
+            if excess > 0:
+                self._conn.execute(
+                    "DELETE FROM embeddings WHERE key IN "
+                    "(SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)",
+                    (excess,)
+                )
+                logging.info("Embedding cache evicted %d entries", excess)
+            self._conn.commit()
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that only sends the chunks missing from the store to the
+    underlying embeddings model. Queries are always embedded by the wrapped model.
+    """
+
+    def __init__(self, embeddings: Embeddings, model_name: str, store: EmbeddingStore):
+        self.embeddings = embeddings
+        self.model_name = model_name
+        self.store = store
+        self.hits = 0
+        self.misses = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [embedding_key(text, self.model_name) for text in texts]
+        vectors = self.store.get_many(keys)
+
+        # Embed each distinct missing text only once
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors and key not in missing:
+                missing[key] = text
+        if missing:
+            new_vectors = self.embeddings.embed_documents(list(missing.values()))
+            computed = dict(zip(missing.keys(), new_vectors))
+            self.store.put_many(computed)
+            vectors.update(computed)
+
+        misses = len(missing)
+        self.misses += misses
+        self.hits += len(texts) - misses
+        logging.info("Embedding cache: %d hits, %d misses", len(texts) - misses, misses)
+        return [vectors[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embeddings.embed_query(text)
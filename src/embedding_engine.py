@@ -0,0 +1,112 @@
+"""
+src/embedding_engine.py
+
+This module implements an embedding engine for Ollama that splits the chunks in
+batches of a fixed size and keeps a bounded number of batch requests in flight,
+so the embedding server is never left idle between requests. Requests that fail
+transiently (connection errors, timeouts, rate limiting, server errors) are retried
+with exponential backoff; other errors are raised at once.
+"""
+import logging
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Union
+
+import httpx
+import ollama
+from langchain_core.embeddings import Embeddings
+
+from src.settings import (
+    DEFAULT_EMBED_BATCH_SIZE,
+    DEFAULT_EMBED_MAX_IN_FLIGHT,
+    DEFAULT_EMBED_MAX_RETRIES,
+)
+from src.tracing import propagate, span
+
+DEFAULT_BACKOFF_SECONDS = 0.5
+
+
+def _is_transient_error(error: Exception) -> bool:
+    """
+    Returns whether a failed Ollama request may succeed if it is sent again: connection
+    and timeout errors, rate limiting (429) and server errors (5xx). A missing model,
+    an invalid input or a malformed response fail the same way on every attempt.
+    """
+    if isinstance(error, ollama.ResponseError):
+        return error.status_code == 429 or error.status_code >= 500
+    # ollama.Client raises ConnectionError when the server cannot be reached
+    return isinstance(error, (httpx.TransportError, ConnectionError))
+
+
+class BatchedOllamaEmbeddings(Embeddings):
+    """Ollama embeddings with configurable batch size, parallelism and retries."""
+
+    def __init__(
+        self,
+        model: str,
+        batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+        max_in_flight: int = DEFAULT_EMBED_MAX_IN_FLIGHT,
+        max_retries: int = DEFAULT_EMBED_MAX_RETRIES,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        host: Optional[str] = None,
+        client: Optional[ollama.Client] = None,
+        keep_alive: Union[str, int, None] = None
+    ):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+        if max_in_flight <= 0:
+            raise ValueError("max_in_flight must be a positive integer")
+        if max_retries < 0:
+            raise ValueError("max_retries must be a non-negative integer")
+        self.model = model
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self.keep_alive = keep_alive
+        # ollama.Client keeps a pool of HTTP connections shared by all the batches
+        self.client = client if client is not None else ollama.Client(host=host)
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embeds one batch, retrying transient failures with exponential backoff and jitter."""
+        attempt = 0
+        with span("embedding_batch", texts=len(texts)) as batch_span:
+            while True:
+                try:
+                    response = self.client.embed(model=self.model, input=texts,
+                                                 keep_alive=self.keep_alive)
+                    vectors = response["embeddings"]
+                    if len(vectors) != len(texts):
+                        raise ValueError(f"Ollama returned {len(vectors)} embeddings "
+                                         f"for {len(texts)} texts")
+                    batch_span.set(retries=attempt)
+                    return [list(vector) for vector in vectors]
+                except Exception as e:
+                    if attempt >= self.max_retries or not _is_transient_error(e):
+                        raise
+                    delay = self.backoff_seconds * (2 ** attempt) * random.uniform(0.8, 1.2)
+                    attempt += 1
+                    logging.warning(
+                        "Embedding batch of %d texts failed (%s), retry %d/%d in %.2fs",
+                        len(texts), e, attempt, self.max_retries, delay
+                    )
+                    time.sleep(delay)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [
+            texts[start:start + self.batch_size]
+            for start in range(0, len(texts), self.batch_size)
+        ]
+        if len(batches) <= 1 or self.max_in_flight == 1:
+            results = [self._embed_batch(batch) for batch in batches]
+        else:
+            workers = min(self.max_in_flight, len(batches))
+            with ThreadPoolExecutor(max_workers=workers,
+                                    thread_name_prefix="embedding") as executor:
+                # map keeps the batches in order
+                results = list(executor.map(propagate(self._embed_batch), batches))
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed_batch([text])[0]
@@ -0,0 +1,183 @@
+"""
+src/faiss_index.py
+
+This module builds the FAISS index behind the vector database. Besides the exact flat
+index built by LangChain, it supports approximate index types for large corpora:
+
+- "flat": exact search over float32 vectors.
+- "ivf": inverted file, only the nprobe closest of nlist clusters are searched.
+- "hnsw": graph-based search, no training needed.
+- "ivfpq": inverted file with product-quantized vectors, the smallest in memory.
+
+IVF indexes need training. Until there are enough vectors to train them, the flat
+index is kept; once there are, the vectors are moved to the trained index.
+"""
+import dataclasses
+import logging
+import math
+from typing import Dict, Optional
+
+import faiss
+import numpy as np
+
+from src.settings import (
+    DEFAULT_FAISS_EF_SEARCH,
+    DEFAULT_FAISS_HNSW_M,
+    DEFAULT_FAISS_INDEX_TYPE,
+    DEFAULT_FAISS_NLIST,
+    DEFAULT_FAISS_NPROBE,
+    DEFAULT_FAISS_PQ_M,
+    FAISS_INDEX_TYPES,
+)
+
+# FAISS recommends at least 39 training vectors per centroid
+_TRAINING_POINTS_PER_CENTROID = 39
+_PQ_CENTROIDS = 256
+
+
+@dataclasses.dataclass
+class IndexOptions:
+    """Represents the type and parameters of a FAISS index."""
+    index_type: str = DEFAULT_FAISS_INDEX_TYPE
+    nlist: int = DEFAULT_FAISS_NLIST  # 0: about 4 * sqrt(number of vectors)
+    pq_m: int = DEFAULT_FAISS_PQ_M  # 0: one sub-quantizer per 8 dimensions
+    hnsw_m: int = DEFAULT_FAISS_HNSW_M
+    nprobe: int = DEFAULT_FAISS_NPROBE
+    ef_search: int = DEFAULT_FAISS_EF_SEARCH
+
+    def __post_init__(self):
+        if self.index_type not in FAISS_INDEX_TYPES:
+            raise ValueError(f"index_type must be one of {', '.join(FAISS_INDEX_TYPES)}")
+
+    def build_params(self) -> Dict[str, object]:
+        """Returns the parameters that change the built index, for cache keys."""
+        if self.index_type == "flat":
+            return {"type": "flat"}
+        if self.index_type == "hnsw":
+            return {"type": "hnsw", "hnsw_m": self.hnsw_m}
+        params = {"type": self.index_type, "nlist": self.nlist}
+        if self.index_type == "ivfpq":
+            params["pq_m"] = self.pq_m
+        return params
+
+
+def _nlist(options: IndexOptions, n_vectors: int) -> int:
+    if options.nlist > 0:
+        return options.nlist
+    return max(1, int(4 * math.sqrt(n_vectors)))
+
+
+def _pq_m(options: IndexOptions, dimensions: int) -> int:
+    if options.pq_m > 0:
+        return options.pq_m
+    # The number of sub-quantizers must divide the number of dimensions
+    target = max(1, dimensions // 8)
+    return max(m for m in range(1, target + 1) if dimensions % m == 0)
+
+
+def min_training_vectors(options: IndexOptions, n_vectors: int) -> int:
+    """Returns the number of vectors needed to train the index, 0 if it needs no training."""
+    if options.index_type in ("flat", "hnsw"):
+        return 0
+    required = _TRAINING_POINTS_PER_CENTROID * _nlist(options, n_vectors)
+    if options.index_type == "ivfpq":
+        required = max(required, _TRAINING_POINTS_PER_CENTROID * _PQ_CENTROIDS)
+    return required
+
+
+def factory_string(options: IndexOptions, n_vectors: int, dimensions: int) -> str:
+    """Returns the faiss.index_factory description of the index."""
+    if options.index_type == "flat":
+        return "Flat"
+    if options.index_type == "hnsw":
+        return f"HNSW{options.hnsw_m}"
+    nlist = _nlist(options, n_vectors)
+    if options.index_type == "ivf":
+        return f"IVF{nlist},Flat"
+    return f"IVF{nlist},PQ{_pq_m(options, dimensions)}"
+
+
+def configure_search(index, options: IndexOptions) -> None:
+    """Sets the search-time parameters (nprobe, efSearch) of an index."""
+    try:
+        faiss.extract_index_ivf(index).nprobe = options.nprobe
+    except RuntimeError:
+        pass  # Not an IVF index
+    hnsw = getattr(index, "hnsw", None)
+    if hnsw is not None:
+        hnsw.efSearch = options.ef_search
+
+
+def build_index(vectors: np.ndarray, options: IndexOptions):
+    """
+    Builds an index of the given type containing the vectors.
+
+    Args:
+        vectors (np.ndarray): float32 matrix with one vector per row.
+        options (IndexOptions): Type and parameters of the index.
+
+    Returns:
+        faiss.Index: The index. A flat index if there are too few vectors to train
+        the requested type.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n_vectors, dimensions = vectors.shape
+    required = min_training_vectors(options, n_vectors)
+    if n_vectors < required:
+        logging.info("Keeping a flat index: %s needs %d vectors to train, there are %d",
+                     options.index_type, required, n_vectors)
+        options = dataclasses.replace(options, index_type="flat")
+
+    index = faiss.index_factory(dimensions, factory_string(options, n_vectors, dimensions),
+                                faiss.METRIC_L2)
+    if not index.is_trained:
+        index.train(vectors)
+    configure_search(index, options)
+    index.add(vectors)
+    return index
+
+
+def is_flat(index) -> bool:
+    """Returns True if the index performs an exact search over float32 vectors."""
+    return isinstance(index, faiss.IndexFlat)
+
+
+def apply_index_type(vector_db, options: IndexOptions) -> bool:
+    """
+    Moves the vectors of a FAISS vector database to the configured index type.
+
+    Only a flat index is converted, since it can return its vectors exactly. The
+    docstore and the ids are unchanged because the vectors keep their positions.
+
+    Args:
+        vector_db (FAISS): The vector database.
+        options (IndexOptions): Type and parameters of the index.
+
+    Returns:
+        bool: True if the index was replaced.
+    """
+    index = vector_db.index
+    if options.index_type == "flat" or not is_flat(index) or index.ntotal == 0:
+        configure_search(index, options)
+        return False
+    if index.ntotal < min_training_vectors(options, index.ntotal):
+        return False
+    vectors = index.reconstruct_n(0, index.ntotal)
+    vector_db.index = build_index(vectors, options)
+    logging.info("FAISS index converted to %s (%d vectors)", options.index_type, index.ntotal)
+    return True
+
+
+def index_memory_bytes(index) -> int:
+    """Returns the serialized size of an index, an estimate of its memory usage."""
+    return int(faiss.serialize_index(index).nbytes)
+
+
+def exact_search(vectors: np.ndarray, queries: np.ndarray, k: int,
+                 reference: Optional[object] = None) -> np.ndarray:
+    """Returns the ids of the exact k nearest neighbors of each query."""
+    if reference is None:
+        reference = faiss.IndexFlatL2(vectors.shape[1])
+        reference.add(np.ascontiguousarray(vectors, dtype=np.float32))
+    _, ids = reference.search(np.ascontiguousarray(queries, dtype=np.float32), k)
+    return ids
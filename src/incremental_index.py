@@ -0,0 +1,437 @@
+"""
+src/incremental_index.py
+
+This module updates the cached vector database of a corpus when its PDFs change,
+instead of rebuilding it. Each index cache entry written here holds a manifest with the
+SHA-256 of every indexed PDF and the ids of the chunks it produced, and a pointer file
+per corpus location and index settings names the entry of the current version. On the
+next run:
+
+- the PDFs that are new or whose hash changed are parsed, chunked and embedded,
+- the vectors and chunks of the removed and changed PDFs are deleted,
+- the PDFs with the same hash are neither parsed nor embedded again.
+
+The changes are applied to a copy of the docstore and to the vectors of the previous
+entry, saved as the entry of the new corpus fingerprint, and the pointer file is then
+replaced atomically. An interrupted update leaves the previous version in use, and a
+process serving queries keeps reading the files it has open.
+"""
+import dataclasses
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import tempfile
+import uuid
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from src.faiss_index import IndexOptions, apply_index_type, build_index, is_flat
+from src.index_cache import LEXICAL_INDEX_FILE, file_sha256
+from src.lexical_index import LexicalIndex
+from src.mmap_store import (
+    DOCSTORE_FILE,
+    INDEX_FILE,
+    SQLiteDocstore,
+    SQLiteIndexToDocstoreId,
+    read_index,
+    save_vector_db,
+)
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_FORMAT_VERSION = 1
+POINTER_SUFFIX = ".current.json"
+
+
+def _write_json(path: str, data: dict) -> None:
+    """Writes a JSON file through a temporary file renamed into place."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, indent=2, sort_keys=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> Optional[dict]:
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning("Ignoring unreadable file %s: %s", path, e)
+        return None
+    if data.get("format") != MANIFEST_FORMAT_VERSION:
+        return None
+    return data
+
+
+def read_manifest(entry_dir: str) -> Optional[Dict[str, dict]]:
+    """
+    Reads the manifest of an index cache entry.
+
+    Args:
+        entry_dir (str): Directory of the entry.
+
+    Returns:
+        Dict[str, dict]: The record of each indexed PDF by path: its "sha256", "size",
+        "mtime_ns" and "chunk_ids".
+        None: If the entry has no readable manifest.
+    """
+    data = _read_json(os.path.join(entry_dir, MANIFEST_FILE))
+    return data["files"] if data is not None else None
+
+
+def read_pointer(cache_dir: str, settings_key: str) -> Optional[str]:
+    """Returns the key of the current entry of a corpus location and settings, if any."""
+    data = _read_json(os.path.join(cache_dir, settings_key + POINTER_SUFFIX))
+    return data["entry"] if data is not None else None
+
+
+def _write_pointer(cache_dir: str, settings_key: str, cache_key: str) -> None:
+    _write_json(os.path.join(cache_dir, settings_key + POINTER_SUFFIX),
+                {"format": MANIFEST_FORMAT_VERSION, "entry": cache_key})
+
+
+def _is_referenced(cache_dir: str, cache_key: str) -> bool:
+    """Returns whether the pointer of any corpus location and settings names an entry."""
+    for name in os.listdir(cache_dir):
+        if name.endswith(POINTER_SUFFIX):
+            data = _read_json(os.path.join(cache_dir, name))
+            if data is not None and data.get("entry") == cache_key:
+                return True
+    return False
+
+
+@dataclasses.dataclass
+class IndexUpdate:
+    """Represents the changes of a corpus since the entry its index is updated from."""
+    settings_key: str
+    base_key: Optional[str]
+    base_files: Dict[str, dict]
+    file_hashes: Dict[str, str]
+    file_states: Dict[str, Tuple[int, int]]
+    added: List[str]
+    changed: List[str]
+    removed: List[str]
+    # Unchanged PDFs whose duplicate chunks were only indexed through a removed chunk
+    reindexed: List[str]
+    unchanged: List[str]
+
+    @property
+    def files_to_parse(self) -> List[str]:
+        """PDFs to parse, chunk and embed."""
+        return sorted(self.added + self.changed + self.reindexed)
+
+    @property
+    def removed_chunk_ids(self) -> List[str]:
+        """Ids of the chunks deleted from the index."""
+        return [chunk_id for path in self.removed + self.changed + self.reindexed
+                for chunk_id in self.base_files[path]["chunk_ids"]]
+
+    def indexed_files(self, loaded_files: Iterable[str]) -> List[str]:
+        """PDFs of the updated index: the unchanged ones and the ones parsed again."""
+        return sorted(set(self.unchanged) | set(loaded_files))
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the counters of the update, for span attributes and metrics."""
+        return {
+            "index_files_added": len(self.added),
+            "index_files_changed": len(self.changed),
+            "index_files_removed": len(self.removed),
+            "index_files_reindexed": len(self.reindexed),
+            "index_files_unchanged": len(self.unchanged),
+        }
+
+
+def _file_state(path: str) -> Tuple[int, int]:
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _duplicate_sources(docstore_path: str, chunk_ids: Sequence[str]) -> set:
+    """Returns the sources of the duplicates dropped in favour of the given chunks."""
+    sources = set()
+    conn = sqlite3.connect(f"file:{docstore_path}?mode=ro", uri=True)
+    try:
+        for chunk_id in chunk_ids:
+            row = conn.execute("SELECT metadata FROM documents WHERE doc_id = ?",
+                               (chunk_id,)).fetchone()
+            if row is None:
+                continue
+            for duplicate in json.loads(row[0]).get("duplicates", []):
+                if duplicate.get("source"):
+                    sources.add(duplicate["source"])
+    finally:
+        conn.close()
+    return sources
+
+
+def plan_update(pdf_files: Sequence[str], cache_dir: str, settings_key: str) -> IndexUpdate:
+    """
+    Compares the PDFs of the corpus with the manifest of its current index cache entry.
+
+    A PDF whose size and modification time match its manifest record is not read
+    again to compute its hash.
+
+    Args:
+        pdf_files (Sequence[str]): Paths of the PDFs of the corpus.
+        cache_dir (str): Root directory of the index cache.
+        settings_key (str): Key returned by ``settings_fingerprint``.
+
+    Returns:
+        IndexUpdate: The PDFs to add, update and delete. Every PDF is added when there
+        is no previous entry.
+    """
+    base_key = read_pointer(cache_dir, settings_key)
+    base_files = None
+    if base_key is not None:
+        base_files = read_manifest(os.path.join(cache_dir, base_key))
+    if base_files is None:
+        base_key = None
+        base_files = {}
+
+    file_hashes: Dict[str, str] = {}
+    file_states: Dict[str, Tuple[int, int]] = {}
+    added, changed, unchanged = [], [], []
+    for path in sorted(set(pdf_files)):
+        state = _file_state(path)
+        record = base_files.get(path)
+        if record is not None and (record["size"], record["mtime_ns"]) == state:
+            file_hashes[path] = record["sha256"]
+        else:
+            file_hashes[path] = file_sha256(path)
+        file_states[path] = state
+        if record is None:
+            added.append(path)
+        elif record["sha256"] != file_hashes[path]:
+            changed.append(path)
+        else:
+            unchanged.append(path)
+    removed = sorted(set(base_files) - set(file_hashes))
+
+    # A chunk kept by the deduplication stands for its duplicates in other PDFs: when
+    # it is deleted, those PDFs are indexed again so that their text stays searchable
+    reindexed: List[str] = []
+    pending = [chunk_id for path in removed + changed
+               for chunk_id in base_files[path]["chunk_ids"]]
+    docstore_path = os.path.join(cache_dir, base_key or "", DOCSTORE_FILE)
+    while pending and base_key is not None:
+        sources = _duplicate_sources(docstore_path, pending) & set(unchanged)
+        pending = []
+        for path in sorted(sources):
+            unchanged.remove(path)
+            reindexed.append(path)
+            pending.extend(base_files[path]["chunk_ids"])
+
+    return IndexUpdate(
+        settings_key=settings_key,
+        base_key=base_key,
+        base_files=base_files,
+        file_hashes=file_hashes,
+        file_states=file_states,
+        added=added,
+        changed=changed,
+        removed=removed,
+        reindexed=reindexed,
+        unchanged=unchanged,
+    )
+
+
+def _copy_docstore(source: str, destination: str) -> None:
+    """Copies a SQLite docstore with the backup API, consistent even if it is open."""
+    source_conn = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+    destination_conn = sqlite3.connect(destination)
+    try:
+        source_conn.backup(destination_conn)
+    finally:
+        destination_conn.close()
+        source_conn.close()
+
+
+def _positions(docstore: SQLiteDocstore) -> List[str]:
+    with docstore.lock:
+        return [row[0] for row in docstore.conn.execute(
+            "SELECT doc_id FROM positions ORDER BY position")]
+
+
+def _write_positions(docstore: SQLiteDocstore, doc_ids: Sequence[str]) -> None:
+    with docstore.lock:
+        docstore.conn.execute("DELETE FROM positions")
+        docstore.conn.executemany("INSERT INTO positions (position, doc_id) VALUES (?, ?)",
+                                  enumerate(doc_ids))
+        docstore.conn.commit()
+
+
+def _vectors(index) -> np.ndarray:
+    """Returns the vectors of an index, approximated for product-quantized indexes."""
+    try:
+        faiss.extract_index_ivf(index).make_direct_map()
+    except RuntimeError:
+        pass  # Not an IVF index
+    return index.reconstruct_n(0, index.ntotal)
+
+
+def _update_vectors(index, keep: List[int], vectors: np.ndarray, options: IndexOptions):
+    """
+    Deletes the vectors whose position is not kept and appends the new ones, keeping the
+    positions contiguous. A flat index removes vectors in place; the other types, whose
+    ids are not renumbered on removal (IVF) or that cannot remove vectors (HNSW), are
+    rebuilt from their remaining vectors, without embedding them again.
+    """
+    if len(keep) < index.ntotal:
+        if not is_flat(index):
+            kept = _vectors(index)[keep]
+            return build_index(np.vstack([kept, vectors]) if len(vectors) else kept, options)
+        removed = np.setdiff1d(np.arange(index.ntotal, dtype=np.int64),
+                               np.asarray(keep, dtype=np.int64))
+        index.remove_ids(removed)
+    if len(vectors):
+        index.add(vectors)
+    return index
+
+
+def _chunk_ids(chunks: Sequence[Document]) -> Tuple[List[str], Dict[str, List[str]]]:
+    """Returns new ids for the chunks, in order and grouped by source."""
+    chunk_ids = [str(uuid.uuid4()) for _ in chunks]
+    ids_by_source: Dict[str, List[str]] = {}
+    for chunk_id, chunk in zip(chunk_ids, chunks):
+        ids_by_source.setdefault(chunk.metadata.get("source"), []).append(chunk_id)
+    return chunk_ids, ids_by_source
+
+
+def _manifest(update: IndexUpdate, loaded_files: Iterable[str],
+              ids_by_source: Dict[str, List[str]]) -> dict:
+    files = {path: update.base_files[path] for path in update.unchanged}
+    for path in loaded_files:
+        size, mtime_ns = update.file_states[path]
+        files[path] = {
+            "sha256": update.file_hashes[path],
+            "size": size,
+            "mtime_ns": mtime_ns,
+            # Empty when every chunk of the PDF was a duplicate
+            "chunk_ids": ids_by_source.get(path, []),
+        }
+    return {"format": MANIFEST_FORMAT_VERSION, "files": files}
+
+
+def _build_entry(tmp_dir: str, chunks: Sequence[Document], embeddings: Embeddings,
+                 options: IndexOptions) -> Tuple[FAISS, Dict[str, List[str]]]:
+    """Builds the first entry of a corpus, with every chunk."""
+    chunk_ids, ids_by_source = _chunk_ids(chunks)
+    vector_db = FAISS.from_documents(documents=list(chunks), embedding=embeddings, ids=chunk_ids)
+    apply_index_type(vector_db, options)
+    save_vector_db(vector_db, tmp_dir)
+    return vector_db, ids_by_source
+
+
+def _update_entry(base_dir: str, tmp_dir: str, update: IndexUpdate,
+                  chunks: Sequence[Document], embeddings: Embeddings,
+                  options: IndexOptions) -> Tuple[FAISS, SQLiteDocstore, Dict[str, List[str]]]:
+    """Applies the update to a copy of the previous entry."""
+    _copy_docstore(os.path.join(base_dir, DOCSTORE_FILE), os.path.join(tmp_dir, DOCSTORE_FILE))
+    docstore = SQLiteDocstore(os.path.join(tmp_dir, DOCSTORE_FILE))
+    try:
+        index = read_index(os.path.join(base_dir, INDEX_FILE), mmap=False)
+        doc_ids = _positions(docstore)
+        removed = set(update.removed_chunk_ids)
+        keep = [position for position, doc_id in enumerate(doc_ids) if doc_id not in removed]
+        chunk_ids, ids_by_source = _chunk_ids(chunks)
+        vectors = np.asarray(embeddings.embed_documents([chunk.page_content for chunk in chunks]),
+                             dtype=np.float32) if chunks else np.empty((0, 0), dtype=np.float32)
+
+        index = _update_vectors(index, keep, vectors, options)
+        docstore.delete(sorted(removed))
+        docstore.add({chunk_id: Document(page_content=chunk.page_content,
+                                         metadata=chunk.metadata)
+                      for chunk_id, chunk in zip(chunk_ids, chunks)})
+        _write_positions(docstore, [doc_ids[position] for position in keep] + chunk_ids)
+
+        vector_db = FAISS(
+            embedding_function=embeddings,
+            index=index,
+            docstore=docstore,
+            index_to_docstore_id=SQLiteIndexToDocstoreId(docstore),
+        )
+        # A flat index is converted once there are enough vectors to train the type
+        apply_index_type(vector_db, options)
+        faiss.write_index(vector_db.index, os.path.join(tmp_dir, INDEX_FILE))
+    except Exception:
+        docstore.close()
+        raise
+    return vector_db, docstore, ids_by_source
+
+
+def apply_update(update: IndexUpdate, chunks: Sequence[Document], loaded_files: Iterable[str],
+                 embeddings: Embeddings, cache_dir: str, cache_key: str,
+                 options: Optional[IndexOptions] = None) -> Dict[str, int]:
+    """
+    Writes the index cache entry of the updated corpus and makes it the current one.
+
+    The entry is written to a temporary directory, renamed into place, and the pointer
+    of the corpus is then replaced, after which the previous entry is deleted. With an
+    "ivfpq" index, the kept vectors are re-encoded from their compressed form; deleting
+    the entry rebuilds them from the embeddings.
+
+    Args:
+        update (IndexUpdate): Changes returned by ``plan_update``.
+        chunks (Sequence[Document]): Chunks of the PDFs parsed again, to embed.
+        loaded_files (Iterable[str]): PDFs of update.files_to_parse that were loaded.
+        embeddings (Embeddings): Embeddings used to vectorize the chunks.
+        cache_dir (str): Root directory of the index cache.
+        cache_key (str): Key of the updated corpus, see ``corpus_fingerprint``.
+        options (Optional[IndexOptions]): Type and parameters of the FAISS index.
+
+    Returns:
+        Dict[str, int]: The number of chunks added ("index_chunks_added") and deleted
+        ("index_chunks_removed").
+    """
+    if options is None:
+        options = IndexOptions()
+    loaded_files = list(loaded_files)
+    entry_dir = os.path.join(cache_dir, cache_key)
+    stats = {"index_chunks_added": 0, "index_chunks_removed": 0}
+    if read_manifest(entry_dir) is None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{cache_key}.", dir=cache_dir)
+        docstore = None
+        try:
+            if update.base_key is None:
+                vector_db, ids_by_source = _build_entry(tmp_dir, chunks, embeddings, options)
+            else:
+                vector_db, docstore, ids_by_source = _update_entry(
+                    os.path.join(cache_dir, update.base_key), tmp_dir, update, chunks,
+                    embeddings, options
+                )
+                stats["index_chunks_removed"] = len(update.removed_chunk_ids)
+            stats["index_chunks_added"] = len(chunks)
+            LexicalIndex.from_vector_db(vector_db).save(os.path.join(tmp_dir, LEXICAL_INDEX_FILE))
+            if docstore is not None:
+                docstore.close()
+                docstore = None
+            _write_json(os.path.join(tmp_dir, MANIFEST_FILE),
+                        _manifest(update, loaded_files, ids_by_source))
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            if docstore is not None:
+                docstore.close()
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        logging.info("Index cache entry %s written: %d chunks added, %d deleted",
+                     entry_dir, stats["index_chunks_added"], stats["index_chunks_removed"])
+
+    _write_pointer(cache_dir, update.settings_key, cache_key)
+    # The previous entry is kept while another corpus location or settings still uses it
+    if (update.base_key is not None and update.base_key != cache_key
+            and not _is_referenced(cache_dir, update.base_key)):
+        shutil.rmtree(os.path.join(cache_dir, update.base_key), ignore_errors=True)
+    return stats
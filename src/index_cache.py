@@ -0,0 +1,224 @@
+"""
+src/index_cache.py
+
+This module implements a persistent on-disk cache for FAISS vector databases.
+Each entry is stored in its own directory, named after a fingerprint of the
+corpus content and of every setting that changes the resulting vectors, so a
+saved index is only reused when it would be identical to a rebuilt one.
+"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from typing import TYPE_CHECKING, Dict, Optional, Sequence
+
+# The index modules import FAISS and LangChain, which are only needed once an
+# entry is read or written, not to compute a cache key
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+
+    from src.lexical_index import LexicalIndex
+
+# Bump when the on-disk layout changes so that old entries are ignored
+CACHE_FORMAT_VERSION = 2
+
+_READ_BLOCK_SIZE = 1024 * 1024
+
+LEXICAL_INDEX_FILE = "lexical.json"
+
+
+def file_sha256(file_path: str) -> str:
+    """
+    Computes the SHA-256 digest of a file's content.
+
+    Args:
+        file_path (str): Path of the file.
+
+    Returns:
+        str: The hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as file:
+        for block in iter(lambda: file.read(_READ_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _index_key_data(embedding_model: str, chunk_size: int, chunk_overlap: int,
+                    pdf_backend: str, index_params: Optional[dict],
+                    dedup_params: Optional[dict]) -> dict:
+    key_data = {
+        "format": CACHE_FORMAT_VERSION,
+        "embedding_model": embedding_model,
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "pdf_backend": pdf_backend,
+        "index": index_params or {"type": "flat"},
+    }
+    # Only part of the key when enabled, so that existing entries stay valid otherwise
+    if dedup_params:
+        key_data["dedup"] = dedup_params
+    return key_data
+
+
+def _digest(key_data: dict) -> str:
+    serialized = json.dumps(key_data, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(serialized).hexdigest()
+
+
+def corpus_fingerprint(pdf_files: Sequence[str], embedding_model: str, chunk_size: int,
+                       chunk_overlap: int, pdf_backend: str = "unstructured",
+                       index_params: Optional[dict] = None,
+                       dedup_params: Optional[dict] = None,
+                       file_hashes: Optional[Dict[str, str]] = None) -> str:
+    """
+    Computes the cache key of a vector database.
+
+    Args:
+        pdf_files (Sequence[str]): Paths of the indexed PDF files.
+        embedding_model (str): Name of the Ollama embedding model.
+        chunk_size (int): Maximum size of each chunk.
+        chunk_overlap (int): Overlap between consecutive chunks.
+        pdf_backend (str): Backend used to extract the text of the PDFs.
+        index_params (Optional[dict]): Build parameters of the FAISS index, see
+            ``IndexOptions.build_params``. Defaults to an exact flat index.
+        dedup_params (Optional[dict]): Parameters of the chunk deduplication, see
+            ``ChunkDeduplicator.params``. None if the chunks are not deduplicated.
+        file_hashes (Optional[Dict[str, str]]): SHA-256 digests already computed, by
+            path. The files missing from it are read.
+
+    Returns:
+        str: The hexadecimal cache key.
+    """
+    file_hashes = file_hashes or {}
+    key_data = _index_key_data(embedding_model, chunk_size, chunk_overlap, pdf_backend,
+                               index_params, dedup_params)
+    # The path is part of the key because it is stored as the chunk source
+    key_data["pdf_sha256"] = {path: file_hashes.get(path) or file_sha256(path)
+                              for path in sorted(pdf_files)}
+    return _digest(key_data)
+
+
+def settings_fingerprint(corpus: str, embedding_model: str, chunk_size: int,
+                         chunk_overlap: int, pdf_backend: str = "unstructured",
+                         index_params: Optional[dict] = None,
+                         dedup_params: Optional[dict] = None) -> str:
+    """
+    Computes the key of a corpus location and index settings, whatever the content of
+    the PDFs. Incremental updates (see src/incremental_index.py) use it to find the
+    entry of the previous version of the corpus.
+
+    Args:
+        corpus (str): PDF file, directory or glob pattern of the corpus.
+        embedding_model (str): Name of the Ollama embedding model.
+        chunk_size (int): Maximum size of each chunk.
+        chunk_overlap (int): Overlap between consecutive chunks.
+        pdf_backend (str): Backend used to extract the text of the PDFs.
+        index_params (Optional[dict]): Build parameters of the FAISS index.
+        dedup_params (Optional[dict]): Parameters of the chunk deduplication.
+
+    Returns:
+        str: The hexadecimal key.
+    """
+    key_data = _index_key_data(embedding_model, chunk_size, chunk_overlap, pdf_backend,
+                               index_params, dedup_params)
+    key_data["corpus"] = corpus
+    return _digest(key_data)
+
+
+def has_index(cache_dir: str, cache_key: str) -> bool:
+    """
+    Returns whether the cache has an entry for a key, single or sharded, without
+    opening it. The entry may still turn out to be unreadable when it is loaded.
+    """
+    from src.mmap_store import INDEX_FILE
+    from src.sharded_index import SHARDS_MANIFEST
+
+    entry_dir = os.path.join(cache_dir, cache_key)
+    return any(os.path.isfile(os.path.join(entry_dir, name))
+               for name in (INDEX_FILE, SHARDS_MANIFEST))
+
+
+def load_index(cache_dir: str, cache_key: str, embeddings,
+               mmap: bool = True) -> Optional["FAISS"]:
+    """
+    Loads a cached FAISS vector database.
+
+    The index is memory-mapped and the chunks stay in SQLite until a search returns
+    them, so opening an entry takes about the same time and memory for any corpus size.
+
+    Args:
+        cache_dir (str): Root directory of the index cache.
+        cache_key (str): Key returned by ``corpus_fingerprint``.
+        embeddings (Embeddings): Embeddings used to vectorize queries.
+        mmap (bool): Open the index memory-mapped and read-only. Use False to modify it.
+
+    Returns:
+        FAISS: The cached vector database.
+        None: If there is no entry for the key or it cannot be read.
+    """
+    from src.mmap_store import INDEX_FILE, load_vector_db
+
+    entry_dir = os.path.join(cache_dir, cache_key)
+    if not os.path.isfile(os.path.join(entry_dir, INDEX_FILE)):
+        return None
+    try:
+        return load_vector_db(entry_dir, embeddings, mmap=mmap)
+    except Exception as e:
+        logging.warning("Ignoring unreadable index cache entry %s: %s", entry_dir, e)
+        return None
+
+
+def save_index(vector_db: "FAISS", cache_dir: str, cache_key: str) -> None:
+    """
+    Saves a FAISS vector database in the cache.
+
+    The BM25 lexical index of the chunks is built and saved next to the vector index.
+    The entry is written to a temporary directory and then renamed into place,
+    so a concurrent or interrupted run never sees a partially written entry.
+
+    Args:
+        vector_db (FAISS): The vector database to save.
+        cache_dir (str): Root directory of the index cache.
+        cache_key (str): Key returned by ``corpus_fingerprint``.
+    """
+    from src.lexical_index import LexicalIndex
+    from src.mmap_store import save_vector_db
+
+    os.makedirs(cache_dir, exist_ok=True)
+    entry_dir = os.path.join(cache_dir, cache_key)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{cache_key}.", dir=cache_dir)
+    try:
+        save_vector_db(vector_db, tmp_dir)
+        LexicalIndex.from_vector_db(vector_db).save(os.path.join(tmp_dir, LEXICAL_INDEX_FILE))
+        if os.path.isdir(entry_dir):
+            shutil.rmtree(entry_dir)
+        os.replace(tmp_dir, entry_dir)
+        logging.info("FAISS vector database saved to cache %s", entry_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+
+def load_cached_lexical_index(cache_dir: str, cache_key: str) -> Optional["LexicalIndex"]:
+    """
+    Loads the lexical index saved next to a cached vector database.
+
+    Args:
+        cache_dir (str): Root directory of the index cache.
+        cache_key (str): Key returned by ``corpus_fingerprint``.
+
+    Returns:
+        LexicalIndex: The cached lexical index.
+        None: If there is no lexical index for the key or it cannot be read.
+    """
+    from src.lexical_index import load_lexical_index
+
+    path = os.path.join(cache_dir, cache_key, LEXICAL_INDEX_FILE)
+    try:
+        return load_lexical_index(path)
+    except (OSError, ValueError, KeyError) as e:
+        logging.warning("Ignoring unreadable lexical index %s: %s", path, e)
+        return None
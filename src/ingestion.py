@@ -1,22 +1,104 @@
+import glob
 import logging
+import os
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
 
-from langchain_community.document_loaders import UnstructuredPDFLoader
+# Las bibliotecas de PDF se importan dentro de las funciones que las utilizan: su
+# importación es lenta y solo son necesarias cuando hay que procesar algún PDF
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
 
+from src.settings import DEFAULT_PDF_BACKEND, PDF_BACKENDS
 
-def load_pdf(file_path: str):
+# Páginas con menos caracteres en la capa de texto se consideran escaneadas
+MIN_PAGE_TEXT_CHARS = 20
+
+
+def _load_with_unstructured(file_path: str) -> List["Document"]:
+    """Extrae el contenido del PDF completo con UnstructuredPDFLoader."""
+    from langchain_community.document_loaders import UnstructuredPDFLoader
+
+    loader = UnstructuredPDFLoader(file_path=file_path)
+    return loader.load()
+
+
+def _unstructured_page_text(pdf, page_index: int) -> str:
+    """Extrae el texto de una página con Unstructured, copiándola a un PDF temporal."""
+    import pikepdf
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        page_path = os.path.join(tmp_dir, "page.pdf")
+        with pikepdf.new() as page_pdf:
+            page_pdf.pages.append(pdf.pages[page_index])
+            page_pdf.save(page_path)
+        documents = _load_with_unstructured(page_path)
+    return "\n\n".join(document.page_content for document in documents)
+
+
+def _load_with_text_layer(file_path: str) -> List["Document"]:
+    """
+    Extrae el texto de cada página de la capa de texto del PDF con pdfplumber.
+
+    Solo las páginas sin texto utilizable (por ejemplo, páginas escaneadas) se procesan
+    con Unstructured, que puede aplicar OCR. Devuelve un documento por página.
     """
-    Carga un archivo PDF y extrae su contenido utilizando UnstructuredPDFLoader.
+    import pdfplumber
+    import pikepdf
+    from langchain_core.documents import Document
+
+    documents = []
+    fallback_pages = 0
+    with pdfplumber.open(file_path) as pdf, pikepdf.open(file_path) as raw_pdf:
+        for page_index, page in enumerate(pdf.pages):
+            text = page.extract_text() or ""
+            extraction = "text_layer"
+            if len(text.strip()) < MIN_PAGE_TEXT_CHARS:
+                text = _unstructured_page_text(raw_pdf, page_index)
+                extraction = "unstructured"
+                fallback_pages += 1
+            page.close()
+            documents.append(Document(
+                page_content=text,
+                metadata={
+                    "source": file_path,
+                    "page_number": page_index + 1,
+                    "extraction": extraction,
+                }
+            ))
+    if fallback_pages:
+        logging.info("PDF %s: %d páginas sin capa de texto procesadas con Unstructured",
+                     file_path, fallback_pages)
+    return documents
+
+
+_LOADERS = {
+    "unstructured": _load_with_unstructured,
+    "fast": _load_with_text_layer,
+}
+
+
+def load_pdf(file_path: str, backend: str = DEFAULT_PDF_BACKEND):
+    """
+    Carga un archivo PDF y extrae su contenido.
 
     Parámetros:
     - file_path (str): La ruta del archivo PDF.
+    - backend (str, opcional): "unstructured" utiliza UnstructuredPDFLoader para el
+      documento completo. "fast" extrae la capa de texto de cada página con pdfplumber
+      y solo utiliza Unstructured para las páginas sin texto (escaneadas).
 
     Retorna:
     - data (list) o None en caso de error.
     """
+    if backend not in _LOADERS:
+        raise ValueError(f"backend debe ser uno de {', '.join(PDF_BACKENDS)}")
     try:
-        loader = UnstructuredPDFLoader(file_path=file_path)
-        data = loader.load()
-        logging.info("PDF %s cargado correctamente", file_path)
+        data = _LOADERS[backend](file_path)
+        logging.info("PDF %s cargado correctamente (%s)", file_path, backend)
         return data
     except FileNotFoundError:
         logging.error("El archivo %s no fue encontrado.", file_path)
@@ -24,4 +106,116 @@ def load_pdf(file_path: str):
         logging.error("Biblioteca faltante: %s", e)
     except Exception as e:
         logging.error("Error cargando el PDF: %s", e)
-    return None
\ No newline at end of file
+    return None
+
+
+def resolve_pdf_files(path: str) -> List[str]:
+    """
+    Obtiene la lista de archivos PDF a procesar a partir de la configuración.
+
+    Parámetros:
+    - path (str): Ruta de un archivo PDF, de un directorio (se buscan los PDF de forma
+      recursiva) o un patrón glob (por ejemplo "./data/*.pdf").
+
+    Retorna:
+    - list: Las rutas de los archivos PDF, ordenadas.
+    """
+    if os.path.isdir(path):
+        pattern = os.path.join(path, "**", "*")
+        files = [
+            file for file in glob.glob(pattern, recursive=True)
+            if os.path.isfile(file) and file.lower().endswith(".pdf")
+        ]
+    elif glob.has_magic(path):
+        files = [file for file in glob.glob(path, recursive=True) if os.path.isfile(file)]
+    else:
+        files = [path]
+    return sorted(files)
+
+
+def _load_pdf_task(file_path: str, backend: str = DEFAULT_PDF_BACKEND
+                   ) -> Tuple[str, Optional[list]]:
+    """Carga un PDF en un proceso del pool y etiqueta sus documentos con su origen."""
+    documents = load_pdf(file_path, backend)
+    if documents is not None:
+        for document in documents:
+            document.metadata["source"] = file_path
+            document.metadata["file_name"] = os.path.basename(file_path)
+    return file_path, documents
+
+
+def iter_pdfs(file_paths: List[str], max_workers: Optional[int] = None,
+              backend: str = DEFAULT_PDF_BACKEND) -> Iterator[Tuple[str, Optional[list]]]:
+    """
+    Carga varios archivos PDF en paralelo y los devuelve uno a uno, en orden.
+
+    Como máximo hay dos archivos por proceso pendientes de consumir, de modo que la
+    memoria utilizada no depende del número de archivos.
+
+    Parámetros:
+    - file_paths (list): Rutas de los archivos PDF.
+    - max_workers (int, opcional): Número máximo de procesos. Por defecto, el menor entre
+      el número de archivos y el número de CPUs.
+    - backend (str, opcional): Backend de extracción, ver load_pdf.
+
+    Retorna:
+    - Iterator: Tuplas (ruta, documentos), con documentos igual a None si el archivo no
+      se pudo cargar.
+    """
+    if not file_paths:
+        return
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(file_paths)))
+
+    if max_workers == 1:
+        for file_path in file_paths:
+            yield _load_pdf_task(file_path, backend)
+        return
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        paths = iter(file_paths)
+        for file_path in islice(paths, 2 * max_workers):
+            pending.append((file_path, executor.submit(_load_pdf_task, file_path, backend)))
+        while pending:
+            file_path, future = pending.popleft()
+            try:
+                documents = future.result()[1]
+            except Exception as e:
+                # Por ejemplo, si el proceso que cargaba el archivo termina abruptamente
+                logging.error("Error cargando el PDF %s: %s", file_path, e)
+                documents = None
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(_load_pdf_task, next_path, backend)))
+            yield file_path, documents
+
+
+def load_pdfs(file_paths: List[str], max_workers: Optional[int] = None,
+              backend: str = DEFAULT_PDF_BACKEND):
+    """
+    Carga varios archivos PDF en paralelo utilizando un pool de procesos.
+
+    Los errores se aíslan por archivo: un PDF que no se puede cargar se registra en el
+    log y en la lista de fallos, pero no interrumpe la carga del resto.
+
+    Parámetros:
+    - file_paths (list): Rutas de los archivos PDF.
+    - max_workers (int, opcional): Número máximo de procesos. Por defecto, el menor entre
+      el número de archivos y el número de CPUs.
+    - backend (str, opcional): Backend de extracción, ver load_pdf.
+
+    Retorna:
+    - tuple: (documentos, fallos), donde documentos es la lista de documentos de todos los
+      archivos, en el orden de file_paths, y fallos la lista de rutas que no se cargaron.
+    """
+    documents = []
+    failed = []
+    for file_path, file_documents in iter_pdfs(file_paths, max_workers, backend):
+        if file_documents is None:
+            failed.append(file_path)
+        else:
+            documents.extend(file_documents)
+    logging.info("%d PDF cargados, %d con errores", len(file_paths) - len(failed), len(failed))
+    return documents, failed
@@ -0,0 +1,166 @@
+"""
+src/lexical_index.py
+
+This module implements a lexical index over the chunks of the vector database: an
+inverted index scored with BM25. It finds exact-term matches (codes, names) that
+embeddings miss, and answers queries without any embedding call.
+"""
+import heapq
+import json
+import math
+import os
+import re
+import tempfile
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict
+
+from src.tracing import span
+
+DEFAULT_K1 = 1.5
+DEFAULT_B = 0.75
+
+# Words, keeping codes such as "ISO-9001" or "v1.2" together
+_TOKEN = re.compile(r"\w+(?:[-./]\w+)*")
+_SEPARATOR = re.compile(r"[-./]")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Splits a text into index terms: case-folded, without accents. Compound codes are
+    indexed both whole and by parts, so "ISO-9001" also matches "iso" and "9001".
+    """
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char)).casefold()
+    terms = []
+    for token in _TOKEN.findall(text):
+        terms.append(token)
+        if _SEPARATOR.search(token):
+            terms.extend(part for part in _SEPARATOR.split(token) if part)
+    return terms
+
+
+class LexicalIndex:
+    """Inverted index with BM25 scoring over a set of documents."""
+
+    def __init__(self, doc_ids: List[str], doc_lengths: List[int],
+                 postings: Dict[str, List[Tuple[int, int]]],
+                 k1: float = DEFAULT_K1, b: float = DEFAULT_B):
+        self.doc_ids = doc_ids
+        self.doc_lengths = doc_lengths
+        self.postings = postings
+        self.k1 = k1
+        self.b = b
+        self.avg_length = (sum(doc_lengths) / len(doc_lengths)) if doc_lengths else 0.0
+
+    @classmethod
+    def build(cls, doc_ids: Sequence[str], texts: Sequence[str], **kwargs) -> "LexicalIndex":
+        """Builds the index of the given documents."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = []
+        for position, text in enumerate(texts):
+            terms = tokenize(text)
+            doc_lengths.append(len(terms))
+            for term, frequency in Counter(terms).items():
+                postings.setdefault(term, []).append((position, frequency))
+        return cls(list(doc_ids), doc_lengths, postings, **kwargs)
+
+    @classmethod
+    def from_vector_db(cls, vector_db, **kwargs) -> "LexicalIndex":
+        """Builds the index of every chunk stored in a FAISS vector database."""
+        doc_ids = []
+        texts = []
+        for doc_id in vector_db.index_to_docstore_id.values():
+            document = vector_db.docstore.search(doc_id)
+            if isinstance(document, Document):
+                doc_ids.append(doc_id)
+                texts.append(document.page_content)
+        return cls.build(doc_ids, texts, **kwargs)
+
+    def __len__(self) -> int:
+        return len(self.doc_ids)
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Returns the ids and BM25 scores of the k best documents for the query."""
+        total = len(self.doc_ids)
+        if not total:
+            return []
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1.0 + (total - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, frequency in postings:
+                length_norm = 1.0 - self.b + self.b * self.doc_lengths[position] / self.avg_length
+                score = idf * frequency * (self.k1 + 1.0) / (frequency + self.k1 * length_norm)
+                scores[position] = scores.get(position, 0.0) + score
+        best = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        return [(self.doc_ids[position], score) for position, score in best]
+
+    def save(self, path: str) -> None:
+        """Saves the index as JSON, atomically replacing any previous file."""
+        data = {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_ids": self.doc_ids,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+        directory = os.path.dirname(path) or "."
+        fd, tmp_path = tempfile.mkstemp(prefix=".lexical.", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file, separators=(",", ":"))
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        """Loads an index saved with save."""
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+        postings = {
+            term: [tuple(posting) for posting in term_postings]
+            for term, term_postings in data["postings"].items()
+        }
+        return cls(data["doc_ids"], data["doc_lengths"], postings, data["k1"], data["b"])
+
+
+def load_lexical_index(path: str) -> Optional[LexicalIndex]:
+    """Loads a lexical index, None if the file does not exist."""
+    if not os.path.isfile(path):
+        return None
+    return LexicalIndex.load(path)
+
+
+class LexicalRetriever(BaseRetriever):
+    """Retriever returning the BM25 best matches, without any embedding call."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    docstore: Any
+    k: int = 4
+
+    def search_with_scores(self, query: str) -> List[Tuple[Document, float]]:
+        """Returns the best documents for the query with their BM25 scores."""
+        results = []
+        with span("retrieval", kind="lexical"):
+            for doc_id, score in self.index.search(query, self.k):
+                document = self.docstore.search(doc_id)
+                if isinstance(document, Document):
+                    results.append((document, score))
+        return results
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        return [document for document, _ in self.search_with_scores(query)]
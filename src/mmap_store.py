@@ -0,0 +1,203 @@
+"""
+src/mmap_store.py
+
+This module implements the on-disk layout of a saved vector database that is fast to
+open whatever the corpus size:
+
+- index.faiss: the FAISS index, opened memory-mapped (read-only) where the FAISS build
+  supports it, so its vectors are paged in on demand instead of being deserialized.
+- docstore.sqlite3: the chunk texts and metadata, and the FAISS position -> docstore id
+  mapping, in SQLite. Texts are only fetched for the hits of a search.
+
+LangChain's FAISS.save_local/load_local pickle the whole docstore instead, which has to
+be read into memory before the first query.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections.abc import MutableMapping
+from typing import Dict, Iterator, List, Optional, Union
+
+import faiss
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+INDEX_FILE = "index.faiss"
+DOCSTORE_FILE = "docstore.sqlite3"
+
+# Flat indexes can only be memory-mapped by recent FAISS versions (IO_FLAG_MMAP_IFC)
+_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+
+
+class SQLiteDocstore(Docstore, AddableMixin):
+    """Docstore keeping the chunks in SQLite and reading them on demand."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS documents ("
+            " doc_id TEXT PRIMARY KEY,"
+            " page_content TEXT NOT NULL,"
+            " metadata TEXT NOT NULL)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS positions ("
+            " position INTEGER PRIMARY KEY,"
+            " doc_id TEXT NOT NULL)"
+        )
+        self.conn.commit()
+
+    def search(self, search: str) -> Union[str, Document]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT page_content, metadata FROM documents WHERE doc_id = ?", (search,)
+            ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=row[0], metadata=json.loads(row[1]))
+
+    def add(self, texts: Dict[str, Document]) -> None:
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, page_content, metadata)"
+                " VALUES (?, ?, ?)",
+                [(doc_id, document.page_content, json.dumps(document.metadata, default=str))
+                 for doc_id, document in texts.items()]
+            )
+            self.conn.commit()
+
+    def delete(self, ids: List) -> None:
+        with self.lock:
+            self.conn.executemany("DELETE FROM documents WHERE doc_id = ?",
+                                  [(doc_id,) for doc_id in ids])
+            self.conn.commit()
+
+    def close(self) -> None:
+        """Closes the underlying database connection."""
+        with self.lock:
+            self.conn.close()
+
+
+class SQLiteIndexToDocstoreId(MutableMapping):
+    """FAISS position -> docstore id mapping read from the positions table on demand."""
+
+    def __init__(self, docstore: SQLiteDocstore):
+        self.docstore = docstore
+
+    def __getitem__(self, position: int) -> str:
+        with self.docstore.lock:
+            row = self.docstore.conn.execute(
+                "SELECT doc_id FROM positions WHERE position = ?", (int(position),)
+            ).fetchone()
+        if row is None:
+            raise KeyError(position)
+        return row[0]
+
+    def __setitem__(self, position: int, doc_id: str) -> None:
+        with self.docstore.lock:
+            self.docstore.conn.execute(
+                "INSERT OR REPLACE INTO positions (position, doc_id) VALUES (?, ?)",
+                (int(position), doc_id)
+            )
+            self.docstore.conn.commit()
+
+    def __delitem__(self, position: int) -> None:
+        with self.docstore.lock:
+            cursor = self.docstore.conn.execute(
+                "DELETE FROM positions WHERE position = ?", (int(position),)
+            )
+            self.docstore.conn.commit()
+        if cursor.rowcount == 0:
+            raise KeyError(position)
+
+    def __iter__(self) -> Iterator[int]:
+        with self.docstore.lock:
+            positions = [row[0] for row in self.docstore.conn.execute(
+                "SELECT position FROM positions ORDER BY position"
+            )]
+        return iter(positions)
+
+    def __len__(self) -> int:
+        with self.docstore.lock:
+            (count,) = self.docstore.conn.execute("SELECT COUNT(*) FROM positions").fetchone()
+        return count
+
+
+def save_vector_db(vector_db: FAISS, directory: str) -> None:
+    """
+    Saves a FAISS vector database in the memory-mappable layout.
+
+    Args:
+        vector_db (FAISS): The vector database.
+        directory (str): Destination directory, created if needed.
+    """
+    os.makedirs(directory, exist_ok=True)
+    faiss.write_index(vector_db.index, os.path.join(directory, INDEX_FILE))
+
+    docstore_path = os.path.join(directory, DOCSTORE_FILE)
+    if os.path.exists(docstore_path):
+        os.remove(docstore_path)
+    store = SQLiteDocstore(docstore_path)
+    try:
+        positions = []
+        documents = []
+        for position, doc_id in vector_db.index_to_docstore_id.items():
+            positions.append((int(position), doc_id))
+            document = vector_db.docstore.search(doc_id)
+            if isinstance(document, Document):
+                documents.append((doc_id, document.page_content,
+                                  json.dumps(document.metadata, default=str)))
+        with store.lock:
+            store.conn.executemany(
+                "INSERT INTO positions (position, doc_id) VALUES (?, ?)", positions
+            )
+            store.conn.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, page_content, metadata)"
+                " VALUES (?, ?, ?)", documents
+            )
+            store.conn.commit()
+    finally:
+        store.close()
+
+
+def read_index(path: str, mmap: bool = True):
+    """Reads a FAISS index, memory-mapped when requested and supported."""
+    if mmap:
+        try:
+            return faiss.read_index(path, _MMAP_FLAGS)
+        except RuntimeError as e:
+            logging.info("FAISS index %s cannot be memory-mapped, reading it: %s", path, e)
+    return faiss.read_index(path)
+
+
+def load_vector_db(directory: str, embeddings: Embeddings, mmap: bool = True) -> Optional[FAISS]:
+    """
+    Opens a vector database saved with save_vector_db.
+
+    Args:
+        directory (str): Directory of the saved vector database.
+        embeddings (Embeddings): Embeddings used to vectorize queries.
+        mmap (bool): Open the index memory-mapped and read-only. Use False to modify it.
+
+    Returns:
+        FAISS: The vector database, reading chunks from SQLite on demand.
+        None: If the directory does not contain a saved vector database.
+    """
+    index_path = os.path.join(directory, INDEX_FILE)
+    docstore_path = os.path.join(directory, DOCSTORE_FILE)
+    if not (os.path.isfile(index_path) and os.path.isfile(docstore_path)):
+        return None
+    index = read_index(index_path, mmap)
+    docstore = SQLiteDocstore(docstore_path)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=SQLiteIndexToDocstoreId(docstore),
+    )
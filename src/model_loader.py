@@ -2,7 +2,7 @@ import logging
 
 from langchain_ollama import ChatOllama
 
-def load_llm(model_name:str):
+def load_llm(model_name:str, keep_alive=None, client_kwargs=None):
     """
     Carga un modelo de lenguaje (LLM) utilizando Ollama.
 
@@ -10,7 +10,12 @@ def load_llm(model_name:str):
     El modelo se carga con el nombre de modelo proporcionado en la configuración (variable `MODEL_NAME`).
 
     Parámetros:
-    - Ninguno.
+    - model_name (str): Nombre del modelo de Ollama.
+    - keep_alive (str o int, opcional): Tiempo que Ollama mantiene el modelo cargado
+      en memoria tras cada petición. Por defecto, el de Ollama (5 minutos).
+    - client_kwargs (dict, opcional): Argumentos de los clientes HTTP síncrono y asíncrono
+      del modelo, por ejemplo el límite de conexiones de `client_kwargs()` en
+      src/ollama_client.py. Por defecto, los de ChatOllama.
 
     Retorna:
     - llm (ChatOllama): Una instancia del modelo de lenguaje cargado correctamente.
@@ -20,10 +25,11 @@ def load_llm(model_name:str):
     - En caso de un error durante la carga del modelo de lenguaje, la función captura y muestra el mensaje de error.
 
     Ejemplo de uso:
-    llm = load_llm()
+    llm = load_llm("llama3.2", keep_alive="30m", client_kwargs=client_kwargs(16))
     """
     try:
-        llm = ChatOllama(model=model_name)
+        llm = ChatOllama(model=model_name, keep_alive=keep_alive,
+                         client_kwargs=client_kwargs or {})
         logging.info("Modelo LLM %s cargado correctamente", model_name)
         return llm
     except Exception as e:
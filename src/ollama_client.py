@@ -0,0 +1,168 @@
+"""
+src/ollama_client.py
+
+This module implements the Ollama client layer shared by the chat model and the
+embeddings. A single ollama.Client per host is created, with a bounded pool of
+keep-alive HTTP connections, so that every embedding batch reuses the same connections
+instead of opening new ones. The chat model builds its own sync and async clients from
+the same ``client_kwargs``, so the query expansion and the answer generation use
+bounded pools of keep-alive connections too.
+
+It also keeps the models ready before the first query:
+
+- ``ensure_model`` only pulls a model that is not listed by the server yet.
+- ``warm_up`` loads the chat and embedding models in Ollama's memory, and the
+  ``keep_alive`` sent with every request keeps them loaded between runs and queries,
+  so the first query does not pay the model load time.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple, Union
+
+import httpx
+import ollama
+
+from src.settings import DEFAULT_OLLAMA_KEEP_ALIVE, DEFAULT_OLLAMA_POOL_SIZE
+from src.tracing import propagate, span
+
+_clients: Dict[Optional[str], ollama.Client] = {}
+_available: Set[Tuple[Optional[str], str]] = set()
+_lock = threading.Lock()
+_pull_lock = threading.Lock()
+
+
+def parse_keep_alive(value: Union[str, int, None]) -> Union[str, int, None]:
+    """
+    Converts a keep_alive setting to the value sent to Ollama: a number of seconds
+    (negative keeps the model loaded forever) or a duration such as "30m".
+    """
+    if value is None or isinstance(value, int):
+        return value
+    value = value.strip()
+    if not value:
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+def client_kwargs(pool_size: int = DEFAULT_OLLAMA_POOL_SIZE) -> Dict[str, httpx.Limits]:
+    """
+    Returns the keyword arguments of the HTTP clients of Ollama: a pool of at most
+    ``pool_size`` keep-alive connections. They are passed to ollama.Client and
+    ollama.AsyncClient, for example through ChatOllama's ``client_kwargs``.
+    """
+    if pool_size <= 0:
+        raise ValueError("pool_size must be a positive integer")
+    return {"limits": httpx.Limits(max_connections=pool_size,
+                                   max_keepalive_connections=pool_size)}
+
+
+def get_client(host: Optional[str] = None,
+               pool_size: int = DEFAULT_OLLAMA_POOL_SIZE) -> ollama.Client:
+    """
+    Returns the shared Ollama client of a host, creating it on first use.
+
+    Args:
+        host (Optional[str]): URL of the Ollama server, None for OLLAMA_HOST or the
+            default local server.
+        pool_size (int): Maximum number of HTTP connections of the client. Only used
+            when the client is created.
+
+    Returns:
+        ollama.Client: The client, safe to use from several threads.
+    """
+    kwargs = client_kwargs(pool_size)
+    with _lock:
+        client = _clients.get(host)
+        if client is None:
+            client = ollama.Client(host=host, **kwargs)
+            _clients[host] = client
+        return client
+
+
+def _model_names(client: ollama.Client) -> Set[str]:
+    names = set()
+    for model in client.list().get("models", []):
+        # Recent versions of the client name the field "model", older ones "name"
+        name = model.get("model") or model.get("name")
+        if name:
+            names.add(name)
+            if name.endswith(":latest"):
+                names.add(name[:-len(":latest")])
+    return names
+
+
+def ensure_model(model: str, client: Optional[ollama.Client] = None,
+                 host: Optional[str] = None) -> bool:
+    """
+    Pulls a model unless the Ollama server already has it.
+
+    Args:
+        model (str): Name of the model.
+        client (Optional[ollama.Client]): Client to use, defaults to the shared client.
+        host (Optional[str]): Host of the shared client, when no client is given.
+
+    Returns:
+        bool: True if the model was pulled, False if it was already present.
+    """
+    if client is None:
+        client = get_client(host)
+    key = (host, model)
+    if key in _available:
+        return False
+    # Serializes concurrent pulls, for example the warm-up and step 2
+    with _pull_lock:
+        if key in _available:
+            return False
+        if model in _model_names(client):
+            _available.add(key)
+            return False
+        logging.info("Pulling Ollama model %s", model)
+        with span("model_pull", model=model):
+            client.pull(model)
+        _available.add(key)
+        return True
+
+
+def warm_up(chat_model: Optional[str], embedding_model: Optional[str],
+            keep_alive: Union[str, int, None] = DEFAULT_OLLAMA_KEEP_ALIVE,
+            client: Optional[ollama.Client] = None) -> Dict[str, float]:
+    """
+    Pulls the missing models and loads them in Ollama's memory, in parallel.
+
+    Args:
+        chat_model (Optional[str]): Name of the chat model, None to skip it.
+        embedding_model (Optional[str]): Name of the embedding model, None to skip it.
+        keep_alive (Union[str, int, None]): How long Ollama keeps the models loaded.
+        client (Optional[ollama.Client]): Client to use, defaults to the shared client.
+
+    Returns:
+        Dict[str, float]: Seconds spent warming up each model, keyed by
+        "warmup_chat_seconds" and "warmup_embedding_seconds".
+    """
+    if client is None:
+        client = get_client()
+
+    def load(kind: str, model: str) -> Tuple[str, float]:
+        start_time = time.perf_counter()
+        with span("model_warmup", model=model, kind=kind):
+            ensure_model(model, client)
+            # Requests without input only load the model
+            if kind == "chat":
+                client.generate(model=model, keep_alive=keep_alive)
+            else:
+                client.embed(model=model, input=[], keep_alive=keep_alive)
+        return f"warmup_{kind}_seconds", time.perf_counter() - start_time
+
+    models = [(kind, model) for kind, model in (("chat", chat_model),
+                                                ("embedding", embedding_model)) if model]
+    with ThreadPoolExecutor(max_workers=max(1, len(models)),
+                            thread_name_prefix="warmup") as executor:
+        timings = dict(executor.map(propagate(lambda item: load(*item)), models))
+    logging.info("Ollama models warmed up: %s",
+                 ", ".join(f"{name} {seconds:.2f}s" for name, seconds in timings.items()))
+    return timings
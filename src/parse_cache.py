@@ -0,0 +1,238 @@
+"""
+src/parse_cache.py
+
+This module implements an on-disk cache of parsed PDF pages and chunks, so that step 1
+does not parse the PDFs again when only the retrieval, prompt or model settings change.
+
+Each file is stored as an uncompressed Arrow IPC file keyed by the PDF content hash and
+the loader settings. Cached files are opened memory-mapped and Documents are only built
+when they are accessed.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections.abc import Sequence
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import pyarrow as pa
+from langchain_core.documents import Document
+
+from src.chunking import split_text
+from src.index_cache import file_sha256
+from src.ingestion import iter_pdfs
+from src.settings import DEFAULT_PDF_BACKEND
+
+# Bump when the content of the cached tables changes so that old entries are ignored
+CACHE_FORMAT_VERSION = 1
+
+_SCHEMA = pa.schema([
+    ("page_content", pa.large_string()),
+    ("metadata", pa.string()),
+])
+
+
+def _cache_key(**key_data) -> str:
+    key_data["format"] = CACHE_FORMAT_VERSION
+    serialized = json.dumps(key_data, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(serialized).hexdigest()
+
+
+class DocumentTable(Sequence):
+    """Read-only sequence of the Documents of one PDF, backed by an Arrow table."""
+
+    def __init__(self, table: pa.Table, source: str):
+        self.table = table
+        self.source = source
+
+    def _document(self, page_content: str, metadata: str) -> Document:
+        metadata = json.loads(metadata)
+        # The cache is keyed by content, so the file may have been cached under another path
+        metadata["source"] = self.source
+        metadata["file_name"] = os.path.basename(self.source)
+        return Document(page_content=page_content, metadata=metadata)
+
+    def __len__(self) -> int:
+        return self.table.num_rows
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document index out of range")
+        return self._document(
+            self.table.column("page_content")[index].as_py(),
+            self.table.column("metadata")[index].as_py(),
+        )
+
+    def __iter__(self) -> Iterator[Document]:
+        for batch in self.table.to_batches():
+            for page_content, metadata in zip(batch.column(0).to_pylist(),
+                                              batch.column(1).to_pylist()):
+                yield self._document(page_content, metadata)
+
+
+class LazyDocuments(Sequence):
+    """Read-only concatenation of several DocumentTables."""
+
+    def __init__(self, parts: List[DocumentTable]):
+        self.parts = parts
+        self._offsets = []
+        total = 0
+        for part in parts:
+            self._offsets.append(total)
+            total += len(part)
+        self._length = total
+
+    @property
+    def sources(self) -> List[str]:
+        """Paths of the PDF files with at least one document."""
+        return [part.source for part in self.parts if len(part)]
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[position] for position in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("document index out of range")
+        part = bisect.bisect_right(self._offsets, index) - 1
+        return self.parts[part][index - self._offsets[part]]
+
+    def __iter__(self) -> Iterator[Document]:
+        for part in self.parts:
+            yield from part
+
+
+class ParseCache:
+    """Directory of Arrow files with the parsed pages and the chunks of each PDF."""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+
+    def _path(self, kind: str, key: str) -> str:
+        return os.path.join(self.cache_dir, kind, f"{key}.arrow")
+
+    def load(self, kind: str, key: str, source: str) -> Optional[DocumentTable]:
+        """Opens a cached table memory-mapped, None if it is not cached or unreadable."""
+        path = self._path(kind, key)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with pa.memory_map(path, "r") as source_file:
+                table = pa.ipc.open_file(source_file).read_all()
+            return DocumentTable(table, source)
+        except (pa.ArrowException, OSError) as e:
+            logging.warning("Ignoring unreadable parse cache entry %s: %s", path, e)
+            return None
+
+    def save(self, kind: str, key: str, documents: List[Document]) -> None:
+        """Writes the documents to the cache, atomically replacing any previous entry."""
+        path = self._path(kind, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.table({
+            "page_content": [document.page_content for document in documents],
+            "metadata": [json.dumps(document.metadata, default=str) for document in documents],
+        }, schema=_SCHEMA)
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{key}.", dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            with pa.OSFile(tmp_path, "wb") as sink:
+                with pa.ipc.new_file(sink, _SCHEMA) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+
+def load_and_split_cached(
+    pdf_files: List[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    cache_dir: str,
+    max_workers: Optional[int] = None,
+    backend: str = DEFAULT_PDF_BACKEND
+) -> Tuple[LazyDocuments, List[str], Dict[str, int]]:
+    """
+    Loads and splits the PDFs, reusing the cached pages and chunks of each file.
+
+    A file whose chunks are cached for these settings is neither parsed nor split. A
+    file whose pages are cached is only split again. The remaining files are parsed in
+    parallel (see src.ingestion.iter_pdfs) and their pages and chunks are cached.
+
+    Args:
+        pdf_files (List[str]): Paths of the PDF files.
+        chunk_size (int): Maximum size of each chunk.
+        chunk_overlap (int): Overlap between consecutive chunks.
+        cache_dir (str): Directory of the parse cache.
+        max_workers (Optional[int]): Number of PDF parsing processes.
+        backend (str): PDF extraction backend, see src.ingestion.load_pdf.
+
+    Returns:
+        Tuple: The chunks of every loaded file, in the order of pdf_files, the paths of
+        the files that could not be loaded and the cache hit counts.
+    """
+    cache = ParseCache(cache_dir)
+    stats = {"parse_cache_chunk_hits": 0, "parse_cache_page_hits": 0, "parse_cache_misses": 0}
+    parts: Dict[str, DocumentTable] = {}
+    pages_to_split: Dict[str, list] = {}
+    to_parse: List[str] = []
+    keys: Dict[str, Tuple[str, str]] = {}
+    failed: List[str] = []
+
+    for file_path in pdf_files:
+        try:
+            content_hash = file_sha256(file_path)
+        except OSError as e:
+            logging.error("Error reading the PDF %s: %s", file_path, e)
+            failed.append(file_path)
+            continue
+        pages_key = _cache_key(sha256=content_hash, backend=backend)
+        chunks_key = _cache_key(sha256=content_hash, backend=backend,
+                                chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        keys[file_path] = (pages_key, chunks_key)
+
+        chunks = cache.load("chunks", chunks_key, file_path)
+        if chunks is not None:
+            parts[file_path] = chunks
+            stats["parse_cache_chunk_hits"] += 1
+            continue
+        pages = cache.load("pages", pages_key, file_path)
+        if pages is not None:
+            pages_to_split[file_path] = list(pages)
+            stats["parse_cache_page_hits"] += 1
+            continue
+        to_parse.append(file_path)
+        stats["parse_cache_misses"] += 1
+
+    for file_path, documents in iter_pdfs(to_parse, max_workers, backend):
+        if documents is None:
+            failed.append(file_path)
+            continue
+        cache.save("pages", keys[file_path][0], documents)
+        pages_to_split[file_path] = documents
+
+    for file_path, pages in pages_to_split.items():
+        chunks = split_text(pages, chunk_size, chunk_overlap)
+        if chunks is None:
+            failed.append(file_path)
+            continue
+        chunks_key = keys[file_path][1]
+        cache.save("chunks", chunks_key, chunks)
+        parts[file_path] = cache.load("chunks", chunks_key, file_path)
+
+    logging.info(
+        "Parse cache: %d files with cached chunks, %d with cached pages, %d parsed",
+        stats["parse_cache_chunk_hits"], stats["parse_cache_page_hits"],
+        stats["parse_cache_misses"]
+    )
+    documents = LazyDocuments([parts[path] for path in pdf_files if parts.get(path) is not None])
+    return documents, failed, stats
@@ -0,0 +1,284 @@
+"""
+src/resource_monitor.py
+
+This module samples the resources used while a step of the pipeline runs, from a
+background thread, with psutil:
+
+- CPU time of the process and of its child processes (PDF parsing workers, shard
+  search processes), and the CPU utilization of the whole host, which includes the
+  Ollama server computing the embeddings and the answers when it runs on the same host,
+- the share of CPU time the host spent waiting for I/O (Linux),
+- the peak resident memory (RSS) of the process and its children,
+- the bytes read and written by the process and its children,
+- the peak number of threads and child processes.
+
+A step with a high process CPU utilization is CPU-bound in Python, a high host CPU with
+a low process CPU points to the Ollama server, and a high I/O wait or many bytes read
+with little CPU points to the disk.
+"""
+import dataclasses
+import functools
+import logging
+import sys
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+from src.settings import DEFAULT_RESOURCE_SAMPLE_INTERVAL
+from src.tracing import current_span
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_BYTES_PER_MB = 1024 * 1024
+
+
+@dataclasses.dataclass
+class SamplingConfig:
+    """Configuration of the steps decorated with ``sampled``."""
+    # Seconds between two samples, 0 disables the sampling
+    interval: float = DEFAULT_RESOURCE_SAMPLE_INTERVAL
+
+
+# Sampling configuration shared by the whole pipeline
+sampling = SamplingConfig()
+
+
+def set_sample_interval(seconds: float) -> None:
+    """Sets the sampling interval of the steps decorated with ``sampled``, 0 to disable it."""
+    if seconds < 0:
+        raise ValueError("The sampling interval must be a non-negative number")
+    sampling.interval = seconds
+
+
+@dataclasses.dataclass
+class ResourceUsage:
+    """Represents the resources used during a sampled interval."""
+    seconds: float = 0.0
+    samples: int = 0
+    cpu_seconds: float = 0.0
+    cpu_percent_peak: float = 0.0
+    system_cpu_percent: float = 0.0
+    iowait_percent: Optional[float] = None
+    rss_peak_mb: float = 0.0
+    read_mb: Optional[float] = None
+    write_mb: Optional[float] = None
+    threads_peak: int = 0
+    children_peak: int = 0
+
+    @property
+    def cpu_percent(self) -> float:
+        """Mean CPU utilization of the process and its children, 100 per busy core."""
+        return 100 * self.cpu_seconds / self.seconds if self.seconds else 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        """Returns the usage as a JSON-serializable dict, without unavailable counters."""
+        usage = {
+            "seconds": round(self.seconds, 3),
+            "samples": self.samples,
+            "cpu_seconds": round(self.cpu_seconds, 3),
+            "cpu_percent": round(self.cpu_percent, 1),
+            "cpu_percent_peak": round(self.cpu_percent_peak, 1),
+            "system_cpu_percent": round(self.system_cpu_percent, 1),
+            "iowait_percent": round(self.iowait_percent, 1)
+            if self.iowait_percent is not None else None,
+            "rss_peak_mb": round(self.rss_peak_mb, 1),
+            "read_mb": self.read_mb,
+            "write_mb": self.write_mb,
+            "threads_peak": self.threads_peak,
+            "children_peak": self.children_peak,
+        }
+        return {name: round(value, 3) if isinstance(value, float) else value
+                for name, value in usage.items() if value is not None}
+
+
+def _max_rss_bytes() -> Optional[int]:
+    """Returns the peak RSS of the process since it started, None if unavailable."""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class ResourceSampler:
+    """Samples the resources of the current process in a background thread."""
+
+    def __init__(self, interval: float = DEFAULT_RESOURCE_SAMPLE_INTERVAL, include_children: bool = True):
+        # psutil is only imported when a step is sampled
+        import psutil
+
+        if interval <= 0:
+            raise ValueError("interval must be a positive number")
+        self.interval = interval
+        self.include_children = include_children
+        self.usage = ResourceUsage()
+        self._psutil = psutil
+        self._process = psutil.Process()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        # Cumulative counters of each process at its previous sample
+        self._cpu: Dict[int, float] = {}
+        self._io: Dict[int, tuple] = {}
+        self._io_available = True
+        self._system_cpu = None
+        self._start_time = 0.0
+        self._last_time = 0.0
+        self._start_max_rss: Optional[int] = None
+
+    def _processes(self) -> list:
+        processes = [self._process]
+        if self.include_children:
+            try:
+                processes.extend(self._process.children(recursive=True))
+            except self._psutil.Error:
+                pass
+        return processes
+
+    def _sample(self, baseline: bool = False) -> None:
+        """Adds the counters read since the previous sample to the usage."""
+        psutil = self._psutil
+        now = time.perf_counter()
+        processes = self._processes()
+        cpu_delta = 0.0
+        rss = 0
+        read_delta = write_delta = 0
+        threads = 0
+        for process in processes:
+            try:
+                with process.oneshot():
+                    times = process.cpu_times()
+                    cpu = times.user + times.system
+                    rss += process.memory_info().rss
+                    if process.pid == self._process.pid:
+                        threads = process.num_threads()
+                        if threading.current_thread() is self._thread:
+                            threads -= 1  # Without the sampler thread itself
+                    io = None
+                    if self._io_available:
+                        try:
+                            counters = process.io_counters()
+                            io = (counters.read_bytes, counters.write_bytes)
+                        except (AttributeError, NotImplementedError):
+                            self._io_available = False  # macOS
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+                continue
+            # Processes started during the interval count from 0
+            previous_cpu = self._cpu.get(process.pid, cpu if baseline else 0.0)
+            cpu_delta += max(0.0, cpu - previous_cpu)
+            self._cpu[process.pid] = cpu
+            if io is not None:
+                previous_io = self._io.get(process.pid, io if baseline else (0, 0))
+                read_delta += max(0, io[0] - previous_io[0])
+                write_delta += max(0, io[1] - previous_io[1])
+                self._io[process.pid] = io
+
+        with self._lock:
+            usage = self.usage
+            usage.samples += 1
+            usage.rss_peak_mb = max(usage.rss_peak_mb, rss / _BYTES_PER_MB)
+            usage.threads_peak = max(usage.threads_peak, threads)
+            usage.children_peak = max(usage.children_peak, len(processes) - 1)
+            if baseline:
+                self._system_cpu = psutil.cpu_times()
+            else:
+                elapsed = now - self._last_time
+                usage.cpu_seconds += cpu_delta
+                if elapsed > 0:
+                    usage.cpu_percent_peak = max(usage.cpu_percent_peak,
+                                                 100 * cpu_delta / elapsed)
+                if self._io_available:
+                    usage.read_mb = (usage.read_mb or 0.0) + read_delta / _BYTES_PER_MB
+                    usage.write_mb = (usage.write_mb or 0.0) + write_delta / _BYTES_PER_MB
+            self._last_time = now
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self._sample()
+            except Exception as e:
+                logging.warning("Resource sampling stopped: %s", e)
+                return
+
+    def start(self) -> "ResourceSampler":
+        """Takes the first sample and starts the sampling thread."""
+        self._start_time = time.perf_counter()
+        self._start_max_rss = _max_rss_bytes()
+        self._sample(baseline=True)
+        self._thread = threading.Thread(target=self._run, name="resource-sampler", daemon=True)
+        self._thread.start()
+        return self
+
+    def _system_percentages(self) -> None:
+        """Sets the host CPU and I/O wait utilization since the first sample."""
+        end = self._psutil.cpu_times()
+        start = self._system_cpu
+        total = sum(end) - sum(start)
+        if total <= 0:
+            return
+        idle = end.idle - start.idle
+        iowait = getattr(end, "iowait", 0.0) - getattr(start, "iowait", 0.0)
+        self.usage.system_cpu_percent = 100 * (total - idle - iowait) / total
+        if hasattr(end, "iowait"):
+            self.usage.iowait_percent = 100 * iowait / total
+
+    def stop(self) -> ResourceUsage:
+        """Stops the sampling thread, takes a last sample and returns the usage."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._sample()
+        with self._lock:
+            self.usage.seconds = time.perf_counter() - self._start_time
+            self._system_percentages()
+            # The lifetime peak only grows when the step reached a new peak between samples
+            end_max_rss = _max_rss_bytes()
+            if end_max_rss is not None and self._start_max_rss is not None \
+                    and end_max_rss > self._start_max_rss:
+                self.usage.rss_peak_mb = max(self.usage.rss_peak_mb,
+                                             end_max_rss / _BYTES_PER_MB)
+        return self.usage
+
+    def __enter__(self) -> "ResourceSampler":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+def sampled(callback: Callable[[str, ResourceUsage], None],
+            name: Optional[str] = None) -> Callable:
+    """
+    Decorator sampling the resources used by every call of a function. The usage is
+    passed to the callback, with the function name unless a name is given, and added
+    to the attributes of the current span.
+    """
+    def decorator(func: Callable) -> Callable:
+        step_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            interval = sampling.interval
+            if not interval:
+                return func(*args, **kwargs)
+            try:
+                sampler = ResourceSampler(interval).start()
+            except Exception as e:
+                logging.warning("Resources of %s not sampled: %s", step_name, e)
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                usage = sampler.stop()
+                step_span = current_span()
+                if step_span is not None:
+                    step_span.set(**{f"resource_{key}": value
+                                     for key, value in usage.to_dict().items()})
+                callback(step_name, usage)
+
+        return wrapper
+
+    return decorator
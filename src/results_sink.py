@@ -0,0 +1,283 @@
+"""
+src/results_sink.py
+
+This module implements the destinations ("sinks") of the run results and the
+background writer that delivers them:
+
+- JsonLinesSink and SQLiteSink keep the results on the local disk.
+- FirebaseSink sends them to Firebase Realtime Database. The Firebase Admin SDK is
+  only imported and initialized when the first batch is sent.
+
+Records submitted to the BackgroundWriter are first stored in a durable on-disk
+queue (SQLite), then sent in batches by a background thread. A failed batch is
+retried with exponential backoff; records still pending when the process exits are
+sent by the next run, so results are never lost and the pipeline never waits on,
+or fails because of, the network.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from src.settings import (
+    DEFAULT_RESULTS_BATCH_SIZE,
+    DEFAULT_RESULTS_FLUSH_TIMEOUT,
+    RESULTS_SINKS,
+)
+from src.tracing import span
+
+DEFAULT_BACKOFF_SECONDS = 1.0
+DEFAULT_MAX_BACKOFF_SECONDS = 300.0
+
+
+def _make_parent_dir(path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+
+class ResultsSink:
+    """
+    Destination of the run results. Each record is a dict with a "key", unique per
+    run (server name and timestamp), and the serialized payload as "data".
+    """
+
+    def send(self, records: List[Dict]) -> None:
+        """Delivers a batch of records, raising an exception if it could not."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Releases the resources of the sink."""
+
+
+class JsonLinesSink(ResultsSink):
+    """Appends the records to a JSON lines file."""
+
+    def __init__(self, path: str):
+        _make_parent_dir(path)
+        self.path = path
+
+    def send(self, records: List[Dict]) -> None:
+        lines = "".join(json.dumps(record, ensure_ascii=False, default=str) + "\n"
+                        for record in records)
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+
+class SQLiteSink(ResultsSink):
+    """Stores the records in a SQLite table, replacing records with the same key."""
+
+    def __init__(self, path: str):
+        _make_parent_dir(path)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            " key TEXT PRIMARY KEY,"
+            " data TEXT NOT NULL,"
+            " stored_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def send(self, records: List[Dict]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO results (key, data, stored_at) VALUES (?, ?, ?)",
+                [(record["key"], json.dumps(record["data"], ensure_ascii=False, default=str),
+                  now) for record in records]
+            )
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class FirebaseSink(ResultsSink):
+    """Sends the records to Firebase Realtime Database, one update per batch."""
+
+    def __init__(self, database_url: Optional[str], credentials_path: Optional[str]):
+        self.database_url = database_url
+        self.credentials_path = credentials_path
+        self._db = None
+        self._lock = threading.Lock()
+
+    def _database(self):
+        with self._lock:
+            if self._db is None:
+                # Imported on first use: the SDK is slow to import and needs credentials
+                import firebase_admin  # pylint: disable=import-outside-toplevel
+                from firebase_admin import credentials, db  # pylint: disable=import-outside-toplevel
+
+                if not firebase_admin._apps:  # pylint: disable=protected-access
+                    if not self.credentials_path or not self.database_url:
+                        raise ValueError(
+                            "FIREBASE_CREDENTIALS_PATH and FIREBASE_URL must be set")
+                    firebase_admin.initialize_app(
+                        credentials.Certificate(self.credentials_path),
+                        {"databaseURL": self.database_url}
+                    )
+                self._db = db
+            return self._db
+
+    def send(self, records: List[Dict]) -> None:
+        database = self._database()
+        # A multi-location update writes every record of the batch in one request
+        database.reference("/").update({record["key"]: record["data"] for record in records})
+
+
+def create_sink(kind: str, path: str = "") -> ResultsSink:
+    """
+    Creates a results sink.
+
+    Args:
+        kind (str): "firebase", "jsonl" or "sqlite".
+        path (str): File of the local sinks. Empty for .cache/results.jsonl or
+            .cache/results.sqlite3.
+
+    Returns:
+        ResultsSink: The sink. Firebase reads FIREBASE_URL and FIREBASE_CREDENTIALS_PATH.
+    """
+    if kind == "firebase":
+        return FirebaseSink(os.getenv("FIREBASE_URL"), os.getenv("FIREBASE_CREDENTIALS_PATH"))
+    if kind == "jsonl":
+        return JsonLinesSink(path or ".cache/results.jsonl")
+    if kind == "sqlite":
+        return SQLiteSink(path or ".cache/results.sqlite3")
+    raise ValueError(f"kind must be one of {', '.join(RESULTS_SINKS)}")
+
+
+class BackgroundWriter:
+    """Sends records to a sink from a background thread, through a durable queue."""
+
+    def __init__(
+        self,
+        sink: ResultsSink,
+        queue_path: str,
+        batch_size: int = DEFAULT_RESULTS_BATCH_SIZE,
+        backoff_seconds: float = DEFAULT_BACKOFF_SECONDS,
+        max_backoff_seconds: float = DEFAULT_MAX_BACKOFF_SECONDS
+    ):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+        _make_parent_dir(queue_path)
+        self.sink = sink
+        self.batch_size = batch_size
+        self.backoff_seconds = backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.sent = 0
+        self.failures = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(queue_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pending ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " record TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " next_attempt REAL NOT NULL DEFAULT 0)"
+        )
+        self._conn.commit()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="results-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, record: Dict) -> bool:
+        """
+        Queues a record for delivery. Only writes to the local queue, never blocks on
+        the sink.
+
+        Returns:
+            bool: False if the record could not even be queued.
+        """
+        try:
+            serialized = json.dumps(record, ensure_ascii=False, default=str)
+            with self._lock:
+                self._conn.execute("INSERT INTO pending (record) VALUES (?)", (serialized,))
+                self._conn.commit()
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            logging.error("Error queuing the results: %s", e)
+            return False
+        self._wakeup.set()
+        return True
+
+    def pending(self) -> int:
+        """Returns the number of records waiting to be delivered."""
+        with self._lock:
+            (count,) = self._conn.execute("SELECT COUNT(*) FROM pending").fetchone()
+        return count
+
+    def _send_batch(self, ignore_backoff: bool = False) -> bool:
+        """Sends the oldest due records. Returns True if a batch was delivered."""
+        now = time.time()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, record, attempts FROM pending WHERE next_attempt <= ?"
+                " ORDER BY id LIMIT ?",
+                (float("inf") if ignore_backoff else now, self.batch_size)
+            ).fetchall()
+        if not rows:
+            return False
+        try:
+            with span("telemetry_upload", records=len(rows)):
+                self.sink.send([json.loads(record) for _, record, _ in rows])
+        except Exception as e:  # pylint: disable=broad-exception-caught
+            attempts = max(row[2] for row in rows) + 1
+            delay = min(self.max_backoff_seconds, self.backoff_seconds * 2 ** (attempts - 1))
+            logging.warning("Error sending %d results (attempt %d), retry in %.0f s: %s",
+                            len(rows), attempts, delay, e)
+            with self._lock:
+                self.failures += 1
+                self._conn.executemany(
+                    "UPDATE pending SET attempts = ?, next_attempt = ? WHERE id = ?",
+                    [(attempts, now + delay, row[0]) for row in rows]
+                )
+                self._conn.commit()
+            return False
+        with self._lock:
+            self._conn.executemany("DELETE FROM pending WHERE id = ?", [(row[0],) for row in rows])
+            self._conn.commit()
+            self.sent += len(rows)
+        return True
+
+    def _next_due_in(self) -> Optional[float]:
+        with self._lock:
+            (next_attempt,) = self._conn.execute(
+                "SELECT MIN(next_attempt) FROM pending").fetchone()
+        if next_attempt is None:
+            return None
+        return max(0.0, next_attempt - time.time())
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            while not self._stop.is_set() and self._send_batch():
+                pass
+            self._wakeup.wait(self._next_due_in())
+            self._wakeup.clear()
+
+    def close(self, timeout: float = DEFAULT_RESULTS_FLUSH_TIMEOUT) -> None:
+        """
+        Stops the background thread after one last attempt to deliver the pending
+        records, waiting at most timeout seconds. Undelivered records stay queued
+        for the next run.
+        """
+        deadline = time.monotonic() + timeout
+        self._stop.set()
+        self._wakeup.set()
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+        if not self._thread.is_alive():
+            while time.monotonic() < deadline and self._send_batch(ignore_backoff=True):
+                pass
+        remaining = self.pending()
+        if remaining:
+            logging.warning("%d results not delivered yet, they will be retried on the next run",
+                            remaining)
+        if not self._thread.is_alive():
+            self.sink.close()
+            with self._lock:
+                self._conn.close()
@@ -1,26 +1,213 @@
 import logging
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
 
 from langchain.retrievers.multi_query import MultiQueryRetriever
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.retrievers import BaseRetriever
+from pydantic import ConfigDict, PrivateAttr
 
+from src.answer_cache import normalize_question
+from src.lexical_index import LexicalRetriever
+from src.settings import (
+    DEFAULT_RETRIEVAL_K,
+    DEFAULT_RETRIEVAL_WORKERS,
+    DEFAULT_RETRIEVER_MODE,
+    RETRIEVER_MODES,
+)
+from src.tracing import propagate, span
 
-def setup_retriever(vector_db, llm, query_prompt):
+DEFAULT_RRF_K = 60
+DEFAULT_VARIANT_CACHE_SIZE = 1024
+
+# Numeración o viñetas con las que el LLM suele empezar cada versión de la pregunta
+_LIST_MARKER = re.compile(r"^\s*(?:[-*•]|\d+[.)])\s*")
+
+
+def document_key(document: Document) -> str:
+    """Identifica un documento para eliminar duplicados entre listas de resultados."""
+    document_id = getattr(document, "id", None)
+    if document_id:
+        return document_id
+    return f"{document.metadata.get('source', '')}\0{document.page_content}"
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Document]],
+                           rrf_k: int = DEFAULT_RRF_K) -> List[Document]:
+    """
+    Combina varias listas de resultados ordenadas con Reciprocal Rank Fusion.
+
+    Cada documento obtiene la suma de 1 / (rrf_k + posición) en todas las listas en las
+    que aparece, y los duplicados se eliminan.
+
+    Parámetros:
+    - rankings (list): Listas de documentos, cada una ordenada de más a menos relevante.
+    - rrf_k (int, opcional): Constante de suavizado de RRF. Por defecto 60.
+
+    Retorna:
+    - list: Los documentos sin duplicados, ordenados por puntuación RRF descendente.
+    """
+    scores: Dict[str, float] = {}
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for position, document in enumerate(ranking, start=1):
+            key = document_key(document)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + position)
+            documents.setdefault(key, document)
+    ordered = sorted(scores, key=scores.get, reverse=True)
+    return [documents[key] for key in ordered]
+
+
+def parse_query_variants(text: str) -> List[str]:
+    """Extrae las versiones alternativas de la pregunta, una por línea, de la respuesta del LLM."""
+    variants = []
+    for line in text.splitlines():
+        line = _LIST_MARKER.sub("", line).strip()
+        if line:
+            variants.append(line)
+    return variants
+
+
+class FusionMultiQueryRetriever(BaseRetriever):
+    """
+    Recuperador de múltiples consultas con versiones cacheadas, búsquedas en paralelo
+    y combinación de resultados con Reciprocal Rank Fusion.
+
+    Si skip_expansion_score está definido y el mejor resultado de la pregunta original
+    tiene una puntuación de relevancia igual o superior, no se generan versiones
+    alternativas y se ahorra la llamada al LLM.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_db: Any
+    query_chain: Any
+    k: int = DEFAULT_RETRIEVAL_K
+    rrf_k: int = DEFAULT_RRF_K
+    skip_expansion_score: Optional[float] = None
+    max_workers: int = DEFAULT_RETRIEVAL_WORKERS  # 0: un hilo por versión
+    variant_cache_size: int = DEFAULT_VARIANT_CACHE_SIZE
+
+    _variant_cache: OrderedDict = PrivateAttr(default_factory=OrderedDict)
+    _variant_lock: Any = PrivateAttr(default_factory=threading.Lock)
+
+    def generate_variants(self, query: str, run_manager=None) -> List[str]:
+        """Devuelve las versiones alternativas de la pregunta, generándolas solo una vez."""
+        key = normalize_question(query)
+        with self._variant_lock:
+            if key in self._variant_cache:
+                self._variant_cache.move_to_end(key)
+                return list(self._variant_cache[key])
+
+        config = {"callbacks": run_manager.get_child()} if run_manager else None
+        with span("query_expansion") as expansion_span:
+            variants = parse_query_variants(
+                self.query_chain.invoke({"question": query}, config=config))
+            expansion_span.set(variants=len(variants))
+
+        with self._variant_lock:
+            self._variant_cache[key] = variants
+            self._variant_cache.move_to_end(key)
+            while len(self._variant_cache) > self.variant_cache_size:
+                self._variant_cache.popitem(last=False)
+        return list(variants)
+
+    def _search_variants(self, variants: List[str]) -> List[List[Document]]:
+        """Calcula el embedding de cada versión y la busca, todas en paralelo."""
+        # embed_query no pasa por la caché de embeddings de los fragmentos
+        embeddings = self.vector_db.embeddings
+        workers = max(1, min(self.max_workers or len(variants), len(variants)))
+
+        def search(variant):
+            with span("retrieval", kind="vector", variant=True):
+                vector = embeddings.embed_query(variant)
+                return self.vector_db.similarity_search_by_vector(vector, k=self.k)
+
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="retrieval") as executor:
+            return list(executor.map(propagate(search), variants))
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with span("retrieval", kind="vector", variant=False):
+            original = self.vector_db.similarity_search_with_relevance_scores(query, k=self.k)
+        original_documents = [document for document, _ in original]
+        if (self.skip_expansion_score is not None and original
+                and original[0][1] >= self.skip_expansion_score):
+            logging.info("Expansión de la consulta omitida (puntuación %.3f)", original[0][1])
+            return original_documents
+
+        variants = [
+            variant for variant in self.generate_variants(query, run_manager)
+            if normalize_question(variant) != normalize_question(query)
+        ]
+        if not variants:
+            return original_documents
+        rankings = [original_documents] + self._search_variants(variants)
+        return reciprocal_rank_fusion(rankings, self.rrf_k)
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Recuperador híbrido: ejecuta en paralelo un recuperador vectorial y el recuperador
+    léxico BM25, y combina ambas listas de resultados con Reciprocal Rank Fusion.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    vector_retriever: Any
+    lexical_retriever: Any
+    rrf_k: int = DEFAULT_RRF_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        config = {"callbacks": run_manager.get_child()}
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="lexical") as executor:
+            lexical = executor.submit(propagate(self.lexical_retriever.invoke), query, config)
+            vector_documents = self.vector_retriever.invoke(query, config=config)
+            lexical_documents = lexical.result()
+        return reciprocal_rank_fusion([vector_documents, lexical_documents], self.rrf_k)
+
+
+def setup_retriever(vector_db, llm, query_prompt, mode: str = DEFAULT_RETRIEVER_MODE,
+                    k: int = DEFAULT_RETRIEVAL_K, skip_expansion_score: Optional[float] = None,
+                    lexical_index=None, max_workers: int = DEFAULT_RETRIEVAL_WORKERS):
     """
-    Configura un sistema de recuperación de múltiples consultas utilizando un modelo de 
+    Configura un sistema de recuperación de múltiples consultas utilizando un modelo de
     lenguaje (LLM) y una base de datos vectorial.
 
-    Esta función configura el sistema de recuperación usando la clase `MultiQueryRetriever` 
-    de la biblioteca `langchain.retrievers.multi_query`.
-    Se utiliza para realizar consultas a una base de datos vectorial a través de un modelo de lenguaje, 
-    generando múltiples versiones alternativas de la consulta original para obtener resultados más relevantes.
+    El LLM genera múltiples versiones alternativas de la consulta original para obtener
+    resultados más relevantes. En el modo "fusion" (por defecto) se utiliza
+    `FusionMultiQueryRetriever`, que cachea las versiones generadas para cada pregunta,
+    realiza las búsquedas en paralelo y combina los resultados con Reciprocal Rank Fusion.
+    En el modo "multi_query" se utiliza la clase `MultiQueryRetriever` de
+    `langchain.retrievers.multi_query`, que realiza las búsquedas una tras otra.
+    El modo "hybrid" combina el recuperador "fusion" con el índice léxico BM25, y el modo
+    "lexical" solo utiliza el índice léxico, sin LLM ni llamadas de embeddings.
 
     Parámetros:
     - vector_db (Retriever): Instancia de un objeto recuperador de base de datos vectorial.
     - llm (ChatOllama): Modelo de lenguaje (LLM) que se utilizará para generar consultas alternativas.
-    - query_prompt (PromptTemplate): Plantilla de consulta que especifica cómo generar versiones alternativas 
+    - query_prompt (PromptTemplate): Plantilla de consulta que especifica cómo generar versiones alternativas
     de la pregunta original.
+    - mode (str, opcional): "fusion" o "multi_query".
+    - k (int, opcional): Número de documentos recuperados por cada versión de la pregunta.
+    - skip_expansion_score (float, opcional): Solo en el modo "fusion". Puntuación de
+      relevancia del mejor resultado de la pregunta original a partir de la cual no se
+      generan versiones alternativas. None para generarlas siempre.
+    - lexical_index (LexicalIndex, opcional): Índice léxico de los fragmentos, necesario en
+      los modos "hybrid" y "lexical".
+    - max_workers (int, opcional): Solo en los modos "fusion" y "hybrid". Número de hilos
+      que buscan las versiones de la pregunta, 0 para uno por versión.
 
     Retorna:
-    - retriever (MultiQueryRetriever): Una instancia del sistema de recuperación configurado correctamente.
+    - retriever (BaseRetriever): Una instancia del sistema de recuperación configurado correctamente.
     - None: Si ocurre un error durante la configuración del sistema de recuperación.
 
     Excepciones:
@@ -30,10 +217,33 @@ def setup_retriever(vector_db, llm, query_prompt):
     retriever = setup_retriever(vector_db, llm, query_prompt)
     """
     try:
-        retriever = MultiQueryRetriever.from_llm(
-            vector_db.as_retriever(), llm, prompt=query_prompt
-        )
-        logging.info("Sistema de recuperación configurado correctamente")
+        if mode not in RETRIEVER_MODES:
+            raise ValueError(f"mode debe ser uno de {', '.join(RETRIEVER_MODES)}")
+        if mode in ("hybrid", "lexical") and lexical_index is None:
+            raise ValueError(f"El modo {mode} necesita un índice léxico")
+
+        if mode == "multi_query":
+            retriever = MultiQueryRetriever.from_llm(
+                vector_db.as_retriever(search_kwargs={"k": k}), llm, prompt=query_prompt
+            )
+        elif mode == "lexical":
+            retriever = LexicalRetriever(index=lexical_index, docstore=vector_db.docstore, k=k)
+        else:
+            retriever = FusionMultiQueryRetriever(
+                vector_db=vector_db,
+                query_chain=query_prompt | llm | StrOutputParser(),
+                k=k,
+                skip_expansion_score=skip_expansion_score,
+                max_workers=max_workers,
+            )
+            if mode == "hybrid":
+                retriever = HybridRetriever(
+                    vector_retriever=retriever,
+                    lexical_retriever=LexicalRetriever(
+                        index=lexical_index, docstore=vector_db.docstore, k=k
+                    ),
+                )
+        logging.info("Sistema de recuperación configurado correctamente (%s)", mode)
         return retriever
     except Exception as e:
         logging.error("Error configurando el sistema de recuperación: %s", e)
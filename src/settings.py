@@ -0,0 +1,236 @@
+"""
+src/settings.py
+
+This module defines the optional tuning settings of the pipeline. Unlike the
+required variables read by ``load_config`` in ``main.py``, every setting here
+has a default value and can be overridden through an environment variable.
+"""
+import dataclasses
+import os
+from typing import Optional
+
+# Defaults
+DEFAULT_INDEX_CACHE_DIR = ".cache/index"
+DEFAULT_EMBEDDING_CACHE_PATH = ".cache/embeddings.sqlite3"
+DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES = 500_000
+DEFAULT_EMBED_BATCH_SIZE = 32
+DEFAULT_EMBED_MAX_IN_FLIGHT = 4
+DEFAULT_EMBED_MAX_RETRIES = 3
+DEFAULT_PDF_WORKERS = 0
+DEFAULT_INGESTION_MODE = "batch"
+DEFAULT_STREAM_QUEUE_SIZE = 8
+
+DEFAULT_PDF_BACKEND = "unstructured"
+DEFAULT_PARSE_CACHE_DIR = ".cache/parsed"
+DEFAULT_ANSWER_CACHE_PATH = ".cache/answers.sqlite3"
+DEFAULT_ANSWER_CACHE_SIMILARITY = 0.95
+DEFAULT_ANSWER_CACHE_TTL_SECONDS = 7 * 24 * 3600
+DEFAULT_ANSWER_CACHE_MAX_ENTRIES = 10_000
+DEFAULT_QUERY_CONCURRENCY = 1
+DEFAULT_RETRIEVER_MODE = "fusion"
+DEFAULT_RETRIEVAL_K = 4
+DEFAULT_RETRIEVAL_WORKERS = 0
+DEFAULT_FAISS_INDEX_TYPE = "flat"
+DEFAULT_FAISS_NLIST = 0
+DEFAULT_FAISS_PQ_M = 0
+DEFAULT_FAISS_HNSW_M = 32
+DEFAULT_FAISS_NPROBE = 16
+DEFAULT_FAISS_EF_SEARCH = 64
+DEFAULT_SERVER_HOST = "127.0.0.1"
+DEFAULT_SERVER_PORT = 8000
+DEFAULT_SERVER_MAX_CONCURRENCY = 8
+DEFAULT_TRACE_FILE = ".cache/traces.jsonl"
+DEFAULT_RESULTS_SINK = "firebase"
+DEFAULT_RESULTS_QUEUE_PATH = ".cache/results_queue.sqlite3"
+DEFAULT_RESULTS_BATCH_SIZE = 50
+DEFAULT_RESULTS_FLUSH_TIMEOUT = 10.0
+DEFAULT_DEDUP_THRESHOLD = 0.0
+DEFAULT_DEDUP_NUM_PERM = 64
+DEFAULT_CONTEXT_TOKEN_BUDGET = 1500
+DEFAULT_OLLAMA_KEEP_ALIVE = "30m"
+DEFAULT_OLLAMA_POOL_SIZE = 16
+DEFAULT_OLLAMA_WARMUP = "true"
+DEFAULT_INDEX_SHARDS = 1
+DEFAULT_SHARD_BY = "source"
+DEFAULT_SEARCH_PROCESSES = 0
+DEFAULT_INCREMENTAL_INDEX = "false"
+DEFAULT_RESOURCE_SAMPLE_INTERVAL = 0.2
+
+INGESTION_MODES = ("batch", "stream")
+PDF_BACKENDS = ("unstructured", "fast")
+RETRIEVER_MODES = ("fusion", "multi_query", "hybrid", "lexical")
+FAISS_INDEX_TYPES = ("flat", "ivf", "hnsw", "ivfpq")
+RESULTS_SINKS = ("firebase", "jsonl", "sqlite")
+BOOLEAN_CHOICES = ("true", "false")
+SHARD_STRATEGIES = ("source", "hash")
+
+
+def _env_int(name: str, default: int) -> int:
+    """Reads an integer environment variable, falling back to the default if unset."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return int(value)
+    except ValueError as e:
+        raise ValueError(f"{name} must be an integer, got {value!r}") from e
+
+
+def _env_float(name: str, default: Optional[float]) -> Optional[float]:
+    """Reads a float environment variable, falling back to the default if unset."""
+    value = os.getenv(name)
+    if value is None or value.strip() == "":
+        return default
+    try:
+        return float(value)
+    except ValueError as e:
+        raise ValueError(f"{name} must be a number, got {value!r}") from e
+
+
+def _env_choice(name: str, default: str, choices) -> str:
+    """Reads an environment variable that must take one of the given values."""
+    value = (os.getenv(name) or default).strip().lower()
+    if value not in choices:
+        raise ValueError(f"{name} must be one of {', '.join(choices)}, got {value!r}")
+    return value
+
+
+@dataclasses.dataclass
+class PipelineSettings:
+    """Represents the optional tuning settings of the pipeline."""
+    index_cache_dir: str
+    embedding_cache_path: str
+    embedding_cache_max_entries: int
+    embed_batch_size: int
+    embed_max_in_flight: int
+    embed_max_retries: int
+    pdf_workers: int
+    ingestion_mode: str
+    stream_queue_size: int
+    pdf_backend: str
+    parse_cache_dir: str
+    answer_cache_path: str
+    answer_cache_similarity: float
+    answer_cache_ttl_seconds: float
+    answer_cache_max_entries: int
+    questions_file: str
+    query_concurrency: int
+    retriever_mode: str
+    retrieval_k: int
+    retrieval_workers: int
+    skip_expansion_score: Optional[float]
+    faiss_index_type: str
+    faiss_nlist: int
+    faiss_pq_m: int
+    faiss_hnsw_m: int
+    faiss_nprobe: int
+    faiss_ef_search: int
+    server_host: str
+    server_port: int
+    server_max_concurrency: int
+    trace_file: str
+    results_sink: str
+    results_path: str
+    results_queue_path: str
+    results_batch_size: int
+    results_flush_timeout: float
+    dedup_threshold: float
+    dedup_num_perm: int
+    context_token_budget: int
+    ollama_keep_alive: str
+    ollama_pool_size: int
+    ollama_warmup: bool
+    index_shards: int
+    shard_by: str
+    search_processes: int
+    incremental_index: bool
+    resource_sample_interval: float
+
+
+def load_settings() -> PipelineSettings:
+    """
+    Loads the optional settings from environment variables.
+
+    ``load_config`` must have been called first so that the values of the
+    ``.env`` file are already in the environment.
+
+    Returns:
+        PipelineSettings: The settings, with defaults for unset variables.
+    """
+    return PipelineSettings(
+        # An empty INDEX_CACHE_DIR disables the persistent index cache
+        index_cache_dir=os.getenv("INDEX_CACHE_DIR", DEFAULT_INDEX_CACHE_DIR),
+        # An empty EMBEDDING_CACHE_PATH disables the chunk embedding cache
+        embedding_cache_path=os.getenv("EMBEDDING_CACHE_PATH", DEFAULT_EMBEDDING_CACHE_PATH),
+        embedding_cache_max_entries=_env_int(
+            "EMBEDDING_CACHE_MAX_ENTRIES", DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES),
+        embed_batch_size=_env_int("EMBED_BATCH_SIZE", DEFAULT_EMBED_BATCH_SIZE),
+        embed_max_in_flight=_env_int("EMBED_MAX_IN_FLIGHT", DEFAULT_EMBED_MAX_IN_FLIGHT),
+        embed_max_retries=_env_int("EMBED_MAX_RETRIES", DEFAULT_EMBED_MAX_RETRIES),
+        # 0 uses one process per CPU
+        pdf_workers=_env_int("PDF_WORKERS", DEFAULT_PDF_WORKERS),
+        ingestion_mode=_env_choice("INGESTION_MODE", DEFAULT_INGESTION_MODE, INGESTION_MODES),
+        stream_queue_size=_env_int("STREAM_QUEUE_SIZE", DEFAULT_STREAM_QUEUE_SIZE),
+        pdf_backend=_env_choice("PDF_BACKEND", DEFAULT_PDF_BACKEND, PDF_BACKENDS),
+        # An empty PARSE_CACHE_DIR disables the parsed document cache
+        parse_cache_dir=os.getenv("PARSE_CACHE_DIR", DEFAULT_PARSE_CACHE_DIR),
+        # An empty ANSWER_CACHE_PATH disables the answer cache
+        answer_cache_path=os.getenv("ANSWER_CACHE_PATH", DEFAULT_ANSWER_CACHE_PATH),
+        answer_cache_similarity=_env_float(
+            "ANSWER_CACHE_SIMILARITY", DEFAULT_ANSWER_CACHE_SIMILARITY),
+        answer_cache_ttl_seconds=_env_float(
+            "ANSWER_CACHE_TTL_SECONDS", DEFAULT_ANSWER_CACHE_TTL_SECONDS),
+        answer_cache_max_entries=_env_int(
+            "ANSWER_CACHE_MAX_ENTRIES", DEFAULT_ANSWER_CACHE_MAX_ENTRIES),
+        # An empty QUESTIONS_FILE answers the default questions of main.py
+        questions_file=os.getenv("QUESTIONS_FILE", ""),
+        query_concurrency=_env_int("QUERY_CONCURRENCY", DEFAULT_QUERY_CONCURRENCY),
+        retriever_mode=_env_choice("RETRIEVER_MODE", DEFAULT_RETRIEVER_MODE, RETRIEVER_MODES),
+        retrieval_k=_env_int("RETRIEVAL_K", DEFAULT_RETRIEVAL_K),
+        # 0 searches every query variant in its own thread
+        retrieval_workers=_env_int("RETRIEVAL_WORKERS", DEFAULT_RETRIEVAL_WORKERS),
+        # Unset: the query is always expanded with the LLM
+        skip_expansion_score=_env_float("SKIP_EXPANSION_SCORE", None),
+        faiss_index_type=_env_choice(
+            "FAISS_INDEX_TYPE", DEFAULT_FAISS_INDEX_TYPE, FAISS_INDEX_TYPES),
+        # 0 derives nlist from the number of vectors and pq_m from the dimensions
+        faiss_nlist=_env_int("FAISS_NLIST", DEFAULT_FAISS_NLIST),
+        faiss_pq_m=_env_int("FAISS_PQ_M", DEFAULT_FAISS_PQ_M),
+        faiss_hnsw_m=_env_int("FAISS_HNSW_M", DEFAULT_FAISS_HNSW_M),
+        faiss_nprobe=_env_int("FAISS_NPROBE", DEFAULT_FAISS_NPROBE),
+        faiss_ef_search=_env_int("FAISS_EF_SEARCH", DEFAULT_FAISS_EF_SEARCH),
+        server_host=os.getenv("SERVER_HOST", DEFAULT_SERVER_HOST),
+        server_port=_env_int("SERVER_PORT", DEFAULT_SERVER_PORT),
+        server_max_concurrency=_env_int(
+            "SERVER_MAX_CONCURRENCY", DEFAULT_SERVER_MAX_CONCURRENCY),
+        # An empty TRACE_FILE disables the JSON lines export of the traces
+        trace_file=os.getenv("TRACE_FILE", DEFAULT_TRACE_FILE),
+        results_sink=_env_choice("RESULTS_SINK", DEFAULT_RESULTS_SINK, RESULTS_SINKS),
+        # An empty RESULTS_PATH uses .cache/results.jsonl or .cache/results.sqlite3
+        results_path=os.getenv("RESULTS_PATH", ""),
+        results_queue_path=os.getenv("RESULTS_QUEUE_PATH", DEFAULT_RESULTS_QUEUE_PATH),
+        results_batch_size=_env_int("RESULTS_BATCH_SIZE", DEFAULT_RESULTS_BATCH_SIZE),
+        results_flush_timeout=_env_float(
+            "RESULTS_FLUSH_TIMEOUT", DEFAULT_RESULTS_FLUSH_TIMEOUT),
+        # 0, the default, disables the chunk deduplication; 1 only removes exact duplicates
+        dedup_threshold=_env_float("DEDUP_THRESHOLD", DEFAULT_DEDUP_THRESHOLD),
+        dedup_num_perm=_env_int("DEDUP_NUM_PERM", DEFAULT_DEDUP_NUM_PERM),
+        # 0 packs every retrieved chunk, without a token limit
+        context_token_budget=_env_int("CONTEXT_TOKEN_BUDGET", DEFAULT_CONTEXT_TOKEN_BUDGET),
+        # A duration ("30m"), seconds, or -1 to keep the models loaded; empty for Ollama's
+        ollama_keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", DEFAULT_OLLAMA_KEEP_ALIVE),
+        ollama_pool_size=_env_int("OLLAMA_POOL_SIZE", DEFAULT_OLLAMA_POOL_SIZE),
+        ollama_warmup=_env_choice(
+            "OLLAMA_WARMUP", DEFAULT_OLLAMA_WARMUP, BOOLEAN_CHOICES) == "true",
+        # 1 keeps a single in-process FAISS index
+        index_shards=_env_int("INDEX_SHARDS", DEFAULT_INDEX_SHARDS),
+        shard_by=_env_choice("SHARD_BY", DEFAULT_SHARD_BY, SHARD_STRATEGIES),
+        # 0 uses one search process per shard, up to the number of CPUs
+        search_processes=_env_int("SEARCH_PROCESSES", DEFAULT_SEARCH_PROCESSES),
+        # Requires INDEX_CACHE_DIR; batch ingestion with a single index only
+        incremental_index=_env_choice(
+            "INCREMENTAL_INDEX", DEFAULT_INCREMENTAL_INDEX, BOOLEAN_CHOICES) == "true",
+        # Seconds between two samples of the resources used by each step, 0 disables it
+        resource_sample_interval=_env_float(
+            "RESOURCE_SAMPLE_INTERVAL", DEFAULT_RESOURCE_SAMPLE_INTERVAL),
+    )
@@ -0,0 +1,561 @@
+"""
+src/sharded_index.py
+
+This module implements a vector database partitioned into shards. Each shard is an
+independent FAISS index saved in the memory-mappable layout of src/mmap_store.py, in
+its own directory, and the shards of a database are listed in a manifest:
+
+    <directory>/shards.json
+    <directory>/shard-0000/index.faiss, docstore.sqlite3
+    <directory>/shard-0001/...
+
+Chunks are assigned to a shard by their source document (all the chunks of a PDF in
+the same shard) or by a hash of their text (evenly sized shards). A search embeds the
+query once, fans it out to every shard in a pool of worker processes, each of which
+keeps its shards open memory-mapped, and merges the top-k hits by score. New shards
+are added, and the manifest replaced atomically, without touching the existing ones,
+so ingestion and search scale with the number of cores.
+"""
+import atexit
+import bisect
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS
+from langchain_community.vectorstores.utils import maximal_marginal_relevance
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from src.faiss_index import IndexOptions, apply_index_type, configure_search
+from src.mmap_store import (
+    DOCSTORE_FILE,
+    INDEX_FILE,
+    SQLiteDocstore,
+    SQLiteIndexToDocstoreId,
+    read_index,
+    save_vector_db,
+)
+from src.settings import DEFAULT_SHARD_BY, SHARD_STRATEGIES
+from src.tracing import span
+
+SHARDS_MANIFEST = "shards.json"
+
+# Bump when the layout of the manifest changes
+MANIFEST_FORMAT_VERSION = 1
+
+# Metadata filter of a search, as in LangChain's FAISS: a predicate of the metadata or
+# the values it must have
+MetadataFilter = Union[Callable[[dict], bool], Dict[str, Any]]
+
+
+def shard_of(document: Document, num_shards: int, by: str = DEFAULT_SHARD_BY) -> int:
+    """
+    Returns the shard of a chunk.
+
+    Args:
+        document (Document): The chunk.
+        num_shards (int): Number of shards.
+        by (str): "source" keeps the chunks of a document together, "hash" spreads the
+            chunks evenly by a hash of their text.
+
+    Returns:
+        int: The shard number, stable across runs.
+    """
+    if by not in SHARD_STRATEGIES:
+        raise ValueError(f"by must be one of {', '.join(SHARD_STRATEGIES)}")
+    key = document.metadata.get("source", "") if by == "source" else document.page_content
+    digest = hashlib.sha1(str(key).encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % num_shards
+
+
+def read_manifest(directory: str) -> Optional[Dict[str, Any]]:
+    """Returns the manifest of a sharded database, None if the directory has none."""
+    path = os.path.join(directory, SHARDS_MANIFEST)
+    if not os.path.isfile(path):
+        return None
+    with open(path, encoding="utf-8") as file:
+        manifest = json.load(file)
+    if manifest.get("format") != MANIFEST_FORMAT_VERSION:
+        raise ValueError(f"Unsupported shard manifest format in {path}")
+    return manifest
+
+
+def _write_manifest(directory: str, manifest: Dict[str, Any]) -> None:
+    # Written next to the final file and renamed, so readers never see a partial one
+    fd, tmp_path = tempfile.mkstemp(prefix=".shards.", suffix=".json", dir=directory)
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, indent=2)
+        os.replace(tmp_path, os.path.join(directory, SHARDS_MANIFEST))
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def add_shard(directory: str, vector_db: FAISS) -> str:
+    """
+    Saves a vector database as a new shard of a sharded database.
+
+    The other shards are not read or modified. The shard is written to a temporary
+    directory, renamed into place, and only then listed in the manifest.
+
+    Args:
+        directory (str): Directory of the sharded database, created if needed.
+        vector_db (FAISS): The vectors and chunks of the new shard.
+
+    Returns:
+        str: The name of the new shard.
+    """
+    os.makedirs(directory, exist_ok=True)
+    manifest = read_manifest(directory) or {
+        "format": MANIFEST_FORMAT_VERSION,
+        "metric": "ip" if vector_db.index.metric_type == faiss.METRIC_INNER_PRODUCT else "l2",
+        "shards": [],
+    }
+    names = {shard["name"] for shard in manifest["shards"]}
+    number = len(manifest["shards"])
+    while f"shard-{number:04d}" in names:
+        number += 1
+    name = f"shard-{number:04d}"
+    tmp_dir = tempfile.mkdtemp(prefix=f".{name}.", dir=directory)
+    try:
+        save_vector_db(vector_db, tmp_dir)
+        os.replace(tmp_dir, os.path.join(directory, name))
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    manifest["shards"].append({"name": name, "vectors": int(vector_db.index.ntotal)})
+    _write_manifest(directory, manifest)
+    logging.info("Shard %s added to %s (%d vectors)", name, directory,
+                 vector_db.index.ntotal)
+    return name
+
+
+# Indexes opened by a search worker process, by path
+_worker_indexes: Dict[str, Any] = {}
+_worker_options: Optional[IndexOptions] = None
+
+
+def _init_worker(index_options: Optional[IndexOptions]) -> None:
+    global _worker_options  # pylint: disable=global-statement
+    _worker_options = index_options
+
+
+def _worker_index(index_path: str) -> Any:
+    """Returns a shard index of the worker process, opening it on first use."""
+    index = _worker_indexes.get(index_path)
+    if index is None:
+        index = read_index(index_path, mmap=True)
+        if _worker_options is not None:
+            configure_search(index, _worker_options)
+        _worker_indexes[index_path] = index
+    return index
+
+
+def _search_shard(index_path: str, vectors: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Searches one shard in a worker process."""
+    return _worker_index(index_path).search(vectors, k)
+
+
+def _reconstruct_shard(index_path: str, positions: List[int]) -> np.ndarray:
+    """Returns the stored vectors of positions of one shard, in a worker process."""
+    index = _worker_index(index_path)
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        ivf = None
+    # IVF indexes only reconstruct a position through their direct map
+    if ivf is not None and ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+    return np.vstack([index.reconstruct(position) for position in positions])
+
+
+def _check_search_kwargs(kwargs: Dict[str, Any]) -> None:
+    if kwargs:
+        raise TypeError(f"Unsupported search arguments: {', '.join(sorted(kwargs))}")
+
+
+def _metadata_filter(filter_: MetadataFilter) -> Callable[[dict], bool]:
+    """
+    Returns the predicate of a search filter: a callable taking the metadata, or a dict
+    whose values the metadata must equal, or contain when the value is a list.
+    """
+    if callable(filter_):
+        return filter_
+
+    def matches(metadata: dict) -> bool:
+        for key, value in filter_.items():
+            if isinstance(value, list):
+                if metadata.get(key) not in value:
+                    return False
+            elif metadata.get(key) != value:
+                return False
+        return True
+
+    return matches
+
+
+class _Shard:
+    """Docstore side of a shard, opened in the main process."""
+
+    def __init__(self, directory: str, size: int):
+        self.directory = directory
+        # Number of vectors, as recorded in the manifest
+        self.size = size
+        self.index_path = os.path.join(directory, INDEX_FILE)
+        self.docstore = SQLiteDocstore(os.path.join(directory, DOCSTORE_FILE))
+        self.positions = SQLiteIndexToDocstoreId(self.docstore)
+
+
+class ShardedDocstore:
+    """Looks up a chunk id in the docstores of every shard."""
+
+    def __init__(self, shards: List[_Shard]):
+        self.shards = shards
+
+    def search(self, search: str) -> Union[str, Document]:
+        for shard in self.shards:
+            document = shard.docstore.search(search)
+            if isinstance(document, Document):
+                return document
+        return f"ID {search} not found."
+
+
+class ShardedIndexToDocstoreId(Mapping):
+    """Read-only position -> chunk id mapping over the shards, in shard order."""
+
+    def __init__(self, shards: List[_Shard]):
+        self.shards = shards
+        # Global position of the first vector of each shard, extended as shards are added
+        self._offsets: List[int] = []
+        self._total = 0
+
+    def _update_offsets(self) -> None:
+        for shard in self.shards[len(self._offsets):]:
+            self._offsets.append(self._total)
+            self._total += shard.size
+
+    def _locate(self, position: int) -> Tuple[_Shard, int]:
+        self._update_offsets()
+        if position < 0 or position >= self._total:
+            raise KeyError(position)
+        number = bisect.bisect_right(self._offsets, position) - 1
+        return self.shards[number], position - self._offsets[number]
+
+    def __getitem__(self, position: int) -> str:
+        shard, local = self._locate(position)
+        return shard.positions[local]
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(range(len(self)))
+
+    def __len__(self) -> int:
+        self._update_offsets()
+        return self._total
+
+    def values(self) -> Iterable[str]:  # type: ignore[override]
+        return [shard.positions[position] for shard in self.shards
+                for position in shard.positions]
+
+
+class ShardedVectorStore(VectorStore):
+    """
+    Vector store searching every shard of a sharded database in parallel processes.
+
+    It supports the searches used by the retrievers (by query or by vector, with
+    distance or relevance scores) and exposes a docstore and an index to docstore id
+    mapping over all the shards, like LangChain's FAISS.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        embeddings: Embeddings,
+        index_options: Optional[IndexOptions] = None,
+        max_processes: int = 0
+    ):
+        manifest = read_manifest(directory)
+        if manifest is None:
+            raise ValueError(f"No shard manifest in {directory}")
+        self.directory = directory
+        self.embedding_function = embeddings
+        self.index_options = index_options
+        self.max_processes = max_processes
+        self.metric = manifest["metric"]
+        self.shards = [_Shard(os.path.join(directory, shard["name"]), shard["vectors"])
+                       for shard in manifest["shards"]]
+        self.docstore = ShardedDocstore(self.shards)
+        self.index_to_docstore_id = ShardedIndexToDocstoreId(self.shards)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._pool_size = 0
+        self._pool_lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding_function
+
+    @property
+    def num_shards(self) -> int:
+        """Number of shards of the database."""
+        return len(self.shards)
+
+    def _executor(self) -> ProcessPoolExecutor:
+        # Created on the first search; spawned workers do not inherit the threads
+        # (query server, embedding pools) of this process
+        size = self.max_processes or min(self.num_shards, os.cpu_count() or 1)
+        with self._pool_lock:
+            if self._pool is None or self._pool_size != size:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(
+                    max_workers=size,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.index_options,)
+                )
+                self._pool_size = size
+            return self._pool
+
+    def _ranked_hits(self, embedding: List[float], k: int) -> List[Tuple[float, _Shard, int]]:
+        """Returns the k best (score, shard, position) of every shard, best first."""
+        vectors = np.asarray([embedding], dtype=np.float32)
+        with span("shard_search", shards=self.num_shards, k=k):
+            executor = self._executor()
+            futures = [(shard, executor.submit(_search_shard, shard.index_path, vectors, k))
+                       for shard in self.shards]
+            hits = []
+            for shard, future in futures:
+                scores, positions = future.result()
+                hits.extend((float(score), shard, int(position))
+                            for score, position in zip(scores[0], positions[0])
+                            if position != -1)
+        # Distances are better when lower, inner products when higher
+        hits.sort(key=lambda hit: -hit[0] if self.metric == "ip" else hit[0])
+        return hits
+
+    def _search_hits(
+        self,
+        embedding: List[float],
+        k: int,
+        filter_: Optional[MetadataFilter] = None,
+        fetch_k: int = 20
+    ) -> List[Tuple[Document, float, _Shard, int]]:
+        """
+        Returns the k best (chunk, score, shard, position) over all shards. With a filter,
+        fetch_k candidates of each shard are checked against the metadata.
+        """
+        if not self.shards:
+            return []
+        predicate = _metadata_filter(filter_) if filter_ is not None else None
+        results = []
+        for score, shard, position in self._ranked_hits(
+                embedding, k if predicate is None else max(k, fetch_k)):
+            document = shard.docstore.search(shard.positions[position])
+            if not isinstance(document, Document):
+                continue
+            if predicate is None or predicate(document.metadata):
+                results.append((document, score, shard, position))
+                if len(results) == k:
+                    break
+        return results
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[MetadataFilter] = None,  # pylint: disable=redefined-builtin
+        fetch_k: int = 20,
+        score_threshold: Optional[float] = None,
+        **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """
+        Returns the k chunks closest to a vector over all shards, with their distance.
+        Like LangChain's FAISS, the chunks can be filtered by metadata (callable or dict
+        of values) out of fetch_k candidates per shard, and by score_threshold. Other
+        search arguments raise a TypeError instead of being ignored.
+        """
+        _check_search_kwargs(kwargs)
+        results = [(document, score) for document, score, _, _ in
+                   self._search_hits(embedding, k, filter, fetch_k)]
+        if score_threshold is not None:
+            results = [(document, score) for document, score in results
+                       if (score >= score_threshold if self.metric == "ip"
+                           else score <= score_threshold)]
+        return results
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    **kwargs: Any) -> List[Document]:
+        return [document for document, _ in
+                self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        embedding = self.embeddings.embed_query(query)
+        return self.similarity_search_with_score_by_vector(embedding, k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _hit_vectors(self, hits: List[Tuple[Document, float, _Shard, int]]) -> np.ndarray:
+        """Returns the stored vectors of search hits, read by the worker processes."""
+        positions_by_shard: Dict[str, List[int]] = {}
+        for _, _, shard, position in hits:
+            positions_by_shard.setdefault(shard.index_path, []).append(position)
+        executor = self._executor()
+        futures = {path: executor.submit(_reconstruct_shard, path, positions)
+                   for path, positions in positions_by_shard.items()}
+        # Each shard returns its vectors in the order of its hits
+        shard_vectors = {path: iter(future.result()) for path, future in futures.items()}
+        return np.vstack([next(shard_vectors[shard.index_path]) for _, _, shard, _ in hits])
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        filter: Optional[MetadataFilter] = None,  # pylint: disable=redefined-builtin
+        **kwargs: Any
+    ) -> List[Document]:
+        """
+        Returns k chunks selected with maximal marginal relevance among the fetch_k
+        closest over all shards. The candidate vectors are read from the shard indexes.
+        """
+        _check_search_kwargs(kwargs)
+        hits = self._search_hits(embedding, fetch_k, filter, fetch_k)
+        if not hits:
+            return []
+        selected = maximal_marginal_relevance(np.asarray(embedding, dtype=np.float32),
+                                              self._hit_vectors(hits),
+                                              lambda_mult=lambda_mult, k=k)
+        return [hits[position][0] for position in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any
+    ) -> List[Document]:
+        embedding = self.embeddings.embed_query(query)
+        return self.max_marginal_relevance_search_by_vector(embedding, k, fetch_k,
+                                                            lambda_mult, **kwargs)
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        if self.metric == "ip":
+            return self._max_inner_product_relevance_score_fn
+        return self._euclidean_relevance_score_fn
+
+    def add_documents(self, documents: List[Document], **kwargs: Any) -> List[str]:
+        """Embeds the documents into a new shard, without modifying the existing ones."""
+        vector_db = FAISS.from_documents(documents, self.embeddings)
+        if self.index_options is not None:
+            apply_index_type(vector_db, self.index_options)
+        name = add_shard(self.directory, vector_db)
+        self.shards.append(_Shard(os.path.join(self.directory, name),
+                                  int(vector_db.index.ntotal)))
+        return list(vector_db.index_to_docstore_id.values())
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        return self.add_documents([Document(page_content=text, metadata=metadata)
+                                   for text, metadata in zip(texts, metadatas)])
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[dict]] = None, **kwargs: Any) -> "ShardedVectorStore":
+        """
+        Builds a sharded database of the texts, see ``build_sharded_vector_db``.
+
+        Keyword arguments: directory (defaults to a temporary directory removed when the
+        process exits), num_shards (defaults to the number of CPUs), by, index_options
+        and max_processes.
+        """
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata)
+                     for text, metadata in zip(texts, metadatas)]
+        return build_sharded_vector_db(
+            documents,
+            embedding,
+            kwargs.get("directory") or temporary_shard_directory(),
+            kwargs.get("num_shards") or os.cpu_count() or 1,
+            kwargs.get("by", DEFAULT_SHARD_BY),
+            kwargs.get("index_options"),
+            kwargs.get("max_processes", 0)
+        )
+
+    def close(self) -> None:
+        """Stops the search processes and closes the shard docstores."""
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False, cancel_futures=True)
+                self._pool = None
+        for shard in self.shards:
+            shard.docstore.close()
+
+
+def build_sharded_vector_db(
+    chunks: Iterable[Document],
+    embeddings: Embeddings,
+    directory: str,
+    num_shards: int,
+    by: str = DEFAULT_SHARD_BY,
+    index_options: Optional[IndexOptions] = None,
+    max_processes: int = 0
+) -> ShardedVectorStore:
+    """
+    Builds a sharded vector database, one shard at a time.
+
+    Args:
+        chunks (Iterable[Document]): Chunks to index.
+        embeddings (Embeddings): Embeddings used to vectorize chunks and queries.
+        directory (str): Directory of the database, which must not contain one yet.
+        num_shards (int): Number of shards. Empty shards are not created.
+        by (str): Shard assignment, "source" or "hash" (see shard_of).
+        index_options (Optional[IndexOptions]): Type and parameters of each shard index.
+        max_processes (int): Search processes, 0 for one per shard up to the CPU count.
+
+    Returns:
+        ShardedVectorStore: The database.
+    """
+    if num_shards <= 0:
+        raise ValueError("num_shards must be a positive integer")
+    if read_manifest(directory) is not None:
+        raise ValueError(f"{directory} already contains a sharded database")
+    partitions: List[List[Document]] = [[] for _ in range(num_shards)]
+    for chunk in chunks:
+        partitions[shard_of(chunk, num_shards, by)].append(chunk)
+    for number, partition in enumerate(partitions):
+        if not partition:
+            continue
+        with span("shard_build", shard=number, chunks=len(partition)):
+            vector_db = FAISS.from_documents(partition, embeddings)
+            if index_options is not None:
+                apply_index_type(vector_db, index_options)
+            add_shard(directory, vector_db)
+    if read_manifest(directory) is None:
+        raise ValueError("No chunks to index")
+    return ShardedVectorStore(directory, embeddings, index_options, max_processes)
+
+
+def temporary_shard_directory() -> str:
+    """Returns a directory for shards that are not cached, removed when the process exits."""
+    directory = tempfile.mkdtemp(prefix="shards.")
+    atexit.register(shutil.rmtree, directory, ignore_errors=True)
+    return directory
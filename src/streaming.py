@@ -0,0 +1,278 @@
+"""
+src/streaming.py
+
+This module implements the streaming ingestion mode. Instead of parsing the whole
+corpus, then chunking it and only then building the index, the work flows through
+a pipeline of stages connected by bounded queues:
+
+    parse (PDF documents) -> chunk (and dedup) -> embed (batches) -> index (add_embeddings)
+
+Each stage runs in its own thread, so embedding overlaps with parsing, and the
+bounded queues keep the memory used independent of the corpus size.
+"""
+import dataclasses
+import logging
+import queue
+import threading
+import time
+from typing import Iterable, List, Optional, Tuple
+
+from langchain_community.vectorstores import FAISS
+from langchain_core.embeddings import Embeddings
+
+from src.chunking import split_text
+from src.dedup import ChunkDeduplicator
+from src.ingestion import iter_pdfs
+from src.settings import DEFAULT_PDF_BACKEND, DEFAULT_STREAM_QUEUE_SIZE
+from src.tracing import propagate, span
+
+# Marks the end of a stage's output
+_DONE = object()
+
+
+@dataclasses.dataclass
+class StageStats:
+    """Represents the work done by a pipeline stage."""
+    busy_seconds: float = 0.0
+    items: int = 0
+
+
+class _PipelineAborted(Exception):
+    """Raised in a stage when another stage has failed."""
+
+
+def _put(target: queue.Queue, item, stop: threading.Event) -> None:
+    """Puts an item in a bounded queue without blocking forever if the pipeline stops."""
+    while True:
+        if stop.is_set():
+            raise _PipelineAborted()
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+
+def _get(source: queue.Queue, stop: threading.Event):
+    """Gets an item from a queue without blocking forever if the pipeline stops."""
+    while True:
+        if stop.is_set():
+            raise _PipelineAborted()
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+
+
+class StreamingIngestion:
+    """Streaming pipeline building a FAISS vector database from PDF files."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        chunk_size: int,
+        chunk_overlap: int,
+        batch_size: int,
+        queue_size: int = DEFAULT_STREAM_QUEUE_SIZE,
+        max_workers: Optional[int] = None,
+        pdf_backend: str = DEFAULT_PDF_BACKEND,
+        deduplicator: Optional[ChunkDeduplicator] = None
+    ):
+        if batch_size <= 0:
+            raise ValueError("batch_size must be a positive integer")
+        if queue_size <= 0:
+            raise ValueError("queue_size must be a positive integer")
+        self.embeddings = embeddings
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self.max_workers = max_workers
+        self.pdf_backend = pdf_backend
+        self.deduplicator = deduplicator
+        self.stats = {name: StageStats() for name in ("parse", "chunk", "embed", "index")}
+        self.failed: List[str] = []
+        self._stop = threading.Event()
+        self._errors: List[BaseException] = []
+
+    def _run_stage(self, name: str, target, *args) -> threading.Thread:
+        def runner():
+            try:
+                target(*args)
+            except _PipelineAborted:
+                pass
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                logging.error("Streaming stage %s failed: %s", name, e)
+                self._errors.append(e)
+                self._stop.set()
+
+        # propagate nests the spans of the stage under the span that runs the pipeline
+        thread = threading.Thread(target=propagate(runner), name=f"ingestion-{name}",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def _parse(self, pdf_files: List[str], output: queue.Queue) -> None:
+        stats = self.stats["parse"]
+        documents_iter = iter_pdfs(pdf_files, self.max_workers, self.pdf_backend)
+        while True:
+            start = time.perf_counter()
+            item = next(documents_iter, None)
+            stats.busy_seconds += time.perf_counter() - start
+            if item is None:
+                break
+            file_path, documents = item
+            if documents is None:
+                logging.warning("Skipping PDF that could not be loaded: %s", file_path)
+                self.failed.append(file_path)
+                continue
+            stats.items += len(documents)
+            _put(output, documents, self._stop)
+        _put(output, _DONE, self._stop)
+
+    def _chunk(self, source: queue.Queue, output: queue.Queue) -> None:
+        stats = self.stats["chunk"]
+        while True:
+            documents = _get(source, self._stop)
+            if documents is _DONE:
+                break
+            start = time.perf_counter()
+            with span("chunking", documents=len(documents)):
+                chunks = split_text(documents, self.chunk_size, self.chunk_overlap)
+            if chunks and self.deduplicator is not None:
+                with span("dedup", chunks=len(chunks)):
+                    chunks = self.deduplicator.filter(chunks)
+            stats.busy_seconds += time.perf_counter() - start
+            if not chunks:
+                continue
+            stats.items += len(chunks)
+            _put(output, chunks, self._stop)
+        _put(output, _DONE, self._stop)
+
+    def _embed(self, source: queue.Queue, output: queue.Queue) -> None:
+        stats = self.stats["embed"]
+        pending = []
+        done = False
+        while not done:
+            chunks = _get(source, self._stop)
+            if chunks is _DONE:
+                done = True
+            else:
+                pending.extend(chunks)
+            while len(pending) >= self.batch_size or (done and pending):
+                batch, pending = pending[:self.batch_size], pending[self.batch_size:]
+                texts = [chunk.page_content for chunk in batch]
+                start = time.perf_counter()
+                vectors = self.embeddings.embed_documents(texts)
+                stats.busy_seconds += time.perf_counter() - start
+                stats.items += 1
+                metadatas = [chunk.metadata for chunk in batch]
+                _put(output, (list(zip(texts, vectors)), metadatas), self._stop)
+        _put(output, _DONE, self._stop)
+
+    def _index(self, source: queue.Queue) -> Optional[FAISS]:
+        stats = self.stats["index"]
+        vector_db = None
+        while True:
+            batch = _get(source, self._stop)
+            if batch is _DONE:
+                return vector_db
+            text_embeddings, metadatas = batch
+            start = time.perf_counter()
+            with span("index_add", vectors=len(text_embeddings)):
+                if vector_db is None:
+                    vector_db = FAISS.from_embeddings(text_embeddings, self.embeddings,
+                                                      metadatas)
+                else:
+                    vector_db.add_embeddings(text_embeddings, metadatas)
+            stats.busy_seconds += time.perf_counter() - start
+            stats.items += len(text_embeddings)
+
+    def run(self, pdf_files: List[str]) -> Optional[FAISS]:
+        """
+        Runs the pipeline over the given PDF files.
+
+        Args:
+            pdf_files (List[str]): Paths of the PDF files.
+
+        Returns:
+            FAISS: The vector database, None if no chunk was produced.
+
+        Raises:
+            Exception: The first error raised by any of the stages.
+        """
+        pages: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        chunks: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        batches: queue.Queue = queue.Queue(maxsize=self.queue_size)
+        threads = [
+            self._run_stage("parse", self._parse, pdf_files, pages),
+            self._run_stage("chunk", self._chunk, pages, chunks),
+            self._run_stage("embed", self._embed, chunks, batches),
+        ]
+        try:
+            vector_db = self._index(batches)
+        except _PipelineAborted:
+            vector_db = None
+        except BaseException:
+            self._stop.set()
+            raise
+        finally:
+            for thread in threads:
+                thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return vector_db
+
+    def stats_summary(self) -> dict:
+        """Returns the busy time and item count of each stage, for performance_data."""
+        summary = {}
+        for name, stats in self.stats.items():
+            summary[f"stream_{name}_seconds"] = stats.busy_seconds
+        summary["stream_documents"] = self.stats["parse"].items
+        summary["stream_chunks"] = self.stats["chunk"].items
+        summary["stream_embedding_batches"] = self.stats["embed"].items
+        return summary
+
+
+def stream_vector_db(
+    pdf_files: Iterable[str],
+    embeddings: Embeddings,
+    chunk_size: int,
+    chunk_overlap: int,
+    batch_size: int,
+    queue_size: int = DEFAULT_STREAM_QUEUE_SIZE,
+    max_workers: Optional[int] = None,
+    pdf_backend: str = DEFAULT_PDF_BACKEND,
+    deduplicator: Optional[ChunkDeduplicator] = None
+) -> Tuple[Optional[FAISS], dict, List[str]]:
+    """
+    Builds a FAISS vector database with the streaming ingestion pipeline.
+
+    Args:
+        pdf_files (Iterable[str]): Paths of the PDF files.
+        embeddings (Embeddings): Embeddings used to vectorize the chunks.
+        chunk_size (int): Maximum size of each chunk.
+        chunk_overlap (int): Overlap between consecutive chunks.
+        batch_size (int): Number of chunks embedded together.
+        queue_size (int): Capacity of the queues between the stages.
+        max_workers (Optional[int]): Number of PDF parsing processes.
+        pdf_backend (str): PDF extraction backend, see src.ingestion.load_pdf.
+        deduplicator (Optional[ChunkDeduplicator]): Drops duplicate and near-duplicate
+            chunks before they are embedded.
+
+    Returns:
+        Tuple: The vector database (None if no chunk was produced), the stage
+        statistics and the paths of the PDF files that could not be loaded.
+    """
+    pipeline = StreamingIngestion(
+        embeddings, chunk_size, chunk_overlap, batch_size, queue_size, max_workers, pdf_backend,
+        deduplicator
+    )
+    vector_db = pipeline.run(list(pdf_files))
+    summary = pipeline.stats_summary()
+    logging.info(
+        "Streaming ingestion: %d documents, %d chunks, %d embedding batches",
+        summary["stream_documents"], summary["stream_chunks"],
+        summary["stream_embedding_batches"]
+    )
+    return vector_db, summary, pipeline.failed
@@ -0,0 +1,277 @@
+"""
+src/tracing.py
+
+This module implements a lightweight tracer of nested spans timed with
+time.perf_counter. A span opened while no other span is active starts a new trace,
+so a run of main.py is one trace with a span per step, and each query answered by
+the query server is a trace of its own.
+
+The current span is kept in a context variable. Code that hands work to a thread
+pool wraps the callable with ``propagate`` so that the spans opened in the worker
+threads are nested under the span that submitted the work.
+
+Finished traces are passed to the registered exporters (for example
+``JsonLinesExporter``), and every span duration is aggregated into histograms that
+``Tracer.prometheus_text`` renders in the Prometheus text exposition format.
+"""
+import contextlib
+import contextvars
+import dataclasses
+import functools
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Upper bounds, in seconds, of the span duration histogram buckets
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                   60.0, 120.0, 300.0)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_span_ids = itertools.count(1)
+
+
+@dataclasses.dataclass
+class Span:
+    """Represents a timed operation, possibly nested in another one."""
+    name: str
+    span_id: int
+    trace_id: int
+    parent_id: Optional[int]
+    start: float
+    end: Optional[float] = None
+    attributes: Dict[str, Any] = dataclasses.field(default_factory=dict)
+    thread: str = ""
+    error: Optional[str] = None
+
+    @property
+    def duration(self) -> float:
+        """Duration of the span in seconds, up to now if it has not ended."""
+        end = self.end if self.end is not None else time.perf_counter()
+        return end - self.start
+
+    def set(self, **attributes) -> None:
+        """Adds attributes to the span."""
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Returns the span as a JSON-serializable dict."""
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "trace_id": self.trace_id,
+            "parent_id": self.parent_id,
+            "start": self.start,
+            "duration_seconds": self.duration,
+            "thread": self.thread,
+            "error": self.error,
+            "attributes": self.attributes,
+        }
+
+
+class JsonLinesExporter:
+    """Appends the spans of each finished trace to a JSON lines file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def __call__(self, spans: List[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with self._lock, open(self.path, "a", encoding="utf-8") as file:
+            file.write(lines)
+
+
+class Tracer:
+    """Collects spans, exports finished traces and aggregates span durations."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.exporters: List[Callable[[List[Span]], None]] = []
+        self._traces: Dict[int, List[Span]] = {}
+        self._histograms: Dict[str, List[float]] = {}
+        self._lock = threading.Lock()
+
+    def add_exporter(self, exporter: Callable[[List[Span]], None]) -> None:
+        """Registers a callable receiving the spans of every finished trace."""
+        self.exporters.append(exporter)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes) -> Span:
+        """
+        Starts a span without making it the current one.
+
+        Args:
+            name (str): Name of the span.
+            parent (Optional[Span]): Parent span. Defaults to the current span; without
+                one, the span starts a new trace.
+            **attributes: Attributes of the span.
+
+        Returns:
+            Span: The started span, to be passed to end_span.
+        """
+        if parent is None:
+            parent = _current_span.get()
+        span_id = next(_span_ids)
+        new_span = Span(
+            name=name,
+            span_id=span_id,
+            trace_id=parent.trace_id if parent is not None else span_id,
+            parent_id=parent.span_id if parent is not None else None,
+            start=time.perf_counter(),
+            attributes=attributes,
+            thread=threading.current_thread().name,
+        )
+        with self._lock:
+            self._traces.setdefault(new_span.trace_id, [])
+        return new_span
+
+    def end_span(self, ended_span: Span, end: Optional[float] = None) -> None:
+        """Ends a span. Ending the root span of a trace exports the whole trace."""
+        ended_span.end = end if end is not None else time.perf_counter()
+        finished = None
+        with self._lock:
+            self._observe(ended_span.name, ended_span.duration)
+            spans = self._traces.get(ended_span.trace_id)
+            if spans is not None:
+                spans.append(ended_span)
+            if ended_span.parent_id is None:
+                finished = self._traces.pop(ended_span.trace_id, None)
+        if finished:
+            for exporter in self.exporters:
+                try:
+                    exporter(finished)
+                except Exception as e:
+                    logging.warning("Error exporting trace %s: %s", ended_span.trace_id, e)
+
+    def record(self, name: str, start: float, end: float, parent: Optional[Span] = None,
+               **attributes) -> Span:
+        """Records an already finished span from perf_counter timestamps."""
+        recorded_span = self.start_span(name, parent, **attributes)
+        recorded_span.start = start
+        self.end_span(recorded_span, end)
+        return recorded_span
+
+    @contextlib.contextmanager
+    def activate(self, active_span: Span) -> Iterator[Span]:
+        """Makes a started span the current one inside the block, without ending it."""
+        token = _current_span.set(active_span)
+        try:
+            yield active_span
+        finally:
+            _current_span.reset(token)
+
+    @contextlib.contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Span]:
+        """Times the block as a span nested in the current one."""
+        block_span = self.start_span(name, **attributes)
+        token = _current_span.set(block_span)
+        try:
+            yield block_span
+        except BaseException as e:
+            block_span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            self.end_span(block_span)
+
+    def trace_spans(self, trace_id: int) -> List[Span]:
+        """Returns the finished spans of a trace that is still running."""
+        with self._lock:
+            return list(self._traces.get(trace_id, ()))
+
+    def children(self, parent_span: Span) -> List[Span]:
+        """Returns the finished direct children of a span that is still running."""
+        return [child for child in self.trace_spans(parent_span.trace_id)
+                if child.parent_id == parent_span.span_id]
+
+    def child_durations(self, parent_span: Span) -> Dict[str, float]:
+        """Returns the total duration of the finished direct children of a span, by name."""
+        durations: Dict[str, float] = {}
+        for child in self.children(parent_span):
+            durations[child.name] = durations.get(child.name, 0.0) + child.duration
+        return durations
+
+    def _observe(self, name: str, duration: float) -> None:
+        # counts per bucket, then +Inf count and sum
+        histogram = self._histograms.setdefault(name, [0] * (len(self.buckets) + 1) + [0.0])
+        for position, bound in enumerate(self.buckets):
+            if duration <= bound:
+                histogram[position] += 1
+        histogram[len(self.buckets)] += 1
+        histogram[-1] += duration
+
+    def prometheus_text(self, metric: str = "rag_span_duration_seconds") -> str:
+        """Returns the span duration histograms in the Prometheus text format."""
+        lines = [
+            f"# HELP {metric} Duration of the traced operations.",
+            f"# TYPE {metric} histogram",
+        ]
+        with self._lock:
+            histograms = {name: list(values) for name, values in self._histograms.items()}
+        for name in sorted(histograms):
+            histogram = histograms[name]
+            label = name.replace("\\", "\\\\").replace('"', '\\"')
+            for position, bound in enumerate(self.buckets):
+                lines.append(f'{metric}_bucket{{span="{label}",le="{bound:g}"}} '
+                             f'{histogram[position]}')
+            count = histogram[len(self.buckets)]
+            lines.append(f'{metric}_bucket{{span="{label}",le="+Inf"}} {count}')
+            lines.append(f'{metric}_sum{{span="{label}"}} {histogram[-1]:.6f}')
+            lines.append(f'{metric}_count{{span="{label}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+# Tracer shared by the whole pipeline
+tracer = Tracer()
+
+
+def span(name: str, **attributes):
+    """Times the block as a span of the pipeline tracer."""
+    return tracer.span(name, **attributes)
+
+
+def current_span() -> Optional[Span]:
+    """Returns the active span, None outside of any span."""
+    return _current_span.get()
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    Decorator timing every call of a function as a span, named after the function
+    unless a name is given.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name) as function_span:
+                result = func(*args, **kwargs)
+            logging.info('Function %s took %4f seconds to execute.',
+                         span_name, function_span.duration)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def propagate(func: Callable) -> Callable:
+    """
+    Binds a callable to the current context, so that the spans it opens in another
+    thread are nested under the current span. Each call runs in its own copy of the
+    context, so the result can be used with executor.map.
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
@@ -2,7 +2,6 @@ import sys
 import subprocess
 import platform
 from typing import Dict
-import psutil
 
 from src.data import SystemInfo
 
@@ -15,14 +14,19 @@ def obtener_info_equipo() -> SystemInfo:
         SystemInfo: Un objeto que contiene la información del sistema.
 
     """
+    # psutil solo se importa al recoger la información del equipo
+    import psutil
+
     # Detectar el sistema operativo y arquitectura
     sistema = platform.system()
     arquitectura = platform.machine()
 
+    # Una sola consulta del disco para los tres valores
+    uso_disco = psutil.disk_usage('/')
     disk_space_gb: Dict[str, float] = {
-        "Total": round(psutil.disk_usage('/').total / (1024**3), 2),
-        "Usado": round(psutil.disk_usage('/').used / (1024**3), 2),
-        "Libre": round(psutil.disk_usage('/').free / (1024**3), 2)
+        "Total": round(uso_disco.total / (1024**3), 2),
+        "Usado": round(uso_disco.used / (1024**3), 2),
+        "Libre": round(uso_disco.free / (1024**3), 2)
     }
 
     info_equipo = SystemInfo(
@@ -1,35 +1,170 @@
 import logging
-from typing import List
+import os
+import shutil
+import tempfile
+from typing import Dict, List, Optional, Sequence, Tuple, Union
 
 import ollama
 from langchain_core.documents import Document
-from langchain_ollama import OllamaEmbeddings
+from langchain_core.embeddings import Embeddings
 from langchain_community.vectorstores import FAISS
 
-def setup_vector_db(chunks: List[Document], embedding_model: str):
+from src.dedup import ChunkDeduplicator
+from src.embedding_cache import CachedEmbeddings, EmbeddingStore
+from src.embedding_engine import BatchedOllamaEmbeddings
+from src.faiss_index import IndexOptions, apply_index_type, configure_search
+from src.incremental_index import IndexUpdate, apply_update
+from src.index_cache import LEXICAL_INDEX_FILE, load_index, save_index
+from src.lexical_index import LexicalIndex
+from src.mmap_store import read_index
+from src.ollama_client import ensure_model
+from src.sharded_index import (
+    ShardedVectorStore,
+    build_sharded_vector_db,
+    read_manifest,
+    temporary_shard_directory,
+)
+from src.settings import (
+    DEFAULT_EMBED_BATCH_SIZE,
+    DEFAULT_EMBED_MAX_IN_FLIGHT,
+    DEFAULT_EMBED_MAX_RETRIES,
+    DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+    DEFAULT_PDF_BACKEND,
+    DEFAULT_SHARD_BY,
+    DEFAULT_STREAM_QUEUE_SIZE,
+)
+from src.streaming import stream_vector_db
+from src.tracing import span
+
+def build_embeddings(embedding_model: str, cache_path: Optional[str] = None,
+                     cache_max_entries: int = DEFAULT_EMBEDDING_CACHE_MAX_ENTRIES,
+                     batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+                     max_in_flight: int = DEFAULT_EMBED_MAX_IN_FLIGHT,
+                     max_retries: int = DEFAULT_EMBED_MAX_RETRIES,
+                     client: Optional[ollama.Client] = None,
+                     keep_alive: Union[str, int, None] = None) -> Embeddings:
+    """
+    Creates the embeddings used to vectorize chunks and queries.
+
+    Args:
+        embedding_model (str): Name of the Ollama model for generating embeddings.
+        cache_path (Optional[str]): Path of the chunk embedding cache, None to disable it.
+        cache_max_entries (int): Maximum number of vectors kept in the cache.
+        batch_size (int): Number of chunks sent to Ollama in each request.
+        max_in_flight (int): Maximum number of concurrent embedding requests.
+        max_retries (int): Number of retries of a failed embedding request.
+        client (Optional[ollama.Client]): Shared Ollama client, see src/ollama_client.py.
+            Defaults to a client of its own.
+        keep_alive (Union[str, int, None]): How long Ollama keeps the model loaded after
+            each request. Defaults to the Ollama setting.
+
+    Returns:
+        Embeddings: BatchedOllamaEmbeddings, wrapped by the chunk embedding cache if enabled.
     """
-    Configures a vector database using FAISS and OllamaEmbeddings, storing it in memory.
+    embeddings = BatchedOllamaEmbeddings(
+        embedding_model,
+        batch_size=batch_size,
+        max_in_flight=max_in_flight,
+        max_retries=max_retries,
+        client=client,
+        keep_alive=keep_alive
+    )
+    if cache_path:
+        store = EmbeddingStore(cache_path, cache_max_entries)
+        embeddings = CachedEmbeddings(embeddings, embedding_model, store)
+    return embeddings
 
-    This function creates a new FAISS vector database in memory.
+def _load_cached_vector_db(cache_dir: Optional[str], cache_key: Optional[str],
+                           embeddings: Embeddings,
+                           index_options: IndexOptions) -> Optional[FAISS]:
+    """Loads the vector database from the index cache, None on a miss or if disabled."""
+    if not (cache_dir and cache_key):
+        return None
+    vector_db = load_index(cache_dir, cache_key, embeddings)
+    if vector_db is None:
+        logging.info("Index cache miss (key %s), building the vector database", cache_key)
+        return None
+    configure_search(vector_db.index, index_options)
+    logging.info("FAISS vector database loaded from cache (key %s)", cache_key)
+    return vector_db
+
+def _load_cached_sharded_vector_db(entry_dir: str, embeddings: Embeddings,
+                                   index_options: IndexOptions,
+                                   search_processes: int) -> Optional[ShardedVectorStore]:
+    """Opens a cached sharded vector database, None if there is none or it is unreadable."""
+    try:
+        if read_manifest(entry_dir) is None:
+            return None
+        vector_db = ShardedVectorStore(entry_dir, embeddings, index_options, search_processes)
+        # The search processes read the shards lazily: check them now, memory-mapped
+        for shard in vector_db.shards:
+            if read_index(shard.index_path).ntotal != shard.size:
+                raise ValueError(f"shard index {shard.index_path} does not match the manifest")
+        return vector_db
+    except Exception as e:
+        logging.warning("Ignoring unreadable index cache entry %s: %s", entry_dir, e)
+        return None
+
+def setup_vector_db(chunks: List[Document], embedding_model: str,
+                    cache_dir: Optional[str] = None, cache_key: Optional[str] = None,
+                    embeddings: Optional[Embeddings] = None,
+                    index_options: Optional[IndexOptions] = None,
+                    deduplicator: Optional[ChunkDeduplicator] = None):
+    """
+    Configures a vector database using FAISS and Ollama embeddings, storing it in memory.
+
+    When a cache directory and key are given, the vector database is loaded from the
+    persistent index cache if an entry for the key exists. Otherwise a new FAISS vector
+    database is created in memory and saved in the cache for the next runs.
+
+    The vectors are first added to an exact flat index, which is then converted to the
+    configured index type when there are enough vectors to train it.
 
     Args:
         chunks (List[Document]): List of document chunks.
         embedding_model (str): Name of the Ollama model for generating embeddings.
-        collection_name (str): Name of the collection in the vector database.
+        cache_dir (Optional[str]): Root directory of the index cache, None to disable it.
+        cache_key (Optional[str]): Key of the corpus in the index cache.
+        embeddings (Optional[Embeddings]): Embeddings to use, see ``build_embeddings``.
+            Defaults to the batched Ollama embeddings without chunk embedding cache.
+        index_options (Optional[IndexOptions]): Type and parameters of the FAISS index.
+            Defaults to an exact flat index.
+        deduplicator (Optional[ChunkDeduplicator]): Drops duplicate and near-duplicate
+            chunks before they are embedded. None embeds every chunk.
 
     Returns:
         FAISS: Instance of the configured vector database.
         None: If an error occurs during configuration.
     """
     try:
-        # Download the embedding model from Ollama
-        ollama.pull(embedding_model)
-
         # Create embeddings using Ollama
-        embeddings = OllamaEmbeddings(model=embedding_model)
+        if embeddings is None:
+            embeddings = build_embeddings(embedding_model)
+        if index_options is None:
+            index_options = IndexOptions()
+
+        vector_db = _load_cached_vector_db(cache_dir, cache_key, embeddings, index_options)
+        if vector_db is not None:
+            return vector_db
+        if not chunks:
+            logging.error("No chunks to build the FAISS vector database")
+            return None
+        use_cache = bool(cache_dir and cache_key)
+
+        # Download the embedding model from Ollama, unless it is already there
+        ensure_model(embedding_model)
+
+        if deduplicator is not None:
+            with span("dedup", chunks=len(chunks)) as dedup_span:
+                chunks = deduplicator.filter(chunks)
+                dedup_span.set(kept=len(chunks))
 
         # Create a FAISS vector store from the document chunks
         vector_db = FAISS.from_documents(documents=chunks, embedding=embeddings)
+        apply_index_type(vector_db, index_options)
+
+        if use_cache:
+            save_index(vector_db, cache_dir, cache_key)
 
         logging.info("FAISS vector database configured correctly (in memory)")
         return vector_db
@@ -37,3 +172,226 @@ def setup_vector_db(chunks: List[Document], embedding_model: str):
     except Exception as e:
         logging.error("Error configuring the FAISS vector database: %s", e)
         return None
+
+def setup_vector_db_streaming(pdf_files: List[str], embedding_model: str, chunk_size: int,
+                              chunk_overlap: int, embeddings: Embeddings, batch_size: int,
+                              cache_dir: Optional[str] = None, cache_key: Optional[str] = None,
+                              queue_size: int = DEFAULT_STREAM_QUEUE_SIZE,
+                              max_workers: Optional[int] = None,
+                              pdf_backend: str = DEFAULT_PDF_BACKEND,
+                              index_options: Optional[IndexOptions] = None,
+                              deduplicator: Optional[ChunkDeduplicator] = None
+                              ) -> Tuple[Optional[FAISS], Dict[str, float]]:
+    """
+    Configures a FAISS vector database with the streaming ingestion pipeline.
+
+    The PDFs are parsed, chunked, embedded and added to the index in overlapping stages
+    (see src/streaming.py). As with setup_vector_db, the index is loaded from the index
+    cache when an entry for the key exists. It is only saved in the cache when every
+    PDF was loaded, so that a transient parsing error is not cached.
+
+    Args:
+        pdf_files (List[str]): Paths of the PDF files.
+        embedding_model (str): Name of the Ollama model for generating embeddings.
+        chunk_size (int): Maximum size of each chunk.
+        chunk_overlap (int): Overlap between consecutive chunks.
+        embeddings (Embeddings): Embeddings to use, see ``build_embeddings``.
+        batch_size (int): Number of chunks embedded together.
+        cache_dir (Optional[str]): Root directory of the index cache, None to disable it.
+        cache_key (Optional[str]): Key of the corpus in the index cache.
+        queue_size (int): Capacity of the queues between the pipeline stages.
+        max_workers (Optional[int]): Number of PDF parsing processes.
+        pdf_backend (str): PDF extraction backend, see src.ingestion.load_pdf.
+        index_options (Optional[IndexOptions]): Type and parameters of the FAISS index.
+            Defaults to an exact flat index.
+        deduplicator (Optional[ChunkDeduplicator]): Drops duplicate and near-duplicate
+            chunks between the chunking and embedding stages. None embeds every chunk.
+
+    Returns:
+        Tuple: The vector database (None if an error occurs) and the statistics of
+        the pipeline stages.
+    """
+    try:
+        if index_options is None:
+            index_options = IndexOptions()
+
+        vector_db = _load_cached_vector_db(cache_dir, cache_key, embeddings, index_options)
+        if vector_db is not None:
+            return vector_db, {}
+        use_cache = bool(cache_dir and cache_key)
+
+        # Download the embedding model from Ollama, unless it is already there
+        ensure_model(embedding_model)
+
+        vector_db, stats, failed = stream_vector_db(
+            pdf_files, embeddings, chunk_size, chunk_overlap, batch_size, queue_size,
+            max_workers, pdf_backend, deduplicator
+        )
+        stats["pdf_files_loaded"] = len(pdf_files) - len(failed)
+        stats["pdf_files_failed"] = len(failed)
+        if vector_db is None:
+            logging.error("The streaming ingestion produced no chunks")
+            return None, stats
+        apply_index_type(vector_db, index_options)
+
+        if use_cache and not failed:
+            save_index(vector_db, cache_dir, cache_key)
+
+        logging.info("FAISS vector database configured correctly (streaming)")
+        return vector_db, stats
+
+    except Exception as e:
+        logging.error("Error configuring the FAISS vector database: %s", e)
+        return None, {}
+
+def setup_sharded_vector_db(chunks: List[Document], embedding_model: str, num_shards: int,
+                            shard_by: str = DEFAULT_SHARD_BY,
+                            cache_dir: Optional[str] = None, cache_key: Optional[str] = None,
+                            embeddings: Optional[Embeddings] = None,
+                            index_options: Optional[IndexOptions] = None,
+                            deduplicator: Optional[ChunkDeduplicator] = None,
+                            search_processes: int = 0) -> Optional[ShardedVectorStore]:
+    """
+    Configures a vector database partitioned into shards (see src/sharded_index.py).
+
+    The shards are built one after the other and saved in the index cache entry of the
+    key, next to the lexical index, so that later runs open them without embedding
+    anything. Without an index cache they are saved in a temporary directory, since
+    the search processes open them from disk.
+
+    Args:
+        chunks (List[Document]): List of document chunks.
+        embedding_model (str): Name of the Ollama model for generating embeddings.
+        num_shards (int): Number of shards.
+        shard_by (str): Shard assignment of the chunks, "source" or "hash".
+        cache_dir (Optional[str]): Root directory of the index cache, None to disable it.
+        cache_key (Optional[str]): Key of the corpus in the index cache.
+        embeddings (Optional[Embeddings]): Embeddings to use, see ``build_embeddings``.
+        index_options (Optional[IndexOptions]): Type and parameters of each shard index.
+        deduplicator (Optional[ChunkDeduplicator]): Drops duplicate and near-duplicate
+            chunks before they are embedded. None embeds every chunk.
+        search_processes (int): Processes searching the shards, 0 for one per shard up
+            to the number of CPUs.
+
+    Returns:
+        ShardedVectorStore: The sharded vector database.
+        None: If an error occurs during configuration.
+    """
+    try:
+        if embeddings is None:
+            embeddings = build_embeddings(embedding_model)
+        if index_options is None:
+            index_options = IndexOptions()
+
+        use_cache = bool(cache_dir and cache_key)
+        if use_cache:
+            entry_dir = os.path.join(cache_dir, cache_key)
+            vector_db = _load_cached_sharded_vector_db(entry_dir, embeddings, index_options,
+                                                       search_processes)
+            if vector_db is not None:
+                logging.info("Sharded vector database loaded from cache (key %s)", cache_key)
+                return vector_db
+            logging.info("Index cache miss (key %s), building the sharded vector database",
+                         cache_key)
+        if not chunks:
+            logging.error("No chunks to build the sharded vector database")
+            return None
+
+        # Download the embedding model from Ollama, unless it is already there
+        ensure_model(embedding_model)
+
+        if deduplicator is not None:
+            with span("dedup", chunks=len(chunks)) as dedup_span:
+                chunks = deduplicator.filter(chunks)
+                dedup_span.set(kept=len(chunks))
+
+        if not use_cache:
+            vector_db = build_sharded_vector_db(
+                chunks, embeddings, temporary_shard_directory(), num_shards, shard_by,
+                index_options, search_processes
+            )
+            logging.info("Sharded vector database configured correctly (%d shards)",
+                         vector_db.num_shards)
+            return vector_db
+
+        # Built in a temporary directory and renamed, like the entries of save_index
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f".{cache_key}.", dir=cache_dir)
+        try:
+            vector_db = build_sharded_vector_db(
+                chunks, embeddings, tmp_dir, num_shards, shard_by, index_options
+            )
+            LexicalIndex.from_vector_db(vector_db).save(
+                os.path.join(tmp_dir, LEXICAL_INDEX_FILE))
+            vector_db.close()
+            if os.path.isdir(entry_dir):
+                shutil.rmtree(entry_dir)
+            os.replace(tmp_dir, entry_dir)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+        vector_db = ShardedVectorStore(entry_dir, embeddings, index_options, search_processes)
+        logging.info("Sharded vector database saved to cache %s (%d shards)",
+                     entry_dir, vector_db.num_shards)
+        return vector_db
+
+    except Exception as e:
+        logging.error("Error configuring the sharded vector database: %s", e)
+        return None
+
+def setup_incremental_vector_db(update: IndexUpdate, chunks: Sequence[Document],
+                                loaded_files: List[str], embedding_model: str,
+                                cache_dir: str, cache_key: str,
+                                embeddings: Optional[Embeddings] = None,
+                                index_options: Optional[IndexOptions] = None,
+                                deduplicator: Optional[ChunkDeduplicator] = None
+                                ) -> Tuple[Optional[FAISS], Dict[str, int]]:
+    """
+    Updates the cached vector database of a corpus with the PDFs that changed since its
+    previous version (see src/incremental_index.py), then opens it from the cache.
+
+    Args:
+        update (IndexUpdate): Changes of the corpus, see ``plan_update``.
+        chunks (Sequence[Document]): Chunks of update.files_to_parse.
+        loaded_files (List[str]): PDFs of update.files_to_parse that were loaded.
+        embedding_model (str): Name of the Ollama model for generating embeddings.
+        cache_dir (str): Root directory of the index cache.
+        cache_key (str): Key of the updated corpus in the index cache.
+        embeddings (Optional[Embeddings]): Embeddings to use, see ``build_embeddings``.
+        index_options (Optional[IndexOptions]): Type and parameters of the FAISS index.
+        deduplicator (Optional[ChunkDeduplicator]): Drops duplicate and near-duplicate
+            chunks before they are embedded. Only the chunks of the PDFs parsed again
+            are compared.
+
+    Returns:
+        Tuple: The vector database (None if an error occurs) and the counters of the
+        update.
+    """
+    try:
+        if embeddings is None:
+            embeddings = build_embeddings(embedding_model)
+        if index_options is None:
+            index_options = IndexOptions()
+
+        if chunks:
+            # Download the embedding model from Ollama, unless it is already there
+            ensure_model(embedding_model)
+        if deduplicator is not None and chunks:
+            with span("dedup", chunks=len(chunks)) as dedup_span:
+                chunks = deduplicator.filter(chunks)
+                dedup_span.set(kept=len(chunks))
+
+        with span("index_update", **update.stats()) as update_span:
+            stats = apply_update(update, chunks, loaded_files, embeddings, cache_dir,
+                                 cache_key, index_options)
+            update_span.set(**stats)
+        stats.update(update.stats())
+
+        vector_db = _load_cached_vector_db(cache_dir, cache_key, embeddings, index_options)
+        if vector_db is None:
+            logging.error("The updated vector database could not be opened (key %s)", cache_key)
+        return vector_db, stats
+
+    except Exception as e:
+        logging.error("Error updating the FAISS vector database: %s", e)
+        return None, {}